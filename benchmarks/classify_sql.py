@@ -0,0 +1,72 @@
+"""
+Compare the time taken to classify the statements of a large migration with
+the fast (cached) classifier against parsing each of them with sqlparse.
+
+    python benchmarks/classify_sql.py [operations]
+
+This does not need a database: only the classification of each statement
+is timed, not the lookups that follow it.
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from django.conf import settings  # NOQA
+
+if not settings.configured:
+    settings.configure(INSTALLED_APPS=[])
+
+import sqlparse  # NOQA
+
+from boardinghouse.backends.postgres import schema  # NOQA
+
+
+def migration_statements(operations):
+    """
+    The statements the schema editor would execute for a migration with
+    this many operations, in the shapes it uses.
+    """
+    statements = []
+    for i in range(operations):
+        table = '"app_model{0}"'.format(i % 50)
+        statements.extend([
+            'ALTER TABLE {0} ADD COLUMN "field{1}" integer DEFAULT 0 NOT NULL'.format(table, i),
+            'ALTER TABLE {0} ALTER COLUMN "field{1}" DROP DEFAULT'.format(table, i),
+            'CREATE INDEX "app_model_field{1}_idx" ON {0} ("field{1}")'.format(table, i),
+            'ALTER TABLE {0} ADD CONSTRAINT "field{1}_fk" FOREIGN KEY ("field{1}") '
+            'REFERENCES "app_other" ("id") DEFERRABLE INITIALLY DEFERRED'.format(table, i),
+            'UPDATE {0} SET "field{1}" = %s'.format(table, i),
+        ])
+    return statements
+
+
+def sqlparse_classify(statements):
+    for sql in statements:
+        [schema.classify_statement(statement) for statement in sqlparse.parse(sql)]
+
+
+def fast_classify(statements):
+    for sql in statements:
+        schema.classify_sql(sql)
+
+
+def main(operations=500, repeat=3):
+    statements = migration_statements(operations)
+    print('{0} operations, {1} statements'.format(operations, len(statements)))
+
+    results = [
+        ('sqlparse', lambda: sqlparse_classify(statements)),
+        ('fast (cold)', lambda: (schema._classified.clear(), fast_classify(statements))),
+        ('fast (warm)', lambda: fast_classify(statements)),
+    ]
+    for name, function in results:
+        best = min(timeit.repeat(function, number=1, repeat=repeat))
+        print('{0:>12}: {1:8.4f}s'.format(name, best))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,125 @@
+"""
+Time how long clone_schema() takes to create a new schema from a template,
+as the number of schemata in the database grows.
+
+    python benchmarks/clone_schema.py DSN [counts...]
+
+This should be pointed at an empty scratch database: it installs each
+version of the function under its own name, creates a template schema of
+``TABLES`` related tables, and then clones it until the database holds each
+of the given numbers of schemata (10, 100, 1000 and 10000 by default),
+timing a few clones at each step. Everything is dropped again at the end
+(and anything left behind by an interrupted run is dropped at the start).
+
+The version of clone_schema() from before 0.5.0 reads the parameters of each
+sequence from the sequence itself, which does not work with PostgreSQL 10 or
+later: on those servers it is reported as failing.
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import timeit
+
+import psycopg2
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'boardinghouse', 'sql')
+
+VERSIONS = [
+    ('003', 'clone_schema.003.sql'),
+    ('004', 'clone_schema.004.sql'),
+]
+
+TABLES = 20
+TEMPLATE = 'bench_template'
+SAMPLES = 3
+
+
+def install_functions(cursor):
+    for version, filename in VERSIONS:
+        with open(os.path.join(SQL_DIR, filename)) as fp:
+            cursor.execute(fp.read().replace('clone_schema(', 'clone_schema_{0}('.format(version)))
+
+
+def create_template(cursor):
+    cursor.execute('CREATE SCHEMA {0}'.format(TEMPLATE))
+    for i in range(TABLES):
+        cursor.execute(
+            'CREATE TABLE {schema}.table_{i} ('
+            '  id serial PRIMARY KEY,'
+            '  name varchar(64) NOT NULL UNIQUE,'
+            '  created timestamp with time zone DEFAULT now(),'
+            '  parent_id integer{references}'
+            ')'.format(
+                schema=TEMPLATE, i=i,
+                references=' REFERENCES {0}.table_{1} (id)'.format(TEMPLATE, i - 1) if i else '',
+            )
+        )
+        cursor.execute('CREATE INDEX table_{1}_created ON {0}.table_{1} (created)'.format(TEMPLATE, i))
+    cursor.execute('CREATE VIEW {0}.summary AS SELECT count(*) FROM {0}.table_0'.format(TEMPLATE))
+
+
+def clone(cursor, version, schema):
+    cursor.execute('SELECT clone_schema_{0}(%s, %s, false)'.format(version), [TEMPLATE, schema])
+
+
+def drop(cursor, schemata):
+    # One at a time, so as not to run out of locks.
+    for schema in schemata:
+        cursor.execute('DROP SCHEMA IF EXISTS {0} CASCADE'.format(schema))
+
+
+def leftovers(cursor):
+    cursor.execute("SELECT nspname FROM pg_namespace WHERE nspname LIKE 'bench\\_%'")
+    return [schema for schema, in cursor.fetchall()]
+
+
+def main(dsn, *counts):
+    counts = [int(count) for count in counts] or [10, 100, 1000, 10000]
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    cursor = connection.cursor()
+
+    drop(cursor, leftovers(cursor))
+    install_functions(cursor)
+    create_template(cursor)
+    failing = set()
+    schemata = []
+
+    print('{0:>8} {1}'.format('schemata', ' '.join('{0:>10}'.format(version) for version, filename in VERSIONS)))
+    try:
+        for count in counts:
+            while len(schemata) < count:
+                schemata.append('bench_{0:05d}'.format(len(schemata)))
+                clone(cursor, '004', schemata[-1])
+
+            results = []
+            for version, filename in VERSIONS:
+                if version in failing:
+                    results.append('failed')
+                    continue
+                samples = ['bench_sample_{0}'.format(i) for i in range(SAMPLES)]
+                try:
+                    best = min(
+                        timeit.timeit(lambda: clone(cursor, version, schema), number=1)
+                        for schema in samples
+                    )
+                except psycopg2.Error:
+                    failing.add(version)
+                    results.append('failed')
+                else:
+                    results.append('{0:9.4f}s'.format(best))
+                finally:
+                    drop(cursor, samples)
+            print('{0:>8} {1}'.format(count, ' '.join('{0:>10}'.format(result) for result in results)))
+    finally:
+        drop(cursor, schemata + [TEMPLATE])
+        for version, filename in VERSIONS:
+            cursor.execute('DROP FUNCTION IF EXISTS clone_schema_{0}(text, text)'.format(version))
+            cursor.execute('DROP FUNCTION IF EXISTS clone_schema_{0}(text, text, boolean)'.format(version))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    main(*sys.argv[1:])
@@ -0,0 +1,408 @@
+"""
+Time the operations that are affected by the number of tenants, or that are
+on every request's path, and write the results as JSON, so that they can be
+compared between releases.
+
+    DB_NAME=bench python benchmarks/suite.py [--counts 10,100,1000] [--output results.json]
+    DB_NAME=bench python benchmarks/suite.py --compare before.json [--tolerance 0.25]
+
+This uses the settings of the test suite (``tests.settings``, with the same
+``DB_NAME``, ``DB_USER`` and ``DB_PORT`` environment variables), and creates
+(and destroys again) its own test database on a local PostgreSQL server.
+
+These are timed:
+
+``middleware``
+    A request through :class:`boardinghouse.middleware.SchemaMiddleware` to
+    a view that does nothing: with the session's schema already active, with
+    requests from two sessions in turn, with lazy activation, and changing
+    schema with the ``X-Change-Schema`` header.
+
+``pool``
+    Requests from two sessions in turn, each closing the connection at the
+    end (as with the default ``CONN_MAX_AGE``), with and without
+    ``settings.BOARDINGHOUSE_CONNECTION_POOL_SIZE``. Each session is fetched
+    from the database before its schema is activated, as in a real request.
+
+``activate_schema``
+    Activating the schema that is already active, activating two schemata
+    in turn, and lazily activating them in turn.
+
+``clone_schema``
+    Creating a schema (which clones the template schema) when there are
+    each of ``--counts`` schemata.
+
+``migrate``
+    Adding (and removing) a column of a private table, which is done in
+    each of the schemata.
+
+``from_schemata``
+    Fetching the objects of a private model from the schemata, with
+    ``MultiSchemaMixin.from_schemata()``.
+
+``dumpdata`` and ``loaddata``
+    Dumping the objects of a private model in one schema, and loading them
+    into another, with the management commands.
+
+Each result is the best (and the median) of ``--repeat`` samples, in
+seconds per operation. With ``--compare``, the results are compared with
+those of an earlier run, and the exit status is 1 if any is slower by more
+than ``--tolerance``.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+
+import django  # NOQA
+
+django.setup()
+
+from django.apps import apps  # NOQA
+from django.contrib.auth.models import User  # NOQA
+from django.contrib.sessions.backends.db import SessionStore  # NOQA
+from django.core.management import call_command  # NOQA
+from django.db import connection, migrations, models  # NOQA
+from django.db.migrations.state import ProjectState  # NOQA
+from django.http import HttpResponse  # NOQA
+from django.test import RequestFactory, override_settings  # NOQA
+from django.utils import six  # NOQA
+
+from boardinghouse.backends.postgres.pool import connection_pool  # NOQA
+from boardinghouse.middleware import SchemaMiddleware  # NOQA
+from boardinghouse.models import Schema  # NOQA
+from boardinghouse.schema import activate_schema, deactivate_schema  # NOQA
+
+from tests.models import AwareModel  # NOQA
+
+# How many objects each schema holds, for from_schemata().
+ROWS_PER_SCHEMA = 10
+# How many schemata are created in each query while adding tenants.
+BATCH_SIZE = 50
+
+
+class Suite(object):
+    def __init__(self, counts, repeat, number, rows):
+        self.counts = counts
+        self.repeat = repeat
+        self.number = number
+        self.rows = rows
+        self.schemata = []
+        self.results = []
+
+    @property
+    def half(self):
+        # The number of calls to time when each does two operations.
+        return max(1, self.number // 2)
+
+    def time(self, benchmark, function, number=None, setup=None, calls=1, **params):
+        """
+        Time `function` (which does `calls` operations each time it is
+        called), and record the best and median seconds per operation.
+        """
+        number = number or self.number
+        samples = []
+        for i in range(self.repeat):
+            if setup:
+                setup()
+            samples.append(timeit.timeit(function, number=number) / (number * calls))
+        samples.sort()
+        result = {
+            'benchmark': benchmark,
+            'params': params,
+            'best': samples[0],
+            'median': samples[len(samples) // 2],
+            'samples': self.repeat,
+            'number': number * calls,
+        }
+        self.results.append(result)
+        print('{0:>16} {1:<40} {2:12.6f}s'.format(
+            benchmark, ', '.join('{0}={1}'.format(*item) for item in sorted(params.items())), result['best']
+        ), file=sys.stderr)
+        return result
+
+    def add_tenants(self, count):
+        """
+        Create schemata (each holding a few objects) until there are `count`.
+        """
+        while len(self.schemata) < count:
+            names = [
+                'bench_{0:05d}'.format(i)
+                for i in range(len(self.schemata), min(count, len(self.schemata) + BATCH_SIZE))
+            ]
+            created = Schema.objects.mass_create(*names)
+            for schema in created:
+                activate_schema(schema.schema)
+                AwareModel.objects.bulk_create([
+                    AwareModel(name='row{0}'.format(i)) for i in range(ROWS_PER_SCHEMA)
+                ])
+            self.schemata.extend(created)
+        deactivate_schema()
+
+    def run(self):
+        self.add_tenants(2)
+        self.middleware()
+        self.pool()
+        self.activate_schema()
+        self.dumpdata_loaddata()
+
+        for count in self.counts:
+            self.add_tenants(count)
+            self.clone_schema(count)
+            self.migrate(count)
+            self.from_schemata(count)
+
+        return self.results
+
+    def middleware(self):
+        user = User.objects.create_superuser(username='bench', password='bench', email='bench@example.com')
+        first, second = [schema.schema for schema in self.schemata[:2]]
+        factory = RequestFactory()
+        middleware = SchemaMiddleware(lambda request: HttpResponse())
+
+        def request(schema, **extra):
+            request = factory.get('/', **extra)
+            request.user = user
+            request.session = SessionStore()
+            request.session['schema'] = schema
+            return request
+
+        requests = [request(first), request(second)]
+        headers = [
+            request(first, HTTP_X_CHANGE_SCHEMA=second),
+            request(second, HTTP_X_CHANGE_SCHEMA=first),
+        ]
+
+        def alternate(requests):
+            def function():
+                for each in requests:
+                    middleware(each)
+                # Each header changes the session's schema, so change it back.
+                for each, schema in zip(requests, (first, second)):
+                    each.session['schema'] = schema
+            return function
+
+        self.time('middleware', lambda: middleware(requests[0]), mode='active')
+        self.time('middleware', alternate(requests), self.half, calls=2, mode='alternating')
+        with override_settings(BOARDINGHOUSE_LAZY_ACTIVATION=True):
+            self.time('middleware', alternate(requests), self.half, calls=2, mode='lazy')
+        self.time('middleware', alternate(headers), self.half, calls=2, mode='change')
+        deactivate_schema()
+        user.delete()
+
+    def pool(self):
+        user = User.objects.create_superuser(username='bench', password='bench', email='bench@example.com')
+        factory = RequestFactory()
+        middleware = SchemaMiddleware(lambda request: HttpResponse())
+        sessions = []
+        for schema in self.schemata[:2]:
+            session = SessionStore()
+            session['schema'] = schema.schema
+            session.save()
+            sessions.append(session.session_key)
+
+        def alternate():
+            for session_key in sessions:
+                request = factory.get('/')
+                request.user = user
+                request.session = SessionStore(session_key)
+                middleware(request)
+                connection.close()
+
+        connection.close()
+        self.time('pool', alternate, self.half, calls=2, mode='disabled')
+        with override_settings(BOARDINGHOUSE_CONNECTION_POOL_SIZE=2):
+            self.time('pool', alternate, self.half, calls=2, mode='enabled')
+            connection_pool.clear()
+        deactivate_schema()
+        user.delete()
+
+    def activate_schema(self):
+        first, second = [schema.schema for schema in self.schemata[:2]]
+
+        def alternate(lazy=False):
+            activate_schema(first, lazy=lazy)
+            activate_schema(second, lazy=lazy)
+
+        activate_schema(first)
+        self.time('activate_schema', lambda: activate_schema(first), mode='active')
+        self.time('activate_schema', alternate, self.half, calls=2, mode='alternating')
+        self.time('activate_schema', lambda: alternate(lazy=True), self.half, calls=2, mode='lazy')
+        deactivate_schema()
+
+    def clone_schema(self, count):
+        samples = iter(range(self.repeat))
+
+        def function():
+            name = 'bench_sample_{0}'.format(next(samples))
+            Schema.objects.create(name=name, schema=name)
+
+        try:
+            self.time('clone_schema', function, number=1, schemata=count)
+        finally:
+            Schema.objects.filter(schema__startswith='bench_sample_').delete(drop=True)
+
+    def migrate(self, count):
+        state = ProjectState.from_apps(apps)
+        operation = migrations.AddField('awaremodel', 'benchmark', models.IntegerField(default=0))
+        new_state = state.clone()
+        operation.state_forwards('tests', new_state)
+
+        def forwards():
+            with connection.schema_editor() as editor:
+                operation.database_forwards('tests', editor, state, new_state)
+
+        def backwards():
+            with connection.schema_editor() as editor:
+                operation.database_backwards('tests', editor, new_state, state)
+
+        applied = []
+
+        def function():
+            forwards()
+            applied.append(True)
+
+        def setup():
+            # Undo the sample before.
+            if applied:
+                backwards()
+                applied.pop()
+
+        try:
+            self.time('migrate', function, number=1, setup=setup, schemata=count)
+        finally:
+            setup()
+
+    def from_schemata(self, count):
+        schemata = self.schemata[:count]
+
+        def function():
+            list(AwareModel.objects.from_schemata(*schemata))
+
+        self.time('from_schemata', function, number=1, schemata=count)
+
+    def dumpdata_loaddata(self):
+        source, target = [schema.schema for schema in self.schemata[:2]]
+        activate_schema(source)
+        AwareModel.objects.bulk_create([
+            AwareModel(name='obj{0}'.format(i)) for i in range(self.rows)
+        ])
+        deactivate_schema()
+
+        fd, fixture = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            result = self.time('dumpdata', lambda: call_command(
+                'dumpdata', 'tests.awaremodel', schema=source, output=fixture, stdout=six.StringIO(),
+            ), number=1, rows=self.rows + ROWS_PER_SCHEMA)
+            result['objects_per_second'] = (self.rows + ROWS_PER_SCHEMA) / result['best']
+
+            def clear():
+                activate_schema(target)
+                AwareModel.objects.all().delete()
+                deactivate_schema()
+
+            result = self.time('loaddata', lambda: call_command(
+                'loaddata', fixture, schema=target, verbosity=0,
+            ), number=1, setup=clear, rows=self.rows + ROWS_PER_SCHEMA)
+            result['objects_per_second'] = (self.rows + ROWS_PER_SCHEMA) / result['best']
+        finally:
+            os.unlink(fixture)
+            deactivate_schema()
+
+
+def metadata(counts):
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.STDOUT
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'postgresql': connection.pg_version,
+        'counts': counts,
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+    }
+
+
+def key(result):
+    return result['benchmark'], tuple(sorted(result['params'].items()))
+
+
+def compare(results, previous, tolerance):
+    """
+    Print how long each result took compared with the same one in the
+    previous results, and return those that are slower by more than
+    `tolerance` (a fraction).
+    """
+    before = {key(result): result for result in previous['results']}
+    slower = []
+    for result in results:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        ratio = result['best'] / old['best']
+        print('{0:>16} {1:<40} {2:8.2f}x{3}'.format(
+            result['benchmark'],
+            ', '.join('{0}={1}'.format(*item) for item in sorted(result['params'].items())),
+            ratio,
+            '  SLOWER' if ratio > 1 + tolerance else '',
+        ))
+        if ratio > 1 + tolerance:
+            slower.append(result)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--counts', default='10,100,1000',
+                        help='The numbers of schemata to time the operations that depend on them with.')
+    parser.add_argument('--repeat', type=int, default=5, help='How many samples to take of each.')
+    parser.add_argument('--number', type=int, default=200,
+                        help='How many times to run the quicker operations in each sample.')
+    parser.add_argument('--rows', type=int, default=5000, help='How many objects dumpdata and loaddata handle.')
+    parser.add_argument('--output', help='Write the results as JSON to this file (or - for stdout).')
+    parser.add_argument('--compare', help='A file of earlier results to compare these with.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='How much slower than the earlier results is too slow (as a fraction).')
+    args = parser.parse_args()
+    counts = sorted(int(count) for count in args.counts.split(','))
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        results = Suite(counts, args.repeat, args.number, args.rows).run()
+        output = {'meta': metadata(counts), 'results': results}
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    if args.output == '-':
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        print()
+    elif args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(output, fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            previous = json.load(fp)
+        if compare(results, previous, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
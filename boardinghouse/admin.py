@@ -3,22 +3,57 @@
 """
 from __future__ import unicode_literals
 
+import django
 from django.contrib import admin
 from django.contrib.admin.models import LogEntry, LogEntryManager
 from django.db import models
 from django.db.models import expressions, Q
 from django.dispatch import receiver
+from django.template.defaultfilters import filesizeformat
 
 from .models import Schema
-from .schema import get_active_schema_name, get_schema_model, is_shared_model
+from .schema import find_schemata, get_active_schema_name, get_schema_model, is_shared_model
 from .signals import find_schema
+from .statistics import annotate as annotate_statistics
 
 
 class SchemaAdmin(admin.ModelAdmin):
     """
     The `ModelAdmin` for the schema class should protect the `schema`
     field, but only once the object has been saved.
+
+    The changelist also shows the most recently collected storage
+    statistics of each schema (see :mod:`boardinghouse.statistics`), with
+    Django 1.11 or later.
     """
+    list_display = ('__str__', 'is_active', 'total_size', 'row_estimate', 'statistics_collected')
+
+    def get_list_display(self, request):
+        # The statistics are annotated with subqueries, which need Django 1.11.
+        if django.VERSION < (1, 11):
+            return ('__str__', 'is_active')
+        return super(SchemaAdmin, self).get_list_display(request)
+
+    def get_queryset(self, request):
+        queryset = super(SchemaAdmin, self).get_queryset(request)
+        if django.VERSION < (1, 11):
+            return queryset
+        return annotate_statistics(queryset)
+
+    def total_size(self, obj):
+        if obj.total_size is not None:
+            return filesizeformat(obj.total_size)
+    total_size.admin_order_field = 'total_size'
+
+    def row_estimate(self, obj):
+        return obj.row_estimate
+    row_estimate.admin_order_field = 'row_estimate'
+    row_estimate.short_description = 'rows (estimated)'
+
+    def statistics_collected(self, obj):
+        return obj.statistics_collected
+    statistics_collected.admin_order_field = 'statistics_collected'
+
     def get_readonly_fields(self, request, obj=None):
         """
         Prevents `schema` from being editable once created.
@@ -93,12 +128,36 @@ if not getattr(LogEntry, 'object_schema', None):
     SchemaModel = get_schema_model()
 
     def object_schema(self):
+        if '_object_schema' in self.__dict__:
+            return self._object_schema
         for handler, response in find_schema.send(sender=None, schema=self.object_schema_id):
             if response:
                 return response
 
     LogEntry.object_schema = property(object_schema)
 
+    def prefetch_object_schemata(entries):
+        """
+        Find the schemata of all of the log entries at once, rather than as
+        the ``object_schema`` of each of them is used.
+        """
+        entries = list(entries)
+        found = find_schemata(entry.object_schema_id for entry in entries)
+        for entry in entries:
+            entry._object_schema = found.get(entry.object_schema_id)
+        return entries
+
+    history_view = admin.ModelAdmin.history_view
+
+    def history_view_with_schemata(self, request, object_id, extra_context=None):
+        response = history_view(self, request, object_id, extra_context)
+        context = getattr(response, 'context_data', None)
+        if context and 'action_list' in context:
+            context['action_list'] = prefetch_object_schemata(context['action_list'])
+        return response
+
+    admin.ModelAdmin.history_view = history_view_with_schemata
+
     def get_queryset(self):
         queryset = super(LogEntryManager, self).get_queryset()
 
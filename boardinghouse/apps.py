@@ -196,3 +196,19 @@ def check_installed_before_admin(app_configs=None, **kwargs):
             ))
 
     return errors
+
+
+@register('settings')
+def check_spare_prefix_starts_with_underscore(app_configs=None, **kwargs):
+    """Ensure that the prefix for spare schemata internal names starts with underscore.
+
+    A leading underscore is the trigger that the indicated schema is not a
+    "regular" schema, and spare schemata should never be activated.
+    """
+    from django.conf import settings
+
+    if not settings.BOARDINGHOUSE_SPARE_PREFIX.startswith('_'):
+        return [Error('BOARDINGHOUSE_SPARE_PREFIX must start with an underscore',
+                      id='boardinghouse.E005')]
+
+    return []
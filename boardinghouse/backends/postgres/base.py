@@ -1,19 +1,294 @@
 from __future__ import unicode_literals
 
+import re
+from timeit import default_timer
+
+from django.apps import apps
+from django.conf import settings
+from django.db.backends import utils
 from django.db.backends.postgresql_psycopg2 import base
+from django.utils import six
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from boardinghouse.schema import _active_schema, _lazy_schema
 
 from .schema import DatabaseSchemaEditor
 from .creation import DatabaseCreation
+from .instrumentation import query_statistics
+from .pool import changes_session_state, connection_pool
+
+# Statements that may change the search path without us knowing what it
+# was changed to.
+SEARCH_PATH_CHANGE = re.compile(r'search_path|\bRESET\b|\bDISCARD\b', re.IGNORECASE)
+
+
+_private_table_pattern = None
+
+
+def private_table_pattern():
+    """
+    A regular expression that matches any reference to a private table,
+    one of the ``settings.BOARDINGHOUSE_PRIVATE_TABLES``, or to
+    ``current_schema()``, in an SQL statement.
+
+    Statements that match this need the correct schema to be active before
+    they are executed.
+    """
+    global _private_table_pattern
+
+    if _private_table_pattern is None:
+        from boardinghouse.schema import is_shared_model
+
+        tables = sorted(set(
+            model._meta.db_table
+            for model in apps.get_models(include_auto_created=True)
+            if not model._meta.proxy and not is_shared_model(model)
+        ) | set(settings.BOARDINGHOUSE_PRIVATE_TABLES))
+        _private_table_pattern = re.compile(
+            r'\b(?:{0})\b'.format('|'.join([re.escape(table) for table in tables] + ['current_schema'])),
+            re.IGNORECASE
+        )
+
+    return _private_table_pattern
+
+
+def clear_private_table_pattern():
+    """
+    Forget which tables are private: this needs to happen if the settings
+    that determine that are changed, or the models are migrated.
+    """
+    global _private_table_pattern
+    _private_table_pattern = None
+
+
+class SearchPathCursorMixin(object):
+    """
+    Forget the recorded search path of the connection whenever a statement
+    that could change it is executed through a cursor, and note when one
+    could change any other session state (see :mod:`.pool`).
+
+    If the connection has a lazily activated schema, then make sure that is
+    active before executing a statement that refers to a private table.
+
+    If ``settings.BOARDINGHOUSE_QUERY_STATISTICS`` is set, then each statement
+    is timed, and counted against the active schema (see
+    :mod:`boardinghouse.backends.postgres.instrumentation`).
+    """
+    def execute(self, sql, params=None):
+        if self.db.lazy_schema is not None:
+            self.db.activate_lazy_schema(sql)
+        if query_statistics.enabled:
+            return self._timed(super(SearchPathCursorMixin, self).execute, sql, params)
+        try:
+            return super(SearchPathCursorMixin, self).execute(sql, params)
+        finally:
+            self._check_search_path(sql)
+
+    def executemany(self, sql, param_list):
+        if self.db.lazy_schema is not None:
+            self.db.activate_lazy_schema(sql)
+        if query_statistics.enabled:
+            return self._timed(super(SearchPathCursorMixin, self).executemany, sql, param_list)
+        try:
+            return super(SearchPathCursorMixin, self).executemany(sql, param_list)
+        finally:
+            self._check_search_path(sql)
+
+    def _timed(self, execute, sql, params):
+        # Statements are counted against the schema they were executed in.
+        schema = _active_schema.get() or settings.PUBLIC_SCHEMA
+        start = default_timer()
+        try:
+            return execute(sql, params)
+        finally:
+            query_statistics.record(schema, default_timer() - start, sql)
+            self._check_search_path(sql)
+
+    def _check_search_path(self, sql):
+        if not isinstance(sql, six.string_types) or SEARCH_PATH_CHANGE.search(sql):
+            self.db.search_path = None
+        if changes_session_state(sql):
+            self.db.session_changed = True
+
+
+class CursorWrapper(SearchPathCursorMixin, utils.CursorWrapper):
+    pass
+
+
+class CursorDebugWrapper(SearchPathCursorMixin, utils.CursorDebugWrapper):
+    pass
 
 
 class DatabaseWrapper(base.DatabaseWrapper):
     """
     This is a simple subclass of the Postrges DatabaseWrapper,
     but using our new :class:`DatabaseSchemaEditor` class.
+
+    It also keeps a record of the search path that was last set on the
+    connection (``search_path``), so that activating the schema that is
+    already active does not need to hit the database. This is forgotten
+    whenever the connection is opened, closed or rolled back, or a statement
+    that may alter the search path is executed. A rollback also clears the
+    process-local schema cache used by :data:`boardinghouse.signals.find_schema`.
+
+    A schema that has been lazily activated is stored as ``lazy_schema``:
+    it is only actually activated when a statement that refers to a private
+    table is about to be executed (and again after a rollback undoes that).
+    Unlike the search path, this belongs to the current context rather than
+    the connection, so coroutines that share a connection each get the schema
+    they activated. It is kept separately for each database alias.
+
+    If ``settings.BOARDINGHOUSE_CONNECTION_POOL_SIZE`` is set, then closed
+    connections are kept in :data:`boardinghouse.backends.postgres.pool.connection_pool`,
+    and new connections are taken from there, preferring one that already has
+    the search path that is wanted. Activating a schema may also swap the
+    connection for a pooled one that has its search path, if nothing has
+    changed the state of the session since it was connected (``session_changed``).
     """
+    search_path = None
+    # See boardinghouse.schema.forget_dropped_schemata: a connection whose
+    # search path has not been checked by activation (such as a pooled one,
+    # which is discarded when its schema is dropped) is trusted.
+    search_path_generation = None
+    wanted_search_path = None
+    session_changed = False
+    activating_lazily = False
+    _pooled_search_path = None
+
+    @property
+    def lazy_schema(self):
+        return _lazy_schema(self.alias).get()
+
+    @lazy_schema.setter
+    def lazy_schema(self, schema_name):
+        _lazy_schema(self.alias).set(schema_name)
+
     def __init__(self, *args, **kwargs):
         super(DatabaseWrapper, self).__init__(*args, **kwargs)
         self.creation = DatabaseCreation(self)
 
     def schema_editor(self, *args, **kwargs):
         return DatabaseSchemaEditor(self, *args, **kwargs)
+
+    def ensure_connection(self, search_path=None):
+        """
+        Make sure we are connected: if a new connection is needed and there
+        is a pooled one with the given search path, then use that.
+
+        If we are already connected, then the connection may be swapped for
+        a pooled one with the given search path instead.
+        """
+        if self.connection is not None:
+            if search_path is not None:
+                self._swap_pooled_connection(search_path)
+            return
+        self.wanted_search_path = search_path
+        try:
+            super(DatabaseWrapper, self).ensure_connection()
+        finally:
+            self.wanted_search_path = None
+
+    def _swap_pooled_connection(self, search_path):
+        """
+        Swap the connection for a pooled one that already has the search
+        path, if that can be done without any queries: the current one must
+        be idle, outside of a transaction or a cursor call, and not have had
+        any other session state changed (so it need not be reset).
+        """
+        if not connection_pool.enabled or self.search_path == search_path:
+            return
+        if self.in_atomic_block or self.activating_lazily or self.session_changed:
+            return
+        if self.connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            return
+        key = self._pool_key()
+        pooled = connection_pool.take(key, search_path, exact=True)
+        if pooled is not None:
+            connection_pool.put(key, self.search_path, self.connection, reset=False)
+            self.connection, self.search_path = pooled
+            self.search_path_generation = None
+
+    def get_new_connection(self, conn_params):
+        self._pooled_search_path = None
+        self.session_changed = False
+        if connection_pool.enabled:
+            search_path = self.wanted_search_path
+            if search_path is None and self.lazy_schema is not None:
+                search_path = (self.lazy_schema, settings.PUBLIC_SCHEMA)
+            pooled = connection_pool.take(self._pool_key(conn_params), search_path)
+            if pooled is not None:
+                connection, self._pooled_search_path = pooled
+                self.isolation_level = self.settings_dict['OPTIONS'].get(
+                    'isolation_level', connection.isolation_level
+                )
+                return connection
+        return super(DatabaseWrapper, self).get_new_connection(conn_params)
+
+    def _pool_key(self, conn_params=None):
+        if conn_params is None:
+            conn_params = self.get_connection_params()
+        return tuple(sorted((key, repr(value)) for key, value in conn_params.items()))
+
+    def init_connection_state(self):
+        # A pooled connection still has the search path it was closed with.
+        self.search_path = self._pooled_search_path
+        self.search_path_generation = None
+        self._pooled_search_path = None
+        super(DatabaseWrapper, self).init_connection_state()
+
+    def create_cursor(self, *args, **kwargs):
+        # A named (server side) cursor may be held open after its transaction.
+        if kwargs.get('name', args[0] if args else None):
+            self.session_changed = True
+        return super(DatabaseWrapper, self).create_cursor(*args, **kwargs)
+
+    def activate_lazy_schema(self, sql):
+        schema_name = self.lazy_schema
+        if self.search_path == (schema_name, settings.PUBLIC_SCHEMA):
+            return
+        if isinstance(sql, six.string_types) and not private_table_pattern().search(sql):
+            return
+
+        from boardinghouse.schema import activate_schema, deactivate_schema
+
+        self.activating_lazily = True
+        try:
+            if schema_name == '$user':
+                deactivate_schema()
+            else:
+                activate_schema(schema_name)
+        finally:
+            self.activating_lazily = False
+            self.lazy_schema = schema_name
+
+    def make_cursor(self, cursor):
+        return CursorWrapper(cursor, self)
+
+    def make_debug_cursor(self, cursor):
+        return CursorDebugWrapper(cursor, self)
+
+    def _close(self):
+        search_path, self.search_path = self.search_path, None
+        if self.connection is not None and connection_pool.enabled:
+            with self.wrap_database_errors:
+                return connection_pool.put(
+                    self._pool_key(), search_path, self.connection, reset=self.session_changed
+                )
+        return super(DatabaseWrapper, self)._close()
+
+    def _rollback(self):
+        self.search_path = None
+        self._clear_schema_cache()
+        return super(DatabaseWrapper, self)._rollback()
+
+    def _savepoint_rollback(self, sid):
+        self.search_path = None
+        self._clear_schema_cache()
+        return super(DatabaseWrapper, self)._savepoint_rollback(sid)
+
+    def _clear_schema_cache(self):
+        # A rollback may undo the creation (or deletion) of a schema that
+        # has since been cached.
+        from boardinghouse.schema import schema_cache
+        schema_cache.clear()
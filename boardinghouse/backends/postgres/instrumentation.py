@@ -0,0 +1,236 @@
+"""
+Per-schema query counts and timings, kept in each process.
+
+When ``settings.BOARDINGHOUSE_QUERY_STATISTICS`` is set, every statement that
+is executed through a cursor of :class:`boardinghouse.backends.postgres.base.DatabaseWrapper`
+is timed, and counted against the schema that was active when it was
+executed (statements executed while no schema is active are counted against
+the public schema). Statements that take longer than
+``settings.BOARDINGHOUSE_SLOW_QUERY_TIME`` seconds are also counted as slow,
+and the most recent few of them are kept for each schema. When it is not set,
+each statement only has that setting looked up.
+
+The totals (since the process started, or :meth:`QueryStatistics.clear` was
+called) are handed to each of the reporters in
+``settings.BOARDINGHOUSE_QUERY_REPORTERS`` at the end of a request, at most
+once every ``settings.BOARDINGHOUSE_QUERY_REPORT_INTERVAL`` seconds, or
+whenever :func:`report` is called. A reporter is any class with a
+``report(statistics)`` method, which is passed a dict of schema names to
+:class:`SchemaQueryStatistics`: :class:`LoggingReporter` and
+:class:`StatsdReporter` are provided. :func:`prometheus_metrics` is a view
+that renders the totals in the Prometheus text format instead: it should be
+restricted to the monitoring server.
+"""
+from __future__ import unicode_literals
+
+import logging
+import socket
+import threading
+import time
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+#: How many of the most recent slow statements are kept for each schema.
+SLOW_QUERY_LOG_SIZE = 10
+
+SchemaQueryStatistics = namedtuple('SchemaQueryStatistics', ['count', 'time', 'slow', 'slow_queries'])
+SchemaQueryStatistics.__doc__ = """
+The number of statements executed in a schema, the total time they took (in
+seconds), the number of them that were slow, and the most recent slow
+statements, as a list of (sql, seconds) tuples.
+"""
+
+
+class QueryStatistics(object):
+    def __init__(self):
+        self._schemata = {}
+        self._lock = threading.Lock()
+        self._reported = None
+        self._reporters = None
+
+    @property
+    def enabled(self):
+        return bool(getattr(settings, 'BOARDINGHOUSE_QUERY_STATISTICS', False))
+
+    def record(self, schema, duration, sql):
+        """
+        Count a statement that took `duration` seconds to execute in `schema`.
+        """
+        slow = duration >= settings.BOARDINGHOUSE_SLOW_QUERY_TIME
+        with self._lock:
+            totals = self._schemata.get(schema)
+            if totals is None:
+                totals = self._schemata[schema] = [0, 0.0, 0, deque(maxlen=SLOW_QUERY_LOG_SIZE)]
+            totals[0] += 1
+            totals[1] += duration
+            if slow:
+                totals[2] += 1
+                totals[3].append((sql, duration))
+
+    def snapshot(self):
+        """
+        The totals for each schema, as a dict of schema names to
+        :class:`SchemaQueryStatistics`.
+        """
+        with self._lock:
+            return {
+                schema: SchemaQueryStatistics(count, duration, slow, list(slow_queries))
+                for schema, (count, duration, slow, slow_queries) in self._schemata.items()
+            }
+
+    def clear(self):
+        """
+        Forget the totals, and the reporters.
+        """
+        with self._lock:
+            self._schemata.clear()
+            self._reported = None
+            self._reporters = None
+
+    @property
+    def reporters(self):
+        if self._reporters is None:
+            self._reporters = [import_string(path)() for path in settings.BOARDINGHOUSE_QUERY_REPORTERS]
+        return self._reporters
+
+    def report(self):
+        """
+        Hand the totals to each of the reporters.
+        """
+        self._reported = time.time()
+        statistics = self.snapshot()
+        for reporter in self.reporters:
+            try:
+                reporter.report(statistics)
+            except Exception:
+                LOGGER.exception('Query statistics could not be reported by %r', reporter)
+
+    def report_if_due(self):
+        """
+        Hand the totals to each of the reporters, unless they were handed
+        them less than ``settings.BOARDINGHOUSE_QUERY_REPORT_INTERVAL``
+        seconds ago. The first call only starts the interval.
+        """
+        now = time.time()
+        if self._reported is None:
+            self._reported = now
+        elif now - self._reported >= settings.BOARDINGHOUSE_QUERY_REPORT_INTERVAL:
+            self.report()
+
+
+#: The statistics kept by :class:`boardinghouse.backends.postgres.base.DatabaseWrapper`.
+query_statistics = QueryStatistics()
+
+
+def report():
+    """
+    Hand the totals to each of the reporters in ``settings.BOARDINGHOUSE_QUERY_REPORTERS``.
+    """
+    query_statistics.report()
+
+
+class LoggingReporter(object):
+    """
+    Log the totals of each schema (at ``INFO`` level), and each of its recent
+    slow statements (at ``WARNING`` level) that has not been logged before.
+    """
+    def __init__(self, logger=LOGGER):
+        self.logger = logger
+        self._logged = {}
+
+    def report(self, statistics):
+        for schema, stats in sorted(statistics.items()):
+            self.logger.info(
+                'Schema %s: %d queries in %.3fs (%d slow)', schema, stats.count, stats.time, stats.slow
+            )
+            unlogged = stats.slow - self._logged.get(schema, 0)
+            if unlogged > 0:
+                for sql, duration in stats.slow_queries[-unlogged:]:
+                    self.logger.warning('Slow query in schema %s (%.3fs): %s', schema, duration, sql)
+            self._logged[schema] = stats.slow
+
+
+class StatsdReporter(object):
+    """
+    Send the increase in the totals of each schema since they were last
+    reported to a StatsD server, as UDP packets of counters:
+    ``<prefix>.<schema>.queries``, ``<prefix>.<schema>.query_time`` (in
+    milliseconds) and ``<prefix>.<schema>.slow_queries``.
+
+    The server is at ``settings.BOARDINGHOUSE_STATSD_ADDRESS``
+    (``'host:port'``) unless another address is given.
+    """
+    def __init__(self, address=None, prefix='boardinghouse'):
+        host, port = (address or settings.BOARDINGHOUSE_STATSD_ADDRESS).rsplit(':', 1)
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self._reported = {}
+
+    def report(self, statistics):
+        lines = []
+        for schema, stats in sorted(statistics.items()):
+            count, duration, slow = self._reported.get(schema, (0, 0.0, 0))
+            if stats.count == count:
+                continue
+            metric = '{0}.{1}'.format(self.prefix, schema)
+            lines.append('{0}.queries:{1}|c'.format(metric, stats.count - count))
+            lines.append('{0}.query_time:{1}|c'.format(metric, int(round((stats.time - duration) * 1000))))
+            if stats.slow > slow:
+                lines.append('{0}.slow_queries:{1}|c'.format(metric, stats.slow - slow))
+            self._reported[schema] = (stats.count, stats.time, stats.slow)
+
+        if not lines:
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # Keep each packet small enough not to be fragmented.
+            packet = []
+            for line in lines:
+                if packet and sum(len(each) + 1 for each in packet) + len(line) > 512:
+                    sock.sendto('\n'.join(packet).encode('utf-8'), self.address)
+                    packet = []
+                packet.append(line)
+            sock.sendto('\n'.join(packet).encode('utf-8'), self.address)
+        finally:
+            sock.close()
+
+
+class PrometheusReporter(object):
+    """
+    Render the totals in the Prometheus text exposition format.
+    """
+    METRICS = [
+        ('boardinghouse_queries_total', 'Statements executed in each schema.', 'count'),
+        ('boardinghouse_query_seconds_total', 'Time spent executing statements in each schema.', 'time'),
+        ('boardinghouse_slow_queries_total', 'Slow statements executed in each schema.', 'slow'),
+    ]
+
+    def render(self, statistics):
+        lines = []
+        for name, help_text, field in self.METRICS:
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} counter'.format(name))
+            for schema, stats in sorted(statistics.items()):
+                label = schema.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append('{0}{{schema="{1}"}} {2!r}'.format(name, label, getattr(stats, field)))
+        return '\n'.join(lines) + '\n'
+
+    def report(self, statistics):
+        # Prometheus fetches the totals itself, from prometheus_metrics().
+        pass
+
+
+def prometheus_metrics(request):
+    """
+    A view that renders the query totals of this process for Prometheus.
+    """
+    return HttpResponse(
+        PrometheusReporter().render(query_statistics.snapshot()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
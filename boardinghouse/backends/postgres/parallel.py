@@ -0,0 +1,93 @@
+"""
+Apply a migration statement to many schemata at once, using several
+database connections.
+
+When ``settings.BOARDINGHOUSE_MIGRATION_WORKERS`` is more than one, and the
+migration is not atomic, then each statement that alters private tables is
+applied to the schemata by that many worker threads. Each of them has its
+own connection, and takes the next schema that has not been migrated yet
+until there are none left: each schema is migrated in its own transaction.
+
+As soon as the statement fails in any schema, the workers stop taking more
+schemata, and a :class:`boardinghouse.exceptions.SchemaMigrationError` is
+raised once they have finished, listing the schemata that the statement was
+applied to, and those it failed in. Progress is logged as it happens.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.six.moves import queue
+
+from boardinghouse.exceptions import SchemaMigrationError
+from boardinghouse.schema import _schema_statements
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+
+def execute_in_parallel(schemata, sql, params=None, workers=None, using=DEFAULT_DB_ALIAS):
+    """
+    Execute the statement in each of the named schemata, using (at most)
+    ``workers`` connections at once, and return the list of schemata that
+    it was applied to, in the order that they were done.
+    """
+    schemata = list(schemata)
+    workers = min(workers or settings.BOARDINGHOUSE_MIGRATION_WORKERS, len(schemata))
+    # Log progress about every ten percent.
+    report_every = max(1, len(schemata) // 10)
+
+    pending = queue.Queue()
+    for schema in schemata:
+        pending.put(schema)
+
+    applied = []
+    failed = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def work():
+        connection = connections[using]
+        try:
+            while not stop.is_set():
+                try:
+                    schema = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    with transaction.atomic(using=using):
+                        with connection.cursor() as cursor:
+                            cursor.execute(_schema_statements(cursor, [schema], sql, params))
+                except Exception as exc:
+                    stop.set()
+                    with lock:
+                        failed[schema] = exc
+                    LOGGER.error('Migration failed in schema %s: %s', schema, exc)
+                else:
+                    with lock:
+                        applied.append(schema)
+                        done = len(applied)
+                    if done % report_every == 0 or done == len(schemata):
+                        LOGGER.info('Migrated %d of %d schemata', done, len(schemata))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=work) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if failed:
+        raise SchemaMigrationError(
+            'Migration failed in {0} schemata ({1} applied, {2} not attempted)'.format(
+                len(failed), len(applied), len(schemata) - len(applied) - len(failed)
+            ),
+            applied=applied,
+            failed=failed,
+        )
+
+    return applied
@@ -0,0 +1,191 @@
+"""
+A process-wide pool of idle database connections, keyed by the search path
+that each of them has set.
+
+When ``settings.BOARDINGHOUSE_CONNECTION_POOL_SIZE`` is set, closing a
+connection hands it back to this pool instead, and opening one takes a
+pooled connection. The first query of a request (fetching the session, for
+instance) usually happens before the schema is known, so it is given the
+least recently used connection: when the schema is then activated, and the
+pool has a connection that already has its search path, the two are
+swapped (which needs no query). Besides saving the connection setup and the
+``SET search_path``, this means each tenant keeps getting a postgres backend
+whose per-session caches (the catalog and relation caches, and the plans of
+PL/pgSQL functions) are already warm for its tables.
+
+A connection that may have had any other session state changed (settings,
+temporary tables, session advisory locks, prepared statements, ``LISTEN``
+and held cursors) is reset when it is returned to the pool, keeping just its
+search path, so that none of that leaks to whoever uses it next. This is
+found by looking at the statements executed through Django's cursors: state
+changed inside a function (or by statements that are not strings) is not
+seen, except that statements that are not strings are always assumed to
+change it.
+
+The pool is bounded: when it holds more idle connections than the setting
+allows, the least recently used ones (across all schemata) are closed.
+
+A connection that is closed, or that psycopg2 knows to be broken, is never
+taken from the pool. One that the server (or the network) closed while it
+was idle is only noticed when it is next used, and is then thrown away by
+Django like any other broken connection.
+"""
+from __future__ import unicode_literals
+
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import six
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+# Statements that may change the state of the session (other than the search
+# path, which is kept track of separately).
+SESSION_STATE_CHANGE = re.compile(
+    r"(?:^|;)\s*(?:SET|RESET|DISCARD|LISTEN|PREPARE|DECLARE|LOAD)\b"
+    r"|\bTEMP(?:ORARY)?\b|\bpg_(?:try_)?advisory_lock|\bset_config\s*\(\s*'(?!search_path')",
+    re.IGNORECASE
+)
+
+# Everything DISCARD ALL does, apart from forgetting the search path and the
+# plans of PL/pgSQL functions (DISCARD ALL cannot be run in a transaction,
+# and so not in a query of more than one statement).
+RESET_SESSION = (
+    'CLOSE ALL; RESET ALL; DEALLOCATE ALL; UNLISTEN *; '
+    'SELECT pg_advisory_unlock_all(); DISCARD TEMP; DISCARD SEQUENCES'
+)
+
+
+def changes_session_state(sql):
+    """
+    Could this statement change the state of the session?
+    """
+    return not isinstance(sql, six.string_types) or bool(SESSION_STATE_CHANGE.search(sql))
+
+
+class SchemaConnectionPool(object):
+    def __init__(self):
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return bool(getattr(settings, 'BOARDINGHOUSE_CONNECTION_POOL_SIZE', 0))
+
+    def take(self, key, search_path=None, exact=False):
+        """
+        Get an idle connection that was opened with the connection parameters
+        identified by ``key``, as a tuple of (connection, search_path).
+
+        If there is one with the wanted search path, then the most recently
+        used of them is returned: otherwise (unless ``exact`` is set) the
+        least recently used of all of them. Returns None if there are no
+        (usable) idle connections for this key.
+        """
+        with self._lock:
+            for conn_id, (conn_key, path, conn) in list(self._idle.items()):
+                if conn_key == key and not self._is_usable(conn):
+                    del self._idle[conn_id]
+                    conn.close()
+            candidates = [
+                (conn_id, path) for (conn_id, (conn_key, path, conn)) in self._idle.items()
+                if conn_key == key
+            ]
+            matching = [conn_id for (conn_id, path) in candidates if search_path and path == search_path]
+            if search_path:
+                if matching:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if matching:
+                conn_id = matching[-1]
+            elif candidates and not exact:
+                conn_id = candidates[0][0]
+            else:
+                return None
+            conn_key, path, conn = self._idle.pop(conn_id)
+        return conn, path
+
+    def _is_usable(self, connection):
+        # psycopg2 reports an unknown status for a connection that is broken.
+        return not connection.closed and connection.get_transaction_status() == TRANSACTION_STATUS_IDLE
+
+    def put(self, key, search_path, connection, reset=True):
+        """
+        Return a connection to the pool: it is closed instead if it is not
+        idle (or is broken), or if the pool is not enabled.
+
+        Unless ``reset`` is False (because the session state is known not to
+        have been changed), the state of the session is reset first, apart
+        from the search path.
+
+        Connections that the pool no longer has room for are closed.
+        """
+        if not self.enabled or not self._is_usable(connection):
+            connection.close()
+            return
+
+        if reset:
+            try:
+                self._reset(connection, search_path)
+            except psycopg2.Error:
+                connection.close()
+                return
+
+        evicted = []
+        with self._lock:
+            self._idle[id(connection)] = (key, search_path, connection)
+            while len(self._idle) > settings.BOARDINGHOUSE_CONNECTION_POOL_SIZE:
+                evicted.append(self._idle.popitem(last=False)[1][2])
+
+        for connection in evicted:
+            connection.close()
+
+    def _reset(self, connection, search_path):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(RESET_SESSION)
+            if search_path is not None:
+                cursor.execute("SELECT set_config('search_path', %s, false)", [
+                    ','.join('"{0}"'.format(name.replace('"', '""')) for name in search_path)
+                ])
+        finally:
+            cursor.close()
+        if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            connection.commit()
+
+    def discard(self, schemata):
+        """
+        Close the idle connections that have any of the schemata in their
+        search path.
+        """
+        with self._lock:
+            discarded = [
+                conn_id for (conn_id, (key, path, conn)) in self._idle.items()
+                if path and path[0] in schemata
+            ]
+            discarded = [self._idle.pop(conn_id)[2] for conn_id in discarded]
+        for connection in discarded:
+            connection.close()
+
+    def clear(self):
+        """
+        Close all of the idle connections.
+        """
+        with self._lock:
+            idle = [conn for (key, path, conn) in self._idle.values()]
+            self._idle.clear()
+        for connection in idle:
+            connection.close()
+
+    def __len__(self):
+        return len(self._idle)
+
+
+#: The pool used by :class:`boardinghouse.backends.postgres.base.DatabaseWrapper`.
+connection_pool = SchemaConnectionPool()
@@ -1,14 +1,17 @@
 from __future__ import unicode_literals
 
-from collections import defaultdict
+import re
+import threading
+from collections import OrderedDict, defaultdict
 
 from django.conf import settings
 from django.db.backends.postgresql_psycopg2 import schema
+from django.utils import six
 
 import sqlparse
 from sqlparse.tokens import DDL, DML, Keyword
 
-from ...schema import deactivate_schema, is_shared_table
+from ...schema import activate_schema, deactivate_schema, is_shared_table
 from ...signals import schema_aware_operation
 
 
@@ -119,13 +122,23 @@ def group_tokens(parsed):
     return grouped, identifiers
 
 
-def get_table_and_schema(statement, cursor):
+class IndexName(six.text_type):
+    """
+    The name of an index that is being dropped: the table it belongs to
+    must be looked up in the database.
+    """
+
+
+def classify_statement(statement):
     """
     I'm not happy with the following, just yet:
 
     False means this is something that must be only applied to the public schema.
 
     None means this statement can be ignored from the perspective of checking.
+
+    Otherwise, a tuple of (table_name, schema_name), or an :class:`IndexName`
+    if that needs to be looked up.
     """
     grouped, identifiers = group_tokens(statement)
 
@@ -145,7 +158,7 @@ def get_table_and_schema(statement, cursor):
             # We will have to hit the database to see what tables have
             # an index with that name: we can just use the template/public
             # schemata though.
-            return get_index_data(cursor, identifiers[0].get_name())[0], None
+            return IndexName(identifiers[0].get_name())
         elif ('VIEW' in keywords or 'TABLE' in keywords) and identifiers:
             # We care about identifier 0, which will be the name of the view
             # or table.
@@ -169,13 +182,88 @@ def get_table_and_schema(statement, cursor):
     return False
 
 
-def can_apply_to_multiple_schemata(sql, cursor):
-    parsed = sqlparse.parse(sql)
+def get_table_and_schema(statement, cursor):
+    """
+    Classify a (parsed) statement, looking up the table of an index that
+    is being dropped: see :func:`classify_statement`.
+    """
+    return _resolve(classify_statement(statement), cursor)
+
+
+def _resolve(match, cursor):
+    if isinstance(match, IndexName):
+        return get_index_data(cursor, match)[0], None
+    return match
+
+
+# The statements that the schema editor usually executes are a small set
+# of shapes, that we can classify without the (slow) full parse.
+IDENTIFIER = r'(?:"(?:[^"]|"")+"|[A-Za-z_][A-Za-z0-9_$]*)'
+QUALIFIED = r'(?:({0})\.)?({0})'.format(IDENTIFIER)
+FAST_STATEMENTS = [
+    (re.compile(r'^(?:CREATE|ALTER|DROP) TABLE (?:IF (?:NOT )?EXISTS )?' + QUALIFIED + r'(?:\s|\(|$)'), 'table'),
+    (re.compile(r'^CREATE (?:UNIQUE )?INDEX (?:CONCURRENTLY )?' + IDENTIFIER + r' ON ' + QUALIFIED + r'(?:\s|\(|$)'), 'table'),
+    (re.compile(r'^DROP INDEX (?:IF EXISTS )?(' + IDENTIFIER + r')$'), 'index'),
+    (re.compile(r'^(?:INSERT INTO|UPDATE|DELETE FROM) ' + QUALIFIED + r'(?:\s|\(|$)'), 'table'),
+]
+# Statements containing these need the full parse to classify them.
+SLOW_STATEMENT = re.compile(r';|--|/\*|\b(?:FUNCTION|SCHEMA|VIEW|TRIGGER|CONSTRAINTS)\b', re.IGNORECASE)
+
+_classified = OrderedDict()
+# The schemata may be migrated from several threads at once.
+_classified_lock = threading.Lock()
+CLASSIFIED_CACHE_SIZE = 1024
+
+
+def _unquote(identifier):
+    if identifier and identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier
 
-    data = [
-        get_table_and_schema(statement, cursor)
-        for statement in parsed
-    ]
+
+def _fast_classify(sql):
+    """
+    Classify a single statement that is in one of the common shapes, or
+    return None if that is not possible.
+    """
+    sql = sql.strip()
+    if sql.endswith(';'):
+        sql = sql[:-1].rstrip()
+    if SLOW_STATEMENT.search(sql):
+        return None
+
+    for pattern, kind in FAST_STATEMENTS:
+        match = pattern.match(sql)
+        if match:
+            if kind == 'index':
+                return (IndexName(_unquote(match.group(1))),)
+            schema_name, table_name = match.groups()
+            return ((_unquote(table_name), _unquote(schema_name)),)
+
+
+def classify_sql(sql):
+    """
+    Classify each of the statements in sql (see :func:`classify_statement`).
+
+    Statements in the shapes that the schema editor normally uses are
+    classified without parsing them with sqlparse, and the results for
+    the most recently seen SQL strings are remembered.
+    """
+    with _classified_lock:
+        result = _classified.pop(sql, None)
+    if result is None:
+        result = _fast_classify(sql)
+        if result is None:
+            result = tuple(classify_statement(statement) for statement in sqlparse.parse(sql))
+    with _classified_lock:
+        _classified[sql] = result
+        while len(_classified) > CLASSIFIED_CACHE_SIZE:
+            _classified.popitem(last=False)
+    return result
+
+
+def can_apply_to_multiple_schemata(sql, cursor):
+    data = [_resolve(match, cursor) for match in classify_sql(sql)]
 
     if any(match is False for match in data):
         return False
@@ -206,8 +294,18 @@ class DatabaseSchemaEditor(schema.DatabaseSchemaEditor):
     3. Change the mechanism for grabbing constraint names to also look in
        the template schema (instead of just `public`, as is hard-coded in
        the original method).
+
+    If it is created with a ``schema``, then statements are only applied to
+    that schema (and constraint names are looked up there): statements that
+    only apply to the public schema are not executed at all, as they will
+    already have been. This is used to bring a schema that is behind up to
+    date (see :mod:`boardinghouse.ledger`).
     """
 
+    def __init__(self, connection, *args, **kwargs):
+        self.schema = kwargs.pop('schema', None)
+        super(DatabaseSchemaEditor, self).__init__(connection, *args, **kwargs)
+
     def __exit__(self, exc_type, exc_value, traceback):
         # It seems that actions that add stuff to the deferred sql
         # will fire per-schema, so we can end up with multiples.
@@ -224,13 +322,25 @@ class DatabaseSchemaEditor(schema.DatabaseSchemaEditor):
     def execute(self, sql, params=None):
         execute = super(DatabaseSchemaEditor, self).execute
 
+        if self.schema is not None:
+            if can_apply_to_multiple_schemata(sql, self.connection.cursor()):
+                activate_schema(self.schema)
+                execute(sql, params)
+                deactivate_schema()
+            return
+
         # TODO: try to get the apps from current project_state, not global apps.
         if can_apply_to_multiple_schemata(sql, self.connection.cursor()):
+            kwargs = {}
+            if not self.collect_sql:
+                # Allow the statement to be sent for many schemata at once.
+                kwargs.update(sql=sql, params=params)
             schema_aware_operation.send(
                 self.__class__,
                 db_table=None,  # Maybe deprecate this argument?
                 function=execute,
-                args=(sql, params)
+                args=(sql, params),
+                **kwargs
             )
             deactivate_schema()
         else:
@@ -244,7 +354,7 @@ class DatabaseSchemaEditor(schema.DatabaseSchemaEditor):
         """
         column_names = list(column_names) if column_names else None
         with self.connection.cursor() as cursor:
-            constraints = get_constraints(cursor, model._meta.db_table)
+            constraints = get_constraints(cursor, model._meta.db_table, self.schema)
         result = []
         for name, infodict in constraints.items():
             if column_names is None or column_names == infodict['columns']:
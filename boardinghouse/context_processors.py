@@ -1,5 +1,7 @@
 from __future__ import unicode_literals
 
+from .models import request_visible_schemata
+
 
 def schemata(request):
     """
@@ -16,8 +18,14 @@ def schemata(request):
     if request.user.is_anonymous:
         return {}
 
+    schemata = request_visible_schemata(request)
+    schema_choices = []
+    for schema in schemata:
+        if (schema.schema, schema.name) not in schema_choices:
+            schema_choices.append((schema.schema, schema.name))
+
     return {
-        'schemata': request.user.visible_schemata,
-        'schema_choices': request.user.visible_schemata.values_list('schema', 'name').distinct(),
+        'schemata': schemata,
+        'schema_choices': schema_choices,
         'selected_schema': request.session.get('schema'),
     }
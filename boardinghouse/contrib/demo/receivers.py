@@ -2,7 +2,7 @@ from django.conf import settings
 from django.db import models
 from django.dispatch import receiver
 
-from boardinghouse.schema import _table_exists
+from boardinghouse.schema import _batched_sql, _execute_in_schemata, _table_exists
 from boardinghouse import signals
 from boardinghouse.receivers import create_schema, drop_schema
 
@@ -18,6 +18,10 @@ models.signals.post_delete.connect(drop_schema, sender=DemoSchema)
 @receiver(signals.schema_aware_operation, weak=False, dispatch_uid='execute-all-demo-schemata')
 def execute_on_all_templates(sender, db_table, function, **kwargs):
     if _table_exists(DemoSchema._meta.db_table):
+        batched = _batched_sql(kwargs)
+        if batched:
+            _execute_in_schemata([schema.schema for schema in DemoSchema.objects.active()], *batched)
+            return
         for schema in DemoSchema.objects.active():
             schema.activate()
             function(*kwargs.get('args', []), **kwargs.get('kwargs', {}))
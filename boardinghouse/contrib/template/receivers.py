@@ -5,7 +5,7 @@ from django.db import models
 from boardinghouse import signals
 from boardinghouse.exceptions import Forbidden
 from boardinghouse.receivers import create_schema, drop_schema
-from boardinghouse.schema import _table_exists
+from boardinghouse.schema import _batched_sql, _execute_in_schemata, _table_exists
 
 from .models import SchemaTemplate
 
@@ -19,6 +19,10 @@ models.signals.post_delete.connect(drop_schema, sender=SchemaTemplate)
 @receiver(signals.schema_aware_operation, weak=False, dispatch_uid='execute-all-templates')
 def execute_on_all_templates(sender, db_table, function, **kwargs):
     if _table_exists(SchemaTemplate._meta.db_table):
+        batched = _batched_sql(kwargs)
+        if batched:
+            _execute_in_schemata([schema.schema for schema in SchemaTemplate.objects.all()], *batched)
+            return
         for schema in SchemaTemplate.objects.all():
             schema.activate()
             function(*kwargs.get('args', []), **kwargs.get('kwargs', {}))
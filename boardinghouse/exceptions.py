@@ -23,8 +23,31 @@ class SchemaNotFound(Exception):
     """
 
 
+class SchemaNotReady(Exception):
+    """
+    An exception that is raised when an attempt to change to a schema that
+    has not yet been created in the database (because it is still being
+    provisioned) is made.
+    """
+
+
 class SchemaRequiredException(Exception):
     """
     An exception raised when an operation requires a schema to be active
     or supplied, but none was provided.
     """
+
+
+class SchemaMigrationError(Exception):
+    """
+    An exception raised when a statement that was being applied to many
+    schemata at once failed in at least one of them.
+
+    ``applied`` is the list of schemata that the statement was applied (and
+    committed) in, and ``failed`` maps each schema that it failed in to the
+    error that was raised.
+    """
+    def __init__(self, message, applied, failed):
+        super(SchemaMigrationError, self).__init__(message)
+        self.applied = applied
+        self.failed = failed
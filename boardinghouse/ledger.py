@@ -0,0 +1,450 @@
+"""
+The per-schema migration ledger.
+
+Django records which migrations have been applied in the shared schema,
+but a migration that alters private tables needs to be applied to every
+schema too. :class:`boardinghouse.models.SchemaMigration` records which
+migrations have been applied to each schema, so a schema that is behind
+(because a migration that was not atomic failed part way through, or
+because ``settings.BOARDINGHOUSE_DEFER_SCHEMA_MIGRATIONS`` is set) can be
+found and brought up to date later, using the ``migrate_schemata``
+management command.
+
+Whenever the ``migrate`` command (see :mod:`boardinghouse.management.commands.migrate`)
+applies a migration, it is recorded as applied to every schema as well
+(unless migrations to the schemata are deferred), on the same connection. A new schema starts with the migrations of the schema
+it was cloned from.
+
+When a schema is brought up to date, each of the migrations it is missing
+is applied to just that schema, in its own transaction, along with the
+record of it having been applied: so this can be stopped at any point, and
+will continue from there when run again. Only the statements that apply to
+private tables are executed: ``RunPython`` operations are not run again.
+
+So a migration that has a ``RunPython`` operation (other than
+``RunPython.noop``), or a ``RunSQL`` operation that alters private tables,
+is never deferred: when the migrate command is going to apply one, every
+schema that is behind is brought up to date first, and then the migrations
+are applied to every schema, just as if they were not deferred.
+
+When migrations are deferred, the schemata that have been activated within
+the last ``settings.BOARDINGHOUSE_RECENT_ACTIVITY_TIMEOUT`` seconds are still
+migrated (and recorded) along with the template schema. If
+``settings.BOARDINGHOUSE_MIGRATE_ON_ACTIVATION`` is set, then the first time
+each process activates a schema it checks whether it is behind, and if so,
+brings it up to date, holding an advisory lock on that schema so that no
+other process tries to do the same at the same time. This is never done
+part-way through executing another statement (when a schema is lazily
+activated), where a schema that is behind raises
+:class:`boardinghouse.exceptions.SchemaNotReady` instead.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection as default_connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.operations.special import RunPython, RunSQL
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.migrations.state import ProjectState
+
+from .backends.postgres.schema import IndexName, classify_sql
+from .exceptions import SchemaNotReady
+from .schema import _table_exists, get_schema_model, is_shared_table
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+# The first key of the advisory lock held while migrating a schema on
+# activation: the second is the hash of the schema name.
+ADVISORY_LOCK_KEY = 0x6268
+
+# The schemata that are migrated along with the template schema by the
+# migrate command that is running, when migrations are deferred.
+_eager_schemata = None
+# Whether the migrate command that is running is applying a migration that
+# cannot be deferred, so that every schema is migrated.
+_undeferrable = False
+
+# The (database alias, schema) of each schema that this process has seen is
+# up to date (since it last ran migrate).
+_current_schemata = set()
+# The (database alias, schema) (if any) that this thread is bringing up to date.
+_migrating = threading.local()
+# When this process last recorded that each schema was activated.
+_activity = {}
+
+
+def _tables(connection):
+    from .models import SchemaMigration
+
+    quote_name = connection.ops.quote_name
+    Schema = get_schema_model()
+    return {
+        'ledger': quote_name(SchemaMigration._meta.db_table),
+        'schema': quote_name(Schema._meta.pk.column),
+        'schema_table': quote_name(Schema._meta.db_table),
+        'migrations': quote_name(MigrationRecorder.Migration._meta.db_table),
+    }
+
+
+def _ledger_exists(connection=default_connection):
+    from .models import SchemaMigration
+    return _table_exists(SchemaMigration._meta.db_table, connection=connection)
+
+
+def record_applied(connection, app, name):
+    """
+    Record that a migration has been applied to every schema (or, when
+    migrations are deferred, to each of the :func:`eager_schemata`).
+
+    The ledger must exist: the ``migrate`` command checks this.
+    """
+    sql = (
+        'INSERT INTO {ledger} (schema, app, name, applied) '
+        'SELECT s.{schema}, %s, %s, now() FROM {schema_table} s '
+        ' WHERE NOT EXISTS (SELECT 1 FROM {ledger} l '
+        '                    WHERE l.schema = s.{schema} AND l.app = %s AND l.name = %s)'
+    ).format(**_tables(connection))
+    params = [app, name, app, name]
+    if deferring():
+        schemata = eager_schemata(using=connection.alias)
+        if not schemata:
+            return
+        sql += ' AND s.{schema} = ANY(%s)'.format(**_tables(connection))
+        params.append(schemata)
+    connection.cursor().execute(sql, params)
+
+
+def record_unapplied(connection, app, name):
+    """
+    Record that a migration has been unapplied from every schema.
+
+    The ledger must exist: the ``migrate`` command checks this.
+    """
+    connection.cursor().execute(
+        'DELETE FROM {ledger} WHERE app = %s AND name = %s'.format(**_tables(connection)),
+        [app, name]
+    )
+
+
+def record_schema_created(connection, schema, source):
+    """
+    Record that a new schema has the migrations of the schema it was
+    cloned from: if that is not in the ledger (the template schema, for
+    instance), then it has every migration.
+    """
+    record_schemata_created(connection, [schema], source)
+
+
+def record_schemata_created(connection, schemata, source):
+    """
+    Record that each of the new schemata has the migrations of the schema
+    they were all cloned from.
+    """
+    if not _ledger_exists(connection):
+        return
+    cursor = connection.cursor()
+    tables = _tables(connection)
+    cursor.execute(
+        'INSERT INTO {ledger} (schema, app, name, applied) '
+        'SELECT s, app, name, now() FROM {ledger}, unnest(%s::text[]) s WHERE schema = %s'.format(**tables),
+        [list(schemata), source]
+    )
+    if not cursor.rowcount:
+        cursor.execute(
+            'INSERT INTO {ledger} (schema, app, name, applied) '
+            'SELECT s, app, name, now() FROM {migrations}, unnest(%s::text[]) s'.format(**tables),
+            [list(schemata)]
+        )
+
+
+def record_schemata_dropped(connection, schemata):
+    """
+    Forget the migrations that were applied to each of the dropped schemata.
+    """
+    if not _ledger_exists(connection):
+        return
+    connection.cursor().execute(
+        'DELETE FROM {ledger} WHERE schema = ANY(%s)'.format(**_tables(connection)),
+        [list(schemata)]
+    )
+
+
+def pending_migrations(schemata=None, using=DEFAULT_DB_ALIAS):
+    """
+    A mapping of each schema that is behind to the set of (app, name) of
+    the migrations that have been applied to the shared schema but not to
+    it. If ``schemata`` are given, only those are looked at.
+    """
+    connection = connections[using]
+    sql = (
+        'SELECT s.{schema}, m.app, m.name FROM {schema_table} s, {migrations} m '
+        ' WHERE NOT EXISTS (SELECT 1 FROM {ledger} l '
+        '                    WHERE l.schema = s.{schema} AND l.app = m.app AND l.name = m.name)'
+    ).format(**_tables(connection))
+    params = []
+    if schemata is not None:
+        sql += ' AND s.{schema} = ANY(%s)'.format(**_tables(connection))
+        params.append(list(schemata))
+
+    pending = defaultdict(set)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for schema, app, name in cursor.fetchall():
+            pending[schema].add((app, name))
+    return dict(pending)
+
+
+def _activity_key(schema):
+    return 'schema-activity-{0}'.format(schema)
+
+
+def note_activity(schema):
+    """
+    Record (in the cache) that the schema has been activated: this is done
+    at most a few times within each timeout, by each process.
+    """
+    timeout = settings.BOARDINGHOUSE_RECENT_ACTIVITY_TIMEOUT
+    now = time.time()
+    if _activity.get(schema, 0) > now - timeout / 10:
+        return
+    _activity[schema] = now
+    cache.set(_activity_key(schema), now, timeout)
+
+
+def _find_eager_schemata(using=DEFAULT_DB_ALIAS):
+    timeout = settings.BOARDINGHOUSE_RECENT_ACTIVITY_TIMEOUT
+    if not timeout or not _ledger_exists(connections[using]):
+        return []
+    schemata = list(get_schema_model().objects.using(using).values_list('pk', flat=True))
+    active = cache.get_many([_activity_key(schema) for schema in schemata])
+    # A schema that is already behind will be brought up to date on activation.
+    pending = pending_migrations(schemata, using=using)
+    return sorted(
+        schema for schema in schemata
+        if _activity_key(schema) in active and schema not in pending
+    )
+
+
+def eager_schemata(using=DEFAULT_DB_ALIAS):
+    """
+    The schemata that are migrated along with the template schema when
+    migrations are deferred: those that have been activated recently, and
+    are not behind.
+
+    While the migrate command is running, these are the ones that were found
+    when it started.
+    """
+    if _eager_schemata is not None:
+        return _eager_schemata
+    return _find_eager_schemata(using)
+
+
+def deferring():
+    """
+    Whether migrations to the schemata (other than the :func:`eager_schemata`)
+    are being deferred.
+    """
+    return settings.BOARDINGHOUSE_DEFER_SCHEMA_MIGRATIONS and not _undeferrable
+
+
+def _alters_private_tables(sql):
+    if isinstance(sql, (list, tuple)):
+        return any(
+            _alters_private_tables(each[0] if isinstance(each, (list, tuple)) else each)
+            for each in sql
+        )
+    for match in classify_sql(sql):
+        # The table of an index that is being dropped may not exist yet.
+        if isinstance(match, IndexName):
+            return True
+        if match and not match[1] and not is_shared_table(match[0]):
+            return True
+    return False
+
+
+def cannot_defer(migration):
+    """
+    Whether a migration has operations that would not be applied to a
+    schema that is brought up to date later: ``RunPython`` (which may
+    change the objects in any schema), or ``RunSQL`` that alters private
+    tables.
+    """
+    for operation in migration.operations:
+        if isinstance(operation, RunPython) and operation.code is not RunPython.noop:
+            return True
+        if isinstance(operation, RunSQL) and _alters_private_tables(operation.sql):
+            return True
+    return False
+
+
+def start_migrating(plan=None, using=DEFAULT_DB_ALIAS):
+    """
+    Find the schemata that are migrated along with the template schema,
+    before any of the migrations in the plan are applied.
+
+    If any of those migrations cannot be deferred (see :func:`cannot_defer`),
+    then every schema that is behind is brought up to date now, and every
+    schema is migrated.
+    """
+    global _eager_schemata, _undeferrable
+    _eager_schemata = None
+    _undeferrable = False
+    undeferrable = [
+        migration for migration, backwards in plan or []
+        if not backwards and cannot_defer(migration)
+    ]
+    if undeferrable:
+        LOGGER.warning(
+            'Migrations to the schemata are not deferred, as %s cannot be',
+            ', '.join('{0}.{1}'.format(migration.app_label, migration.name) for migration in undeferrable)
+        )
+        _undeferrable = True
+        if _ledger_exists(connections[using]):
+            migrate_schemata(using=using)
+    else:
+        _eager_schemata = _find_eager_schemata(using)
+
+
+def finish_migrating():
+    """
+    Forget the schemata found by :func:`start_migrating`, and which schemata
+    this process has seen are up to date, as they may not be any longer.
+    """
+    global _eager_schemata, _undeferrable
+    _eager_schemata = None
+    _undeferrable = False
+    _current_schemata.clear()
+
+
+def migrate_on_activation(schema, connection=None):
+    """
+    Bring the schema up to date on the connection that it is being activated
+    on (or the default one), if it is behind, holding an advisory lock on it
+    while doing so. Each process only checks this once per schema (and
+    database), until it next runs migrate.
+
+    Inside a transaction the lock is held until that transaction ends, so
+    that another process cannot see the schema as behind until the changes
+    have been committed.
+
+    A schema that is being lazily activated (part-way through executing some
+    other statement) is not migrated there: :class:`boardinghouse.exceptions.SchemaNotReady`
+    is raised instead. :class:`boardinghouse.middleware.SchemaMiddleware`
+    brings a lazily activated schema up to date before the view is called,
+    so this should only happen when a view activates another schema lazily.
+    """
+    connection = connection or default_connection
+    key = (connection.alias, schema)
+    if key in _current_schemata or getattr(_migrating, 'schema', None) == key:
+        return
+
+    if pending_migrations([schema], using=connection.alias):
+        if getattr(connection, 'activating_lazily', False):
+            raise SchemaNotReady(schema)
+        if connection.in_atomic_block:
+            lock, unlock = 'SELECT pg_advisory_xact_lock(%s, hashtext(%s))', None
+        else:
+            lock, unlock = 'SELECT pg_advisory_lock(%s, hashtext(%s))', 'SELECT pg_advisory_unlock(%s, hashtext(%s))'
+        cursor = connection.cursor()
+        cursor.execute(lock, [ADVISORY_LOCK_KEY, schema])
+        _migrating.schema = key
+        try:
+            # Another process may have done this while we waited for the lock.
+            migrate_schemata([schema], using=connection.alias)
+        finally:
+            _migrating.schema = None
+            if unlock:
+                cursor.execute(unlock, [ADVISORY_LOCK_KEY, schema])
+            cursor.close()
+
+    _current_schemata.add(key)
+
+
+def _operation_states(migration, project_state):
+    """
+    Move the project state forwards through the operations of a migration,
+    returning (operation, from_state, to_state) for each of them.
+    """
+    steps = []
+    from_state = project_state.clone()
+    for operation in migration.operations:
+        operation.state_forwards(migration.app_label, project_state)
+        to_state = project_state.clone()
+        steps.append((operation, from_state, to_state))
+        from_state = to_state
+    return steps
+
+
+def apply_to_schema(migration, steps, schema_editor):
+    """
+    Apply the operations of a migration using a schema editor that only
+    alters one schema.
+    """
+    for operation, from_state, to_state in steps:
+        if not isinstance(operation, RunPython):
+            operation.database_forwards(migration.app_label, schema_editor, from_state, to_state)
+
+
+def migrate_schemata(schemata=None, using=DEFAULT_DB_ALIAS):
+    """
+    Bring each of the schemata (or every schema) that is behind up to date,
+    one migration at a time, and return a mapping of each schema that was
+    migrated to the list of migrations that were applied to it.
+    """
+    from .models import SchemaMigration
+
+    connection = connections[using]
+    pending = pending_migrations(schemata, using=using)
+    if not pending:
+        return {}
+
+    executor = MigrationExecutor(connection)
+    plan = [
+        migration for migration, backwards
+        in executor.migration_plan(executor.loader.graph.leaf_nodes(), clean_start=True)
+    ]
+
+    # Schemata that are missing the same migrations can share the work of
+    # building the project state for each of those migrations.
+    groups = defaultdict(list)
+    for schema, keys in pending.items():
+        groups[frozenset(keys)].append(schema)
+
+    applied = defaultdict(list)
+    for keys, group in groups.items():
+        group.sort()
+        state = ProjectState(real_apps=list(executor.loader.unmigrated_apps))
+        remaining = set(keys)
+        for migration in plan:
+            if not remaining:
+                break
+            key = (migration.app_label, migration.name)
+            if key not in remaining:
+                state = migration.mutate_state(state, preserve=False)
+                continue
+            remaining.remove(key)
+            # Render the models once, rather than for each schema.
+            state.apps
+            steps = _operation_states(migration, state)
+            for schema in group:
+                with connection.schema_editor(atomic=migration.atomic, schema=schema) as editor:
+                    apply_to_schema(migration, steps, editor)
+                    SchemaMigration.objects.using(using).create(schema=schema, app=key[0], name=key[1])
+                applied[schema].append(key)
+                LOGGER.info('Applied migration %s.%s to schema %s', key[0], key[1], schema)
+
+        # Anything left has been squashed, or no longer exists: there is
+        # nothing to apply, but it should no longer be seen as pending.
+        SchemaMigration.objects.using(using).bulk_create([
+            SchemaMigration(schema=schema, app=app, name=name)
+            for schema in group for (app, name) in sorted(remaining)
+        ])
+
+    return dict(applied)
@@ -0,0 +1,42 @@
+"""
+:mod:`boardinghouse.management.commands.fill_spare_schemata`
+
+Clone the template schema until there are ``settings.BOARDINGHOUSE_SPARE_SCHEMATA``
+spare schemata ready to be used by new schemata, after dropping any that were
+cloned before the template schema was last migrated (see
+:mod:`boardinghouse.spares`).
+
+With ``--size``, keep that many spare schemata ready instead. With
+``--interval``, keep running, and fill the pool again every that many seconds.
+"""
+import time
+
+from django.core.management import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from ...spares import fill
+
+
+class Command(BaseCommand):
+    help = 'Create spare clones of the template schema, for new schemata to use.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', action='store', dest='size', type=int, default=None,
+            help='How many spare schemata to keep. Defaults to settings.BOARDINGHOUSE_SPARE_SCHEMATA.')
+        parser.add_argument(
+            '--interval', action='store', dest='interval', type=float, default=None,
+            help='Keep running, filling the pool every INTERVAL seconds.')
+        parser.add_argument(
+            '--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to fill. Defaults to the "default" database.')
+
+    def handle(self, *args, **options):
+        while True:
+            created, dropped = fill(options['size'], using=options['database'])
+            if dropped:
+                self.stdout.write('Dropped {0} out of date spare schemata.'.format(len(dropped)))
+            self.stdout.write('Created {0} spare schemata.'.format(len(created)))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
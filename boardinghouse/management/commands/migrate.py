@@ -0,0 +1,40 @@
+"""
+:mod:`boardinghouse.management.commands.migrate`
+
+This replaces the ``migrate`` command with one that keeps the per-schema
+migration ledger (see :mod:`boardinghouse.ledger`) in step with the
+migrations that django records as applied (or unapplied), on the database
+that is being migrated.
+"""
+from django.core.management.commands import migrate
+from django.db import connections
+
+from ... import ledger
+
+
+class Command(migrate.Command):
+    def handle(self, *args, **options):
+        self.database = options['database']
+        # Once the ledger exists, applying migrations will not remove it.
+        self.ledger_exists = False
+        super(Command, self).handle(*args, **options)
+
+    def migration_progress_callback(self, action, migration=None, fake=False):
+        super(Command, self).migration_progress_callback(action, migration, fake)
+        if action not in ('apply_success', 'unapply_success'):
+            return
+
+        connection = connections[self.database]
+        if action == 'apply_success':
+            self.ledger_exists = self.ledger_exists or ledger._ledger_exists(connection)
+            if not self.ledger_exists:
+                return
+            record = ledger.record_applied
+        else:
+            if not ledger._ledger_exists(connection):
+                return
+            record = ledger.record_unapplied
+
+        # As django does, record each of the migrations a squashed one replaces.
+        for app, name in migration.replaces or [(migration.app_label, migration.name)]:
+            record(connection, app, name)
@@ -0,0 +1,45 @@
+"""
+:mod:`boardinghouse.management.commands.migrate_schemata`
+
+Bring the schemata that are behind up to date with the migrations that
+have been applied to the shared schema (see :mod:`boardinghouse.ledger`).
+
+Schemata may be named as arguments: otherwise every schema that is behind
+is migrated. Each migration is applied to each schema in its own
+transaction, so if this is interrupted it may just be run again.
+
+With ``--list``, the schemata that are behind are listed, along with how
+many migrations each of them is missing, but nothing is migrated.
+"""
+from django.core.management import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from ...ledger import migrate_schemata, pending_migrations
+
+
+class Command(BaseCommand):
+    help = 'Apply migrations to the schemata that have not had them applied yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('schemata', nargs='*', help='Only migrate these schemata.')
+        parser.add_argument(
+            '--list', action='store_true', dest='list', default=False,
+            help='List the schemata that are behind, without migrating them.')
+        parser.add_argument(
+            '--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to migrate. Defaults to the "default" database.')
+
+    def handle(self, *args, **options):
+        schemata = options['schemata'] or None
+        using = options['database']
+
+        if options['list']:
+            for schema, migrations in sorted(pending_migrations(schemata, using=using).items()):
+                self.stdout.write('{0}: {1} migrations'.format(schema, len(migrations)))
+            return
+
+        applied = migrate_schemata(schemata, using=using)
+        for schema, migrations in sorted(applied.items()):
+            self.stdout.write('{0}: applied {1} migrations'.format(schema, len(migrations)))
+        if not applied:
+            self.stdout.write('No schemata need migrating.')
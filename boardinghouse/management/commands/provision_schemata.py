@@ -0,0 +1,50 @@
+"""
+:mod:`boardinghouse.management.commands.provision_schemata`
+
+Create the schemata that are waiting to be provisioned, because they were
+saved while ``settings.BOARDINGHOUSE_ASYNC_PROVISIONING`` was set (see
+:mod:`boardinghouse.provisioning`), oldest first, and make them active.
+
+With ``--limit``, create at most that many schemata. With ``--retry``, also
+try again to create those that could not be created before. With
+``--interval``, keep running, and look for waiting schemata every that many
+seconds.
+"""
+import time
+
+from django.core.management import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from ...provisioning import provision
+
+
+class Command(BaseCommand):
+    help = 'Create the schemata that are waiting to be provisioned.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', action='store', dest='limit', type=int, default=None,
+            help='Create at most this many schemata.')
+        parser.add_argument(
+            '--retry', action='store_true', dest='retry', default=False,
+            help='Try again to create schemata that could not be created before.')
+        parser.add_argument(
+            '--interval', action='store', dest='interval', type=float, default=None,
+            help='Keep running, looking for waiting schemata every INTERVAL seconds.')
+        parser.add_argument(
+            '--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to provision schemata in. Defaults to the "default" database.')
+
+    def handle(self, *args, **options):
+        retry = options['retry']
+        while True:
+            created, failed = provision(options['limit'], retry=retry, using=options['database'])
+            for schema in created:
+                self.stdout.write('Created schema {0}.'.format(schema))
+            for schema in failed:
+                self.stderr.write('Could not create schema {0}.'.format(schema))
+            if not options['interval']:
+                return
+            # Only try again once.
+            retry = False
+            time.sleep(options['interval'])
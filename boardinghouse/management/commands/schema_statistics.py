@@ -0,0 +1,54 @@
+"""
+:mod:`boardinghouse.management.commands.schema_statistics`
+
+Collect the storage statistics of each schema (see :mod:`boardinghouse.statistics`),
+keep them for the admin to show, and list them, largest first.
+
+Schemata may be named as arguments: otherwise the statistics of every schema
+are collected. With ``--cached``, the statistics that were last collected
+are listed, without collecting them again.
+"""
+from __future__ import unicode_literals
+
+from django.core.management import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.template.defaultfilters import filesizeformat
+
+from ...models import SchemaStatistics
+from ...statistics import collect
+
+
+class Command(BaseCommand):
+    help = 'Collect and list the storage statistics of each schema.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('schemata', nargs='*', help='Only collect the statistics of these schemata.')
+        parser.add_argument(
+            '--cached', action='store_true', dest='cached', default=False,
+            help='List the statistics that were last collected, without collecting them again.')
+        parser.add_argument(
+            '--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to collect statistics from. Defaults to the "default" database.')
+
+    def handle(self, *args, **options):
+        schemata = options['schemata'] or None
+        using = options['database']
+
+        if options['cached']:
+            statistics = SchemaStatistics.objects.using(using).all()
+            if schemata:
+                statistics = statistics.filter(schema__in=schemata)
+        else:
+            statistics = collect(schemata, using=using)
+
+        self.stdout.write('{0:<36} {1:>12} {2:>12} {3:>12} {4:>12}'.format(
+            'schema', 'rows', 'table size', 'index size', 'sequence'
+        ))
+        for each in sorted(statistics, key=lambda each: (-each.total_size, each.schema)):
+            self.stdout.write('{0:<36} {1:>12} {2:>12} {3:>12} {4:>12}'.format(
+                each.schema,
+                each.row_estimate,
+                filesizeformat(each.table_size).replace('\xa0', ' '),
+                filesizeformat(each.index_size).replace('\xa0', ' '),
+                '-' if each.sequence_value is None else each.sequence_value,
+            ))
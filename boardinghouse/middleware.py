@@ -12,7 +12,10 @@ from django.http import (
 from django.shortcuts import redirect
 from django.utils.translation import ugettext_lazy as _
 
-from .exceptions import Forbidden, TemplateSchemaActivation, SchemaNotFound
+from . import ledger, profiling
+from .exceptions import Forbidden, TemplateSchemaActivation, SchemaNotFound, SchemaNotReady
+from .models import request_visible_schemata
+from .provisioning import is_provisioning
 from .schema import activate_schema, deactivate_schema
 from .signals import session_requesting_schema_change, session_schema_changed
 
@@ -56,6 +59,10 @@ def change_schema(request, schema):
     if schema == session.get('schema'):
         return
 
+    # A schema that is still being provisioned can't be used yet.
+    if settings.BOARDINGHOUSE_ASYNC_PROVISIONING and is_provisioning(schema):
+        raise SchemaNotReady(schema)
+
     # Valid schema providers should listen for this signal, and do one of three
     # things: return an object that has a 'schema' attribute, return None, or
     # raise an exception. Returning an object with an attribute of 'schema' will
@@ -138,18 +145,41 @@ class SchemaMiddleware(object):
 
     You could also come up with other methods.
 
+    If ``settings.BOARDINGHOUSE_LAZY_ACTIVATION`` is set, then the schema
+    is not actually activated until the first query that refers to a
+    private table.
+
+    If ``settings.BOARDINGHOUSE_PROFILE_SAMPLE_RATE`` is set, then some
+    requests are profiled (see :mod:`boardinghouse.profiling`).
+
     """
     def __init__(self, get_response=None):
         # We should remove ourself if... when?
         self.get_response = get_response
 
     def __call__(self, request):
+        response = None
+        profiling.begin()
         try:
-            return self.process_request(request) or self.get_response(request)
-        except (TemplateSchemaActivation, ProgrammingError) as exception:
-            return self.process_exception(request, exception)
+            response = self.process_request(request) or self.get_response(request)
+        except (TemplateSchemaActivation, SchemaNotFound, SchemaNotReady, ProgrammingError) as exception:
+            response = self.process_exception(request, exception)
+        finally:
+            profiling.end(request, response)
+        return response
 
     def process_request(self, request):
+        with profiling.timed('middleware'):
+            return self.change_session_schema(request) or self.activate_session_schema(
+                request, lazy=settings.BOARDINGHOUSE_LAZY_ACTIVATION
+            )
+
+    def change_session_schema(self, request):
+        """
+        Handle any of the ways of changing the schema in this request: if
+        that needs a response to be returned instead of calling the view,
+        return that response.
+        """
         FORBIDDEN = HttpResponseForbidden(_('You may not select that schema'))
         # Ways of changing the schema.
         # 1. URL /__change_schema__/<name>/
@@ -199,17 +229,30 @@ class SchemaMiddleware(object):
             except Forbidden:
                 return FORBIDDEN
 
-        elif 'schema' not in request.session and len(request.user.visible_schemata) == 1:
-            change_schema(request, request.user.visible_schemata[0].schema)
+        elif 'schema' not in request.session:
+            schemata = request_visible_schemata(request)
+            if len(schemata) == 1:
+                change_schema(request, schemata[0].schema)
+
+    def activate_session_schema(self, request, lazy=False):
+        """
+        Activate the schema stored in the session (or deactivate, if there
+        is none).
 
+        A schema that is lazily activated is brought up to date now, if
+        ``settings.BOARDINGHOUSE_MIGRATE_ON_ACTIVATION`` is set, rather than
+        part-way through the first query that needs it.
+        """
         if 'schema' in request.session:
             try:
-                activate_schema(request.session['schema'])
+                activate_schema(request.session['schema'], lazy=lazy)
+                if lazy and settings.BOARDINGHOUSE_MIGRATE_ON_ACTIVATION:
+                    ledger.migrate_on_activation(request.session['schema'])
             except SchemaNotFound:
                 deactivate_schema()
                 request.session.pop('schema')
         else:
-            deactivate_schema()
+            deactivate_schema(lazy=lazy)
 
     def process_exception(self, request, exception):
         """
@@ -220,6 +263,16 @@ class SchemaMiddleware(object):
 
         In the case we had a :class:`TemplateSchemaActivation` exception,
         then we want to remove that key from the session.
+
+        In the case we had a :class:`SchemaNotFound` exception (which can
+        only happen here when lazily activating), then we remove that key
+        from the session too, and (if it was a GET or HEAD) try the request
+        again. Other requests may have done something already, so are not
+        repeated: they get a 409 (Conflict) response instead.
+
+        In the case we had a :class:`SchemaNotReady` exception, the schema
+        that was requested has not been created yet: the request may be
+        made again shortly.
         """
         if isinstance(exception, ProgrammingError) and not request.session.get('schema'):
             if re.search('relation ".*" does not exist', exception.args[0]):
@@ -246,4 +299,19 @@ class SchemaMiddleware(object):
             request.session.pop('schema', None)
             return HttpResponseForbidden(_('You may not select that schema'))
 
+        # When the schema is lazily activated, a schema that no longer exists
+        # is only noticed part-way through the view. Forget about it, and
+        # have the request made again without a schema, if that is safe.
+        if isinstance(exception, SchemaNotFound):
+            deactivate_schema()
+            request.session.pop('schema', None)
+            if request.method in ('GET', 'HEAD'):
+                return HttpResponseRedirect(request.get_full_path())
+            return HttpResponse(_('That schema no longer exists'), status=409)
+
+        if isinstance(exception, SchemaNotReady):
+            response = HttpResponse(_('That schema is not ready yet'), status=503)
+            response['Retry-After'] = '5'
+            return response
+
         raise exception
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.migrations.recorder import MigrationRecorder
+import django.utils.timezone
+
+import boardinghouse.base
+
+
+def record_existing_schemata(apps, schema_editor):
+    # Every existing schema has had every migration applied to it.
+    Schema = apps.get_model(*settings.BOARDINGHOUSE_SCHEMA_MODEL.split('.'))
+    SchemaMigration = apps.get_model('boardinghouse', 'SchemaMigration')
+    quote_name = schema_editor.connection.ops.quote_name
+    schema_editor.connection.cursor().execute(
+        'INSERT INTO {ledger} (schema, app, name, applied) '
+        'SELECT s.{schema}, m.app, m.name, m.applied FROM {schema_table} s, {migrations} m'.format(
+            ledger=quote_name(SchemaMigration._meta.db_table),
+            schema=quote_name(Schema._meta.pk.column),
+            schema_table=quote_name(Schema._meta.db_table),
+            migrations=quote_name(MigrationRecorder.Migration._meta.db_table),
+        )
+    )
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.BOARDINGHOUSE_SCHEMA_MODEL),
+        ('boardinghouse', '0005_group_views'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchemaMigration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema', models.CharField(max_length=36)),
+                ('app', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('applied', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            bases=(boardinghouse.base.SharedSchemaMixin, models.Model),
+        ),
+        migrations.AlterUniqueTogether(
+            name='schemamigration',
+            unique_together=set([('schema', 'app', 'name')]),
+        ),
+        migrations.RunPython(record_existing_schemata, noop),
+    ]
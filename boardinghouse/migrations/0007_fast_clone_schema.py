@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+
+from django.conf import settings
+from django.db import migrations
+
+with open(os.path.join(os.path.dirname(__file__), '..', 'sql', 'clone_schema.004.sql')) as fp:
+    FORWARDS = fp.read()
+with open(os.path.join(os.path.dirname(__file__), '..', 'sql', 'clone_schema.003.sql')) as fp:
+    # This version sets the search path (to the public schema) and leaves it
+    # set: restore the search path when the function returns instead, as the
+    # new version does, so that the connection still knows what it is.
+    REVERSE = fp.read().replace(
+        "  -- I seemed to be getting errors if I didn't do this.\n  SET search_path TO public;\n", ''
+    ).replace(
+        '$$ LANGUAGE plpgsql VOLATILE;', '$$ LANGUAGE plpgsql VOLATILE SET search_path = {public_schema};', 1
+    )
+
+
+class CloneSchema(migrations.RunSQL):
+    def __init__(self, *args, **kwargs):
+        super(CloneSchema, self).__init__(sql='', reverse_sql=REVERSE)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self.sql = FORWARDS.format(public_schema=settings.PUBLIC_SCHEMA)
+        super(CloneSchema, self).database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self.reverse_sql = REVERSE.replace('{public_schema}', schema_editor.quote_name(settings.PUBLIC_SCHEMA))
+        super(CloneSchema, self).database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boardinghouse', '0006_schemamigration'),
+    ]
+
+    operations = [
+        CloneSchema(),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+
+from django.db import migrations
+
+with open(os.path.join(os.path.dirname(__file__), '..', 'sql', 'clone_schemata.001.sql')) as fp:
+    CLONE_SCHEMATA = fp.read()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boardinghouse', '0007_fast_clone_schema'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=CLONE_SCHEMATA, reverse_sql='DROP FUNCTION clone_schemata(text, text[], boolean)'),
+    ]
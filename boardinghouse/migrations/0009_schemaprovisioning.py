@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+import boardinghouse.base
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boardinghouse', '0008_clone_schemata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchemaProvisioning',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema', models.CharField(max_length=36, unique=True)),
+                ('clone', models.CharField(blank=True, default='', max_length=63)),
+                ('is_active', models.BooleanField(default=True)),
+                ('state', models.CharField(
+                    choices=[('pending', 'pending'), ('failed', 'failed')], default='pending', max_length=8)),
+                ('error', models.TextField(blank=True, default='')),
+                ('requested', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            bases=(boardinghouse.base.SharedSchemaMixin, models.Model),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+import boardinghouse.base
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boardinghouse', '0009_schemaprovisioning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchemaStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema', models.CharField(max_length=36, unique=True)),
+                ('tables', models.PositiveIntegerField(default=0)),
+                ('table_size', models.BigIntegerField(default=0)),
+                ('index_size', models.BigIntegerField(default=0)),
+                ('row_estimate', models.BigIntegerField(default=0)),
+                ('sequence_value', models.BigIntegerField(blank=True, null=True)),
+                ('collected', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'schema statistics',
+            },
+            bases=(boardinghouse.base.SharedSchemaMixin, models.Model),
+        ),
+    ]
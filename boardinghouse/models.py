@@ -6,12 +6,17 @@ from django.conf import settings
 from django.core.cache import cache
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models.query import ModelIterable
 from django.forms import ValidationError
-from django.utils import six
+from django.utils import six, timezone
 from django.utils.translation import ugettext_lazy as _
 
 from .base import SharedSchemaMixin
-from .schema import _schema_exists, activate_schema, deactivate_schema
+from .profiling import timed
+from .schema import (
+    _schema_exists, activate_schema, deactivate_schema, get_active_schema_name,
+    cache_generation, get_cached_schemata, is_shared_model, schema_cache,
+)
 from . import signals
 
 LOGGER = logging.getLogger(__name__)
@@ -28,27 +33,39 @@ schema_name_validator = RegexValidator(
 
 class SchemaQuerySet(models.query.QuerySet):
     def bulk_create(self, *args, **kwargs):
-        # Normally a bulk_create would not trigger the post_save signal for
-        # each instance. We need to rely on that firing to create the actual
-        # database schema, so we manually trigger that signal.
+        # Normally a bulk_create would not trigger the post_save signal that
+        # creates the actual database schema, so we create all of them here
+        # (in one query), and then send post_save for each of them, marked so
+        # that the receiver that creates the schema skips them.
+        from .receivers import create_schemata
+
         created = super(SchemaQuerySet, self).bulk_create(*args, **kwargs)
-        for schema in created:
-            models.signals.post_save.send(sender=self.model,
-                                          instance=schema,
-                                          created=True)
+        if created:
+            create_schemata(self.model, created)
+            schema_cache.delete(*[schema.schema for schema in created])
+            invalidate_visible_schemata()
+            for schema in created:
+                schema._schema_created = True
+                try:
+                    models.signals.post_save.send(
+                        sender=self.model, instance=schema, created=True,
+                        update_fields=None, raw=False, using=self.db,
+                    )
+                finally:
+                    del schema._schema_created
         cache.delete('active-schemata')
         return created
 
     def mass_create(self, *args):
         # A helper method that creates schemata with name/schema the same.
         # Perhaps it could slugify the schema value?
-        self.bulk_create([self.model(name=x, schema=x) for x in args])
-        cache.delete('active-schemata')
-        # Need to be able to supply the schemata in the order they were passed in,
-        # but a version that has been loaded from the database: otherwise the database
-        # will not be set, and using these will fail.
-        schemata = {x.schema: x for x in self.model.objects.filter(schema__in=args)}
-        return [schemata[x] for x in args]
+        created = self.bulk_create([self.model(name=x, schema=x) for x in args])
+        # These need to know which database they were saved to, otherwise
+        # using them will fail: rather than loading them all again, tell them.
+        for schema in created:
+            schema._state.adding = False
+            schema._state.db = self.db
+        return created
 
     def active(self):
         return self.filter(is_active=True)
@@ -63,10 +80,29 @@ class SchemaQuerySet(models.query.QuerySet):
             signals.schemata_deleted.send(sender=self.model, schemata=schemata, connection=connection)
         else:
             self.update(is_active=False)
+            schema_cache.clear()
+            cache.delete('active-schemata')
+            invalidate_visible_schemata()
 
     def activate(self, pk):
         self.get(pk=pk).activate()
 
+    def collect_statistics(self):
+        """
+        Gather the storage statistics of each of these schemata, and keep
+        them (see :mod:`boardinghouse.statistics`).
+        """
+        from .statistics import collect
+        return collect(self.values_list('schema', flat=True), using=self.db)
+
+    def with_statistics(self):
+        """
+        Annotate each schema with its most recently collected statistics
+        (this needs Django 1.11 or later).
+        """
+        from .statistics import annotate
+        return annotate(self)
+
 
 @six.python_2_unicode_compatible
 class AbstractSchema(SharedSchemaMixin, models.Model):
@@ -137,6 +173,21 @@ class AbstractSchema(SharedSchemaMixin, models.Model):
     def deactivate(cls, cursor=None):
         deactivate_schema()
 
+    @property
+    def statistics(self):
+        """
+        The most recently collected storage statistics for this schema, or
+        ``None`` if they have never been collected.
+        """
+        return SchemaStatistics.objects.filter(schema=self.schema).first()
+
+    def collect_statistics(self):
+        """
+        Gather the storage statistics of this schema, and keep them.
+        """
+        from .statistics import collect
+        return collect([self.schema])[0]
+
 
 class Schema(AbstractSchema):
     """
@@ -157,6 +208,92 @@ class Schema(AbstractSchema):
         swappable = 'BOARDINGHOUSE_SCHEMA_MODEL'
 
 
+@six.python_2_unicode_compatible
+class SchemaMigration(SharedSchemaMixin, models.Model):
+    """
+    A record of a migration having been applied to a schema.
+
+    This is kept for each schema, as well as the record django keeps in
+    the shared schema, so that schemata that have not yet had all of the
+    migrations applied to them can be found (and migrated) later: see
+    :mod:`boardinghouse.ledger`.
+    """
+    schema = models.CharField(max_length=36)
+    app = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    applied = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        app_label = 'boardinghouse'
+        unique_together = ('schema', 'app', 'name')
+
+    def __str__(self):
+        return '{0}.{1} in {2}'.format(self.app, self.name, self.schema)
+
+
+@six.python_2_unicode_compatible
+class SchemaProvisioning(SharedSchemaMixin, models.Model):
+    """
+    A schema that has been saved, but not yet created in the database,
+    because it is being provisioned asynchronously: see
+    :mod:`boardinghouse.provisioning`.
+
+    ``clone`` is the schema it should be a copy of (including the records),
+    if not the template schema, and ``is_active`` is whether the schema
+    should be active once it has been created.
+    """
+    PENDING = 'pending'
+    FAILED = 'failed'
+    STATES = (
+        (PENDING, _('pending')),
+        (FAILED, _('failed')),
+    )
+
+    schema = models.CharField(max_length=36, unique=True)
+    clone = models.CharField(max_length=63, blank=True, default='')
+    is_active = models.BooleanField(default=True)
+    state = models.CharField(max_length=8, choices=STATES, default=PENDING)
+    error = models.TextField(blank=True, default='')
+    requested = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        app_label = 'boardinghouse'
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.schema, self.state)
+
+
+@six.python_2_unicode_compatible
+class SchemaStatistics(SharedSchemaMixin, models.Model):
+    """
+    The storage statistics of a schema, as they were when they were last
+    collected: see :mod:`boardinghouse.statistics`.
+
+    Sizes are in bytes, and the number of rows is the estimate that
+    PostgreSQL keeps (which is updated by ``VACUUM`` and ``ANALYZE``).
+    ``sequence_value`` is the largest value that any sequence in the
+    schema has reached.
+    """
+    schema = models.CharField(max_length=36, unique=True)
+    tables = models.PositiveIntegerField(default=0)
+    table_size = models.BigIntegerField(default=0)
+    index_size = models.BigIntegerField(default=0)
+    row_estimate = models.BigIntegerField(default=0)
+    sequence_value = models.BigIntegerField(null=True, blank=True)
+    collected = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        app_label = 'boardinghouse'
+        verbose_name_plural = 'schema statistics'
+
+    def __str__(self):
+        return 'statistics of {0}'.format(self.schema)
+
+    @property
+    def total_size(self):
+        return self.table_size + self.index_size
+
+
 # This is a bit of fancy trickery to stick the property _is_shared_model
 # on every model class, returning False, unless it has been explicitly
 # set to True in the model definition (see base.py for examples).
@@ -171,6 +308,44 @@ def _is_shared_model(cls):
 models.Model._is_shared_model = ClassProperty(classmethod(_is_shared_model))
 
 
+# Every instance of a private model knows which schema it came from, as the
+# attribute _schema. Rather than setting that whenever any model instance is
+# created (which needs a post_init receiver, and so slows down instantiating
+# every model), it is set once per queryset on the objects that are fetched
+# (and when an object is saved: see receivers.py). Otherwise, it is only
+# looked up the first time it is used.
+class SchemaAttribute(object):
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if is_shared_model(owner):
+            raise AttributeError('_schema')
+        schema = instance.__dict__['_schema'] = get_active_schema_name()
+        return schema
+
+
+models.Model._schema = SchemaAttribute()
+
+
+__old_model_iterable_iter__ = ModelIterable.__iter__
+
+
+def __model_iterable_iter__(self):
+    if is_shared_model(self.queryset.model):
+        return __old_model_iterable_iter__(self)
+    return _with_schema(__old_model_iterable_iter__(self), get_active_schema_name())
+
+
+def _with_schema(objects, schema):
+    for obj in objects:
+        if '_schema' not in obj.__dict__:
+            obj._schema = schema
+        yield obj
+
+
+ModelIterable.__iter__ = __model_iterable_iter__
+
+
 # We need to monkey-patch __eq__ on models.Model
 __old_eq__ = models.Model.__eq__
 
@@ -187,15 +362,56 @@ models.Model.__eq__ = __eq__
 # Add a cached method that prevents user.schemata.all() queries from
 # being needlessly duplicated.
 def visible_schemata(user):
-    """The list of visible schemata for the given user.
+    """The queryset of visible schemata for the given user.
 
-    This is fetched from the cache, if the value is available. There are
+    Its results are fetched from the cache, if the value is available (see
+    :func:`boardinghouse.schema.get_cached_schemata`). There are
     signal listeners that automatically invalidate the cache when conditions
     that are detected that would indicate this value has changed.
     """
-    schemata = cache.get('visible-schemata-{0!s}'.format(user.pk))
-    if schemata is None:
-        schemata = user.schemata.active()
-        cache.set('visible-schemata-{0!s}'.format(user.pk), schemata)
+    return get_cached_schemata(
+        visible_schemata_cache_key(user.pk), user.schemata.active(), generation_key=SCHEMATA_GENERATION_KEY
+    )
+
+
+#: The cache key of the schemata generation, which is incremented whenever
+#: any schema changes: that invalidates the visible schemata of every user
+#: at once.
+SCHEMATA_GENERATION_KEY = 'schemata-generation'
+
+
+def visible_schemata_cache_key(user_pk):
+    """The cache key for the given user's visible schemata.
+
+    The value stored there is only used if the schemata generation has not
+    changed since.
+    """
+    return 'visible-schemata-{0!s}'.format(user_pk)
+
 
-    return schemata
+def invalidate_visible_schemata(user_pks=None):
+    """Invalidate the cached visible schemata of the given users.
+
+    If no users are given, then the cached visible schemata of all users
+    are invalidated, by incrementing the schemata generation.
+    """
+    if user_pks is None:
+        try:
+            cache.incr(SCHEMATA_GENERATION_KEY)
+        except ValueError:
+            cache_generation(SCHEMATA_GENERATION_KEY)
+    elif user_pks:
+        cache.delete_many([visible_schemata_cache_key(pk) for pk in user_pks])
+
+
+def request_visible_schemata(request):
+    """The (evaluated) list of visible schemata for the request's user.
+
+    This is only fetched once per request, however many times it is used.
+    """
+    try:
+        return request._visible_schemata
+    except AttributeError:
+        with timed('visible_schemata'):
+            request._visible_schemata = list(request.user.visible_schemata)
+        return request._visible_schemata
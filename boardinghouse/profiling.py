@@ -0,0 +1,146 @@
+"""
+Profiling of the time each request spends finding and activating schemata.
+
+When ``settings.BOARDINGHOUSE_PROFILE_SAMPLE_RATE`` is set, that fraction of
+the requests handled by :class:`boardinghouse.middleware.SchemaMiddleware` are
+profiled: the time spent in each of these is added up over the request:
+
+``activate``
+    Activating schemata: from :data:`boardinghouse.signals.schema_pre_activate`
+    to :data:`boardinghouse.signals.schema_post_activate` (including a lazily
+    activated schema, when it is actually activated by the view).
+
+``find_schema``
+    Finding schema objects by name (see :data:`boardinghouse.signals.find_schema`).
+
+``visible_schemata``
+    Fetching the schemata that the user may see.
+
+``middleware``
+    Everything the middleware does before calling the view, which includes
+    any of the above that happen then.
+
+The totals (in milliseconds) are logged (at ``INFO`` level), and if
+``settings.BOARDINGHOUSE_PROFILE_SERVER_TIMING`` is set, they are also added
+to the response in a ``Server-Timing`` header, so they show up in the browser's
+developer tools. Requests that are not profiled only pay for looking up a
+context variable at each of these points.
+"""
+from __future__ import unicode_literals
+
+import logging
+import random
+from collections import OrderedDict
+from timeit import default_timer
+
+from django.conf import settings
+
+from .schema import ContextVar, _ThreadLocalVar
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+_timings = (ContextVar or _ThreadLocalVar)('boardinghouse_timings', default=None)
+
+
+class Timings(object):
+    """
+    The time (in seconds) spent in each part of a profiled request.
+    """
+    def __init__(self):
+        self.durations = OrderedDict()
+        self._started = {}
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0) + seconds
+
+    def start(self, name):
+        self._started[name] = default_timer()
+
+    def stop(self, name):
+        started = self._started.pop(name, None)
+        if started is not None:
+            self.add(name, default_timer() - started)
+
+
+class timed(object):
+    """
+    A context manager that adds the time spent in it to the named part of
+    the current request, if it is being profiled.
+    """
+    __slots__ = ('name', 'timings')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _timings.get()
+        if self.timings is not None:
+            self.timings.start(self.name)
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.stop(self.name)
+
+
+def start(name):
+    """
+    Start timing the named part of the current request, if it is being profiled.
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings.start(name)
+
+
+def stop(name):
+    """
+    Stop timing the named part of the current request, if it is being profiled.
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings.stop(name)
+
+
+def begin():
+    """
+    Decide whether the request that is starting should be profiled (see
+    ``settings.BOARDINGHOUSE_PROFILE_SAMPLE_RATE``), and if so, start
+    profiling it.
+    """
+    rate = settings.BOARDINGHOUSE_PROFILE_SAMPLE_RATE
+    if rate and random.random() < rate:
+        _timings.set(Timings())
+        return True
+    return False
+
+
+def end(request, response):
+    """
+    Stop profiling the request (if it was being profiled), log the totals,
+    and add them to the response's ``Server-Timing`` header if
+    ``settings.BOARDINGHOUSE_PROFILE_SERVER_TIMING`` is set.
+
+    Returns the totals (in seconds), or ``None`` if the request was not
+    being profiled.
+    """
+    timings = _timings.get()
+    if timings is None:
+        return None
+    _timings.set(None)
+
+    durations = timings.durations
+    LOGGER.info(
+        '%s %s: %s', request.method, request.path,
+        ', '.join('{0} {1:.3f}ms'.format(name, seconds * 1000) for name, seconds in durations.items()) or '-'
+    )
+
+    if response is not None and settings.BOARDINGHOUSE_PROFILE_SERVER_TIMING and durations:
+        metrics = ', '.join(
+            'schema-{0};dur={1:.3f}'.format(name.replace('_', '-'), seconds * 1000)
+            for name, seconds in durations.items()
+        )
+        if response.has_header('Server-Timing'):
+            metrics = '{0}, {1}'.format(response['Server-Timing'], metrics)
+        response['Server-Timing'] = metrics
+
+    return durations
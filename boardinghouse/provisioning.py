@@ -0,0 +1,197 @@
+"""
+Asynchronous provisioning of new schemata.
+
+Creating a schema clones the template schema, which takes a while, and
+normally happens while the new schema object is being saved. If
+``settings.BOARDINGHOUSE_ASYNC_PROVISIONING`` is set, then a new schema
+object is saved as inactive instead, and a
+:class:`boardinghouse.models.SchemaProvisioning` row records that its schema
+still needs to be created.
+
+The ``provision_schemata`` management command (which may be left running
+with ``--interval``) creates the schemata that are waiting, each in its own
+transaction. It then makes each schema object active again (unless it was
+saved as inactive), and sends :data:`boardinghouse.signals.schema_created`
+and :data:`boardinghouse.signals.schemata_created` for it. Several of these
+may run at once: each one skips the schemata that another is creating (which
+it holds an advisory lock on).
+
+Until then, :class:`boardinghouse.middleware.SchemaMiddleware` refuses to
+change to the schema, and migrations are not applied to it (it will be
+cloned from the migrated template schema). A schema that could not be
+created is marked as failed, along with the error, and is only tried again
+when ``provision_schemata --retry`` is run.
+
+Spare schemata (see :mod:`boardinghouse.spares`) are still used straight
+away, while there are any.
+"""
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from . import ledger
+from .schema import _table_exists, get_schema_model, schema_cache
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+# The first key of the advisory lock held on a schema while it is being
+# provisioned: the second is the hash of the schema name.
+ADVISORY_LOCK_KEY = 0x6269
+
+
+def queue(instances, source, using=DEFAULT_DB_ALIAS):
+    """
+    Record that the schemata for these new schema objects (which will be
+    cloned from `source`) still need to be created, and make the schema
+    objects inactive until they have been.
+    """
+    from .models import SchemaProvisioning
+
+    schemata = [instance.schema for instance in instances]
+    SchemaProvisioning.objects.using(using).bulk_create([
+        SchemaProvisioning(
+            schema=instance.schema,
+            clone=getattr(instance, '_clone', ''),
+            is_active=instance.is_active,
+        )
+        for instance in instances
+    ])
+    get_schema_model().objects.using(using).filter(pk__in=schemata).update(is_active=False)
+    for instance in instances:
+        instance.is_active = False
+    # So they are not seen as being behind: they will be recorded again when
+    # they are created.
+    ledger.record_schemata_created(connections[using], schemata, source)
+
+    for schema in schemata:
+        LOGGER.info('New schema waiting to be provisioned: %s', schema)
+
+
+def queued(using=DEFAULT_DB_ALIAS):
+    """
+    The names of the schemata that are waiting to be created (including
+    those that could not be).
+    """
+    from .models import SchemaProvisioning
+
+    if not _table_exists(SchemaProvisioning._meta.db_table):
+        return []
+    return list(SchemaProvisioning.objects.using(using).values_list('schema', flat=True))
+
+
+def is_provisioning(schema, using=DEFAULT_DB_ALIAS):
+    """
+    Is this schema still waiting to be created?
+    """
+    from .models import SchemaProvisioning
+
+    return SchemaProvisioning.objects.using(using).filter(schema=schema).exists()
+
+
+def _next_job(states, exclude, using=DEFAULT_DB_ALIAS):
+    """
+    Lock the oldest schema that is waiting to be created in one of these
+    states (and is not excluded), skipping any that another process has
+    locked, and return its :class:`boardinghouse.models.SchemaProvisioning`.
+
+    Each job is locked with a transaction-level advisory lock, rather than
+    with ``FOR UPDATE SKIP LOCKED``, which needs PostgreSQL 9.5. The jobs
+    are ordered in a subquery, so that only the first one that could be
+    locked is.
+    """
+    from .models import SchemaProvisioning
+
+    opts = SchemaProvisioning._meta
+    quote_name = connections[using].ops.quote_name
+    sql = (
+        'SELECT * FROM ('
+        '  SELECT * FROM {table} '
+        '   WHERE {state} = ANY(%s) AND NOT ({schema} = ANY(%s)) '
+        '   ORDER BY {requested}, {pk}'
+        ') AS jobs WHERE pg_try_advisory_xact_lock(%s, hashtext(jobs.{schema})) LIMIT 1'
+    ).format(
+        table=quote_name(opts.db_table),
+        state=quote_name(opts.get_field('state').column),
+        schema=quote_name(opts.get_field('schema').column),
+        requested=quote_name(opts.get_field('requested').column),
+        pk=quote_name(opts.pk.column),
+    )
+    exclude = list(exclude)
+
+    while True:
+        jobs = list(SchemaProvisioning.objects.db_manager(using).raw(
+            sql, [list(states), exclude, ADVISORY_LOCK_KEY]
+        ))
+        if not jobs:
+            return None
+        # Another process may have finished it since the query started.
+        job = SchemaProvisioning.objects.using(using).select_for_update().filter(
+            pk=jobs[0].pk, state__in=states,
+        ).first()
+        if job is not None:
+            return job
+        exclude.append(jobs[0].schema)
+
+
+def provision(limit=None, retry=False, using=DEFAULT_DB_ALIAS):
+    """
+    Create the schemata that are waiting to be (at most `limit` of them),
+    oldest first, and return a list of those that were created, and a list
+    of those that could not be.
+
+    If `retry` is set, then those that could not be created before are
+    tried again.
+    """
+    from .models import SchemaProvisioning
+    from .receivers import create_schemata
+
+    Schema = get_schema_model()
+    connection = connections[using]
+    states = [SchemaProvisioning.PENDING]
+    if retry:
+        states.append(SchemaProvisioning.FAILED)
+
+    created = []
+    failed = []
+    while limit is None or len(created) + len(failed) < limit:
+        with transaction.atomic(using=using):
+            job = _next_job(states, failed, using)
+            if job is None:
+                break
+
+            try:
+                instance = Schema.objects.using(using).get(pk=job.schema)
+            except Schema.DoesNotExist:
+                # It was deleted before it was ever created.
+                job.delete()
+                continue
+            if job.clone:
+                instance._clone = job.clone
+
+            try:
+                with transaction.atomic(using=using):
+                    ledger.record_schemata_dropped(connection, [job.schema])
+                    create_schemata(Schema, [instance], queue=False)
+                    Schema.objects.using(using).filter(pk=job.schema).update(is_active=job.is_active)
+                    job.delete()
+            except Exception as exc:
+                LOGGER.exception('Schema could not be provisioned: %s', job.schema)
+                job.state = SchemaProvisioning.FAILED
+                job.error = '{0}: {1}'.format(exc.__class__.__name__, exc)
+                job.save()
+                failed.append(job.schema)
+            else:
+                created.append(job.schema)
+
+    if created:
+        from .models import invalidate_visible_schemata
+
+        schema_cache.delete(*created)
+        cache.delete('active-schemata')
+        invalidate_visible_schemata()
+
+    return created, failed
@@ -1,15 +1,22 @@
 import logging
+from collections import OrderedDict
 
 from django.conf import settings
 from django.core.cache import cache
-from django.db import connection, models
+from django.core.signals import request_finished
+from django.db import DEFAULT_DB_ALIAS, connection, models
 from django.dispatch import receiver
+from django.test.signals import setting_changed
 
-from boardinghouse import signals
+from boardinghouse import ledger, profiling, provisioning, signals, spares
+from boardinghouse.backends.postgres.base import clear_private_table_pattern
+from boardinghouse.backends.postgres.instrumentation import query_statistics
 from boardinghouse.exceptions import TemplateSchemaActivation, Forbidden
+from boardinghouse.models import invalidate_visible_schemata
 from boardinghouse.schema import (
-    _schema_exists, _schema_table_exists, activate_template_schema,
-    get_active_schema_name, get_schema_model, is_shared_model,
+    _batched_sql, _execute_in_schemata, _existing_schemata, _schema_table_exists, activate_template_schema,
+    clear_shared_models_cache, forget_dropped_schemata, get_active_schema_name, get_schema_model,
+    is_shared_model, schema_cache,
 )
 
 LOGGER = logging.getLogger(__name__)
@@ -27,32 +34,108 @@ def create_schema(sender, instance, created, **kwargs):
     those created using raw methods.
 
     How do we indicate when we should be using a different template?
+
+    Schemata created by :meth:`SchemaQuerySet.bulk_create` have already been
+    created (all at once) by the time this is sent for them.
     """
-    if created:
-        schema_name = instance.schema
+    if created and not getattr(instance, '_schema_created', False):
+        create_schemata(sender, [instance])
 
-        # How can we work out what values need to go here?
-        # Currently, we just allow a single attribute `_clone`, that,
-        # if set, will indicate that we should clone a schema.
+
+def create_schemata(sender, instances, queue=None):
+    """
+    Create the schemata for the given schema objects in the database.
+
+    All of those that are cloned from the same schema are created in a single
+    query, and :data:`boardinghouse.signals.schemata_created` is sent once,
+    after :data:`boardinghouse.signals.schema_created` has been sent for each.
+    They are all created in the current transaction, so creating a very large
+    number at once may need the server's ``max_locks_per_transaction`` to be
+    raised.
+
+    If `queue` is set (by default, if ``settings.BOARDINGHOUSE_ASYNC_PROVISIONING``
+    is), then schema model objects are left to be created later instead (see
+    :mod:`boardinghouse.provisioning`), unless there is a spare schema for them.
+    """
+    if queue is None:
+        queue = settings.BOARDINGHOUSE_ASYNC_PROVISIONING
+
+    existing = _existing_schemata([instance.schema for instance in instances])
+    if existing:
+        raise ValueError('Attempt to create an existing schema: {0}'.format(existing[0]))
+
+    # How can we work out what values need to go here?
+    # Currently, we just allow a single attribute `_clone`, that,
+    # if set, will indicate that we should clone a schema.
+    sources = OrderedDict()
+    for instance in instances:
         template_name = getattr(instance, '_clone', settings.TEMPLATE_SCHEMA)
         include_records = bool(getattr(instance, '_clone', False))
-
-        cursor = connection.cursor()
-
-        if _schema_exists(schema_name):
-            raise ValueError('Attempt to create an existing schema: {0}'.format(schema_name))
-
-        cursor.execute("SELECT clone_schema(%s, %s, %s)", [
-            template_name,
-            schema_name,
-            include_records
-        ])
-        cursor.close()
-
-        if schema_name != settings.TEMPLATE_SCHEMA:
-            signals.schema_created.send(sender=get_schema_model(), schema=schema_name)
-
-        LOGGER.info('New schema created: %s', schema_name)
+        sources.setdefault((template_name, include_records), []).append(instance)
+
+    cursor = connection.cursor()
+    created = []
+
+    for (template_name, include_records), group in sources.items():
+        schemata = [instance.schema for instance in group]
+
+        # Spare clones of the template schema may be ready (see boardinghouse.spares).
+        spare = {}
+        if settings.BOARDINGHOUSE_SPARE_SCHEMATA and template_name == settings.TEMPLATE_SCHEMA \
+                and not include_records:
+            for schema_name in schemata:
+                if schema_name != settings.TEMPLATE_SCHEMA:
+                    spare[schema_name] = spares.take(schema_name)
+                    if spare[schema_name] is None:
+                        break
+
+        clone = [schema_name for schema_name in schemata if spare.get(schema_name) is None]
+        if queue:
+            waiting = [
+                instance for instance in group
+                if instance.schema in clone and instance.schema != settings.TEMPLATE_SCHEMA and
+                isinstance(instance, get_schema_model())
+            ]
+            if waiting:
+                provisioning.queue(waiting, template_name)
+                waiting = {instance.schema for instance in waiting}
+                group = [instance for instance in group if instance.schema not in waiting]
+                schemata = [schema_name for schema_name in schemata if schema_name not in waiting]
+                clone = [schema_name for schema_name in clone if schema_name not in waiting]
+
+        if len(clone) == 1:
+            cursor.execute("SELECT clone_schema(%s, %s, %s)", [
+                template_name,
+                clone[0],
+                include_records
+            ])
+        elif clone:
+            cursor.execute("SELECT clone_schemata(%s, %s, %s)", [
+                template_name,
+                clone,
+                include_records
+            ])
+        ledger_schemata = [
+            instance.schema for instance in group
+            if instance.schema != settings.TEMPLATE_SCHEMA and isinstance(instance, get_schema_model())
+        ]
+        if ledger_schemata:
+            ledger.record_schemata_created(connection, ledger_schemata, template_name)
+
+        for schema_name in schemata:
+            if spare.get(schema_name) is None:
+                LOGGER.info('New schema created: %s', schema_name)
+            else:
+                LOGGER.info('New schema created: %s (from spare schema %s)', schema_name, spare[schema_name])
+            if schema_name != settings.TEMPLATE_SCHEMA:
+                created.append(schema_name)
+
+    cursor.close()
+
+    for schema_name in created:
+        signals.schema_created.send(sender=get_schema_model(), schema=schema_name)
+    if created:
+        signals.schemata_created.send(sender=get_schema_model(), schemata=created)
 
 
 @receiver(models.signals.post_delete, sender=Schema, weak=False)
@@ -63,35 +146,50 @@ def drop_schema(sender, instance, **kwargs):
 @receiver(signals.schemata_deleted, weak=False)
 def drop_schemata(sender, schemata, connection=None, **kwargs):
     from django import db
-    cursor = (connection or db.connection).cursor()
+    connection = connection or db.connection
+    cursor = connection.cursor()
     # Is there a way to do this without opening up an SQL injection hole?
     # I guess we have to rely on the fact that schema.schema is always a valid name...?
     sql = ';'.join(['DROP SCHEMA IF EXISTS {0} CASCADE'.format(schema) for schema in schemata])
+    schema_cache.delete(*schemata)
     if sql:
         cursor.execute(sql)
+        if sender is get_schema_model():
+            ledger.record_schemata_dropped(connection, schemata)
+        # We may have just dropped the schema that is in our search path (or
+        # in that of another connection).
+        connection.search_path = None
+        forget_dropped_schemata(schemata)
         for schema in schemata:
             LOGGER.info('Schema dropped: %s', schema)
 
 
-@receiver(models.signals.post_init, sender=None)
+@receiver(models.signals.pre_save, sender=None)
 def inject_schema_attribute(sender, instance, **kwargs):
     """
     A signal listener that injects the current schema on the object
-    just after it is instantiated.
+    just before it is saved, unless it already knows its schema.
 
-    You may use this in conjunction with :class:`MultiSchemaMixin`, it will
-    respect any value that has already been set on the instance.
+    Objects fetched from a queryset have this set already: any other
+    object only looks up its schema when it is first used.
     """
-    if is_shared_model(sender):
-        return
-    if not getattr(instance, '_schema', None):
+    if '_schema' not in instance.__dict__ and not is_shared_model(sender):
         instance._schema = get_active_schema_name()
 
 
 @receiver(signals.schema_aware_operation)
 def execute_on_all_schemata(sender, db_table, function, **kwargs):
     if _schema_table_exists():
-        for each in get_schema_model().objects.all():
+        # Schemata that are waiting to be provisioned do not exist yet.
+        schemata = get_schema_model().objects.exclude(pk__in=provisioning.queued())
+        if ledger.deferring():
+            # The others will be brought up to date later (see boardinghouse.ledger).
+            schemata = schemata.filter(pk__in=ledger.eager_schemata())
+        batched = _batched_sql(kwargs)
+        if batched:
+            _execute_in_schemata(schemata.values_list('schema', flat=True), *batched)
+            return
+        for each in schemata:
             each.activate()
             function(*kwargs.get('args', []), **kwargs.get('kwargs', {}))
 
@@ -102,18 +200,50 @@ def execute_on_template_schema(sender, db_table, function, **kwargs):
     function(*kwargs.get('args', []), **kwargs.get('kwargs', {}))
 
 
+@receiver(signals.schema_pre_activate, weak=False)
+def start_timing_activation(sender, **kwargs):
+    """
+    A signal listener that starts timing the activation of a schema, if the
+    current request is being profiled (see :mod:`boardinghouse.profiling`).
+    """
+    profiling.start('activate')
+
+
+@receiver(signals.schema_post_activate, weak=False)
+def stop_timing_activation(sender, **kwargs):
+    profiling.stop('activate')
+
+
+@receiver(signals.schema_pre_activate, weak=False)
+def migrate_on_activation(sender, schema_name, **kwargs):
+    """
+    A signal listener that records when each schema was last activated,
+    and brings a schema up to date the first time it is activated, if
+    the settings ask for that (see :mod:`boardinghouse.ledger`).
+    """
+    if schema_name in (None, settings.TEMPLATE_SCHEMA):
+        return
+    if settings.BOARDINGHOUSE_DEFER_SCHEMA_MIGRATIONS and settings.BOARDINGHOUSE_RECENT_ACTIVITY_TIMEOUT:
+        ledger.note_activity(schema_name)
+    if settings.BOARDINGHOUSE_MIGRATE_ON_ACTIVATION:
+        ledger.migrate_on_activation(schema_name, kwargs.get('connection'))
+
+
 @receiver(signals.session_requesting_schema_change)
 def check_schema_for_user(sender, schema, user, session, **kwargs):
     if schema == settings.TEMPLATE_SCHEMA:
         raise TemplateSchemaActivation()
 
     if not schema.startswith('_'):
-        try:
-            if user.is_superuser:
+        if user.is_superuser:
+            try:
                 return Schema.objects.get(schema=schema)
-            return user.visible_schemata.get(schema=schema)
-        except Schema.DoesNotExist:
-            raise Forbidden
+            except Schema.DoesNotExist:
+                raise Forbidden
+        for visible_schema in user.visible_schemata:
+            if visible_schema.schema == schema:
+                return visible_schema
+        raise Forbidden
 
 
 # Cache-related stuff.
@@ -124,24 +254,71 @@ if hasattr(Schema, 'users') and hasattr(Schema.users, 'through'):
     def invalidate_cache(sender, **kwargs):
         """
         A signal listener designed to invalidate the cache of a single
-        user's visible schemata items.
+        user's visible schemata items, once the change has been made.
         """
+        if kwargs['action'] not in ('post_add', 'post_remove', 'post_clear'):
+            return
         if kwargs['reverse']:
-            cache.delete('visible-schemata-{instance.pk}'.format(**kwargs))
-        else:
-            if kwargs['pk_set']:
-                for pk in kwargs['pk_set']:
-                    cache.delete('visible-schemata-{0}'.format(pk))
+            invalidate_visible_schemata([kwargs['instance'].pk])
+        elif kwargs['pk_set']:
+            invalidate_visible_schemata(kwargs['pk_set'])
+        elif kwargs['action'] == 'post_clear':
+            invalidate_visible_schemata()
 
     @receiver(models.signals.post_save, sender=Schema)
     def invalidate_all_user_caches(sender, **kwargs):
         """
         A signal listener that invalidates all schemata caches for all users
         who have access to the sender instance (schema).
+
+        Rather than finding each of those users, this invalidates the
+        visible schemata of every user, in one cache operation.
         """
         cache.delete('active-schemata')
-        for user in kwargs['instance'].users.values('pk'):
-            cache.delete('visible-schemata-{pk}'.format(**user))
+        invalidate_visible_schemata()
+
+
+@receiver(models.signals.post_save, sender=Schema, weak=False, dispatch_uid='invalidate-schema-cache')
+@receiver(models.signals.post_delete, sender=Schema, weak=False, dispatch_uid='invalidate-schema-cache')
+def invalidate_schema_cache(sender, instance, **kwargs):
+    """
+    A signal listener that removes a schema from the process-local cache
+    used by :func:`find_schema`.
+    """
+    schema_cache.delete(instance.schema)
+
+
+@receiver(setting_changed)
+def forget_shared_models(sender, setting, **kwargs):
+    """
+    A signal listener that forgets which models are shared when one of the
+    settings that determines that is changed.
+    """
+    if setting in ('SHARED_MODELS', 'PRIVATE_MODELS', 'BOARDINGHOUSE_SCHEMA_MODEL', 'AUTH_USER_MODEL', 'INSTALLED_APPS'):
+        clear_shared_models_cache()
+        clear_private_table_pattern()
+    elif setting == 'BOARDINGHOUSE_PRIVATE_TABLES':
+        clear_private_table_pattern()
+
+
+@receiver(setting_changed)
+def forget_query_statistics(sender, setting, **kwargs):
+    """
+    A signal listener that starts the per-schema query statistics again
+    (with new reporters) when one of the settings they depend on is changed.
+    """
+    if setting.startswith('BOARDINGHOUSE_QUERY_') or setting == 'BOARDINGHOUSE_STATSD_ADDRESS':
+        query_statistics.clear()
+
+
+@receiver(request_finished)
+def report_query_statistics(sender, **kwargs):
+    """
+    A signal listener that hands the per-schema query statistics to the
+    reporters, if it is time to.
+    """
+    if query_statistics.enabled:
+        query_statistics.report_if_due()
 
 
 @receiver(models.signals.pre_migrate)
@@ -153,6 +330,23 @@ def invalidate_all_caches(sender, **kwargs):
         cache.delete('active-schemata')
 
 
+@receiver(models.signals.pre_migrate, weak=False)
+def start_migrating(sender, **kwargs):
+    """
+    Find the schemata that should be migrated along with the template
+    schema when migrations are deferred, before any are applied.
+    """
+    if sender.name == 'boardinghouse' and settings.BOARDINGHOUSE_DEFER_SCHEMA_MIGRATIONS:
+        ledger.start_migrating(kwargs.get('plan'), using=kwargs.get('using', DEFAULT_DB_ALIAS))
+
+
+@receiver(models.signals.post_migrate, weak=False)
+def finish_migrating(sender, **kwargs):
+    if sender.name == 'boardinghouse':
+        ledger.finish_migrating()
+        clear_private_table_pattern()
+
+
 @receiver(signals.session_schema_changed, weak=False)
 def flush_user_perms_cache(sender, user, **kwargs):
     if hasattr(user, '_perm_cache'):
@@ -168,7 +362,39 @@ def find_schema(sender, schema, **kwargs):
     if schema == settings.TEMPLATE_SCHEMA:
         return Schema(name='Template schema', schema=settings.TEMPLATE_SCHEMA)
     if schema and not schema.startswith('_'):
-        try:
-            return Schema.objects.active().get(schema=schema)
-        except Schema.DoesNotExist:
-            return None
+        found, instance = schema_cache.get(schema)
+        if not found:
+            try:
+                instance = Schema.objects.active().get(schema=schema)
+            except Schema.DoesNotExist:
+                instance = None
+            schema_cache.set(schema, instance)
+        return instance
+
+
+@receiver(signals.find_schemata, weak=False)
+def find_schemata(sender, schemata, **kwargs):
+    """
+    Find all of the (regular) schemata at once: any that are not in the
+    process-local cache are fetched in a single query.
+    """
+    result = {}
+    missing = []
+
+    for schema in schemata:
+        if schema == settings.TEMPLATE_SCHEMA or schema.startswith('_'):
+            continue
+        found, instance = schema_cache.get(schema)
+        if found:
+            if instance:
+                result[schema] = instance
+        else:
+            missing.append(schema)
+
+    if missing:
+        fetched = {instance.schema: instance for instance in Schema.objects.active().filter(schema__in=missing)}
+        for schema in missing:
+            schema_cache.set(schema, fetched.get(schema))
+        result.update(fetched)
+
+    return result
@@ -1,22 +1,67 @@
-import inspect
+import copy
 import logging
+import sys
 import threading
+import time
+import weakref
+from collections import OrderedDict
 
-from django.apps import apps
+from django.apps import apps as global_apps
 from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.db import connection
 from django.db.migrations.operations.base import Operation
+from django.utils.encoding import force_text
 from django.utils.translation import lazy
 
 from .exceptions import TemplateSchemaActivation, SchemaNotFound
-from .signals import find_schema
+from .signals import find_schema, find_schemata as find_schemata_signal
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+    ContextVar = None
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(logging.NullHandler())
 
-_thread_locals = threading.local()
+
+class _ThreadLocalVar(threading.local):
+    """
+    A stand-in for :class:`contextvars.ContextVar` where that is not
+    available: the value is local to each thread instead.
+    """
+    def __init__(self, name, default=None):
+        self.name = name
+        self.value = default
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+# The active schema (and the lazily activated schema, see activate_schema())
+# are kept per-context, so that coroutines sharing a thread may each have
+# their own schema active.
+_active_schema = (ContextVar or _ThreadLocalVar)('boardinghouse_active_schema', default=None)
+# The lazily activated schema is kept for each database alias.
+_lazy_schemata = {}
+
+
+def _lazy_schema(alias):
+    """
+    The (per-context) variable that holds the schema lazily activated on
+    the connection with this alias.
+    """
+    try:
+        return _lazy_schemata[alias]
+    except KeyError:
+        return _lazy_schemata.setdefault(alias, (ContextVar or _ThreadLocalVar)(
+            'boardinghouse_lazy_schema_{0}'.format(alias), default=None
+        ))
 
 
 def get_schema_model():
@@ -24,7 +69,7 @@ def get_schema_model():
     Return the class that is currently set as the schema model.
     """
     try:
-        return apps.get_model(settings.BOARDINGHOUSE_SCHEMA_MODEL)
+        return global_apps.get_model(settings.BOARDINGHOUSE_SCHEMA_MODEL)
     except AttributeError:
         raise ImproperlyConfigured("BOARDINGHOUSE_SCHEMA_MODEL is not set: is 'boardinghouse' in your INSTALLED_APPS?")
     except ValueError:
@@ -43,12 +88,73 @@ def _get_search_path():
     return search_path
 
 
+# How many times this process has dropped schemata: a connection only trusts
+# the search path it has recorded if none have been dropped since then.
+_drop_generation = 0
+
+
+def forget_dropped_schemata(schemata):
+    """
+    Make every connection in this process check that the schema it has in
+    its search path still exists the next time that schema is activated,
+    and close any pooled connections that have one of the dropped schemata
+    in their search path.
+
+    A schema that is dropped by another process is not noticed when it is
+    activated on a connection that already has it in its search path: queries
+    of private tables will fail instead.
+    """
+    from .backends.postgres.pool import connection_pool
+
+    global _drop_generation
+    _drop_generation += 1
+    connection_pool.discard(schemata)
+
+
+def _ensure_connection(search_path):
+    """
+    Connect, if we are not already: a pooled connection that already has this
+    search path will be used if there is one (and may be swapped for the
+    current connection, see :mod:`boardinghouse.backends.postgres.pool`).
+    """
+    if hasattr(connection, 'wanted_search_path'):
+        connection.ensure_connection(search_path=search_path)
+
+
 def _set_search_path(search_path):
+    """
+    Set the search path, and return the schema postgres now reports as
+    being current.
+
+    This is done in a single query: if the schema does not exist, then
+    the returned value will not match the requested one, and we have not
+    needed a second round-trip to find that out.
+
+    The connection keeps a record of the search path we last set on it,
+    so if that is already the one we want (and no schemata have been dropped
+    since, see :func:`forget_dropped_schemata`), we don't need to hit the
+    database at all.
+    """
+    path = (search_path, settings.PUBLIC_SCHEMA)
+    _ensure_connection(path)
+    generation = _drop_generation
+    checked = getattr(connection, 'search_path_generation', None)
+    if getattr(connection, 'search_path', None) == path and checked in (None, generation):
+        return search_path
+
     cursor = connection.cursor()
-    cursor.execute('SET search_path TO %s,{0}'.format(settings.PUBLIC_SCHEMA),
-                   [search_path])
+    cursor.execute("""SELECT current_schema()
+                        FROM (SELECT set_config('search_path', quote_ident(%s) || ',' || quote_ident(%s), false)) AS search_path""",
+                   [search_path, settings.PUBLIC_SCHEMA])
+    found_schema = cursor.fetchone()[0]
     cursor.close()
 
+    if found_schema == search_path:
+        connection.search_path = path
+        connection.search_path_generation = generation
+
+    return found_schema
+
 
 def _schema_exists(schema_name, cursor=None):
     if cursor:
@@ -65,23 +171,38 @@ def _schema_exists(schema_name, cursor=None):
         cursor.close()
 
 
+def _existing_schemata(schema_names):
+    """
+    Which of the given schemata already exist in the database.
+    """
+    if not schema_names:
+        return []
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT nspname FROM pg_namespace WHERE nspname = ANY(%s)', [list(schema_names)])
+        existing = {schema_name for schema_name, in cursor.fetchall()}
+    finally:
+        cursor.close()
+    return [schema_name for schema_name in schema_names if schema_name in existing]
+
+
 def get_active_schema_name():
     """
     Get the currently active schema.
 
     This requires a database query to ask it what the current `search_path` is.
     """
-    active_schema = getattr(_thread_locals, 'schema', None)
+    active_schema = _active_schema.get()
 
     if not active_schema:
-        reported_schema = _get_search_path()[0]
+        reported_schema = _get_search_path()
 
         if _get_schema(reported_schema):
             active_schema = reported_schema
         else:
             active_schema = None
 
-        _thread_locals.schema = active_schema
+        _active_schema.set(active_schema)
 
     return active_schema
 
@@ -93,55 +214,212 @@ def get_active_schema():
     return _get_schema(get_active_schema_name())
 
 
-def get_active_schemata():
+#: The format of the cached lists of schemata: this is changed whenever that
+#: format changes, so that values cached by an older version are ignored.
+SCHEMATA_CACHE_VERSION = 3
+
+
+def cache_generation(key):
+    """
+    Get the counter in the cache at key, starting it if it is not there.
     """
-    Get a (cached) list of all currently active schemata.
+    generation = cache.get(key)
+    if generation is None:
+        # Start from a value that an evicted counter is very unlikely to have
+        # reached, so stale entries are not made valid again.
+        cache.add(key, int(time.time() * 1000))
+        generation = cache.get(key)
+    return generation
+
+
+def get_cached_schemata(key, queryset, generation_key=None):
     """
-    schemata = cache.get('active-schemata')
-    if schemata is None:
-        schemata = get_schema_model().objects.active()
-        cache.set('active-schemata', schemata)
+    Get the schemata in queryset, using the cache.
+
+    Only the values of the concrete fields of each schema are stored in the
+    cache (along with the names of those fields, and :data:`SCHEMATA_CACHE_VERSION`),
+    rather than the queryset itself. What is returned is a copy of the
+    queryset with its results filled in from those values: iterating over
+    it needs no query, but filtering it (or anything else that makes a new
+    queryset from it) does.
+
+    If ``generation_key`` is given, then the cached value is only used if the
+    counter at that key (see :func:`cache_generation`) has not changed since
+    it was stored: incrementing it invalidates all of those values at once.
+    The value and the counter are fetched in a single cache operation.
+    """
+    model = queryset.model
+    field_names = tuple(field.attname for field in model._meta.concrete_fields)
+
+    if generation_key is None:
+        cached, generation = cache.get(key), None
+    else:
+        values = cache.get_many([key, generation_key])
+        cached, generation = values.get(key), values.get(generation_key)
+        if generation is None:
+            generation = cache_generation(generation_key)
+
+    if isinstance(cached, tuple) and len(cached) == 4 and \
+            cached[:2] == (SCHEMATA_CACHE_VERSION, field_names) and cached[3] == generation:
+        rows = cached[2]
+    else:
+        rows = tuple(queryset.values_list(*field_names))
+        cache.set(key, (SCHEMATA_CACHE_VERSION, field_names, rows, generation))
+
+    schemata = queryset.all()
+    schemata._result_cache = [model.from_db(queryset.db, field_names, row) for row in rows]
     return schemata
 
 
+def get_active_schemata():
+    """
+    Get a (cached) queryset of all currently active schemata.
+    """
+    return get_cached_schemata('active-schemata', get_schema_model().objects.active())
+
+
 def _get_schema(schema_name):
     """
     Get the matching active schema object for the given name,
     if it exists.
     """
-    for handler, response in find_schema.send(sender=None, schema=schema_name):
-        if response:
-            return response
+    from .profiling import timed
+
+    with timed('find_schema'):
+        for handler, response in find_schema.send(sender=None, schema=schema_name):
+            if response:
+                return response
+
+
+def find_schemata(schema_names):
+    """
+    Get the matching active schema objects for all of the given names,
+    as a dict. Names that do not match a schema are not included.
 
+    Receivers of :data:`boardinghouse.signals.find_schemata` are asked to
+    find them all at once: any that none of them found are then looked for
+    one at a time.
+    """
+    from .profiling import timed
+
+    schema_names = set(name for name in schema_names if name)
+    found = {}
+
+    if schema_names:
+        with timed('find_schema'):
+            for handler, response in find_schemata_signal.send(sender=None, schemata=list(schema_names)):
+                if response:
+                    found.update(response)
+
+    for schema_name in schema_names.difference(found):
+        schema = _get_schema(schema_name)
+        if schema:
+            found[schema_name] = schema
+
+    return found
+
+
+class SchemaCache(object):
+    """
+    A process-local cache of schema name to schema object (or None, if no
+    such schema was found).
+
+    Entries expire after ``settings.BOARDINGHOUSE_SCHEMA_CACHE_TIMEOUT``
+    seconds, and when there are more than ``settings.BOARDINGHOUSE_SCHEMA_CACHE_SIZE``
+    entries, the least recently used ones are discarded.
 
-def activate_schema(schema_name):
+    Each lookup returns a copy of the stored object, so changes made to it
+    by one caller do not leak into other requests.
+    """
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, schema_name):
+        """
+        Return a tuple of (found, schema).
+        """
+        with self._lock:
+            try:
+                expires, schema = self._data.pop(schema_name)
+            except KeyError:
+                return False, None
+            if expires < time.time():
+                return False, None
+            self._data[schema_name] = (expires, schema)
+        return True, copy.copy(schema)
+
+    def set(self, schema_name, schema):
+        timeout = settings.BOARDINGHOUSE_SCHEMA_CACHE_TIMEOUT
+        if not timeout:
+            return
+        with self._lock:
+            self._data.pop(schema_name, None)
+            self._data[schema_name] = (time.time() + timeout, copy.copy(schema))
+            while len(self._data) > settings.BOARDINGHOUSE_SCHEMA_CACHE_SIZE:
+                self._data.popitem(last=False)
+
+    def delete(self, *schema_names):
+        with self._lock:
+            for schema_name in schema_names:
+                self._data.pop(schema_name, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+#: The cache used by the default :data:`boardinghouse.signals.find_schema` receiver.
+schema_cache = SchemaCache()
+
+
+def activate_schema(schema_name, lazy=False):
     """
     Activate the current schema: this will execute, in the database
     connection, something like:
 
     .. code:: sql
 
-        SET search_path TO "foo",public;
+        SELECT current_schema()
+          FROM (SELECT set_config('search_path', 'foo,public', false)) AS search_path;
+
+    This sets the search path and checks that the schema exists in the
+    one query. If the connection already has this search path, then no
+    query is required at all.
 
     It sends signals before and after that the schema will be, and was
     activated.
 
     Must be passed a string: the internal name of the schema to activate.
+
+    If ``lazy`` is set, then the schema is only recorded (for the current
+    context) as the one that should be active: it will be activated just
+    before the first query that refers to a private table. This does not
+    touch the database, so it is safe to do from asynchronous code.
     """
     from .signals import schema_pre_activate, schema_post_activate
 
     if schema_name == settings.TEMPLATE_SCHEMA:
         raise TemplateSchemaActivation()
 
-    schema_pre_activate.send(sender=None, schema_name=schema_name)
-    _set_search_path(schema_name)
-    found_schema = _get_search_path()
+    if lazy and hasattr(connection, 'lazy_schema'):
+        connection.lazy_schema = schema_name
+        _active_schema.set(schema_name)
+        # Swapping for a pooled connection with this search path does not
+        # need any queries, but there is no need to connect yet.
+        if connection.connection is not None:
+            _ensure_connection((schema_name, settings.PUBLIC_SCHEMA))
+        return
+
+    connection.lazy_schema = None
+    schema_pre_activate.send(sender=None, schema_name=schema_name, connection=connection)
+    found_schema = _set_search_path(schema_name)
     if found_schema != schema_name:
         raise SchemaNotFound('Schema activation failed. Expected "{0}", saw "{1}"'.format(
             schema_name, found_schema,
         ))
-    schema_post_activate.send(sender=None, schema_name=schema_name)
-    _thread_locals.schema = schema_name
+    schema_post_activate.send(sender=None, schema_name=schema_name, connection=connection)
+    _active_schema.set(schema_name)
 
 
 def activate_template_schema():
@@ -153,31 +431,49 @@ def activate_template_schema():
     """
     from .signals import schema_pre_activate, schema_post_activate
 
-    _thread_locals.schema = None
+    _active_schema.set(None)
+    connection.lazy_schema = None
     schema_name = settings.TEMPLATE_SCHEMA
-    schema_pre_activate.send(sender=None, schema_name=schema_name)
-    _set_search_path(schema_name)
-    if _get_search_path() != schema_name:
-        raise SchemaNotFound('Template schema was not activated. It seems "{0}" is active.'.format(_get_search_path()))
-    schema_post_activate.send(sender=None, schema_name=schema_name)
+    schema_pre_activate.send(sender=None, schema_name=schema_name, connection=connection)
+    found_schema = _set_search_path(schema_name)
+    if found_schema != schema_name:
+        raise SchemaNotFound('Template schema was not activated. It seems "{0}" is active.'.format(found_schema))
+    schema_post_activate.send(sender=None, schema_name=schema_name, connection=connection)
 
 
 def get_template_schema():
     return get_schema_model()(settings.TEMPLATE_SCHEMA)
 
 
-def deactivate_schema(schema=None):
+def deactivate_schema(schema=None, lazy=False):
     """
     Deactivate the provided (or current) schema.
+
+    If ``lazy`` is set, then the search path is only reset just before the
+    next query that refers to a private table (see :func:`activate_schema`).
     """
     from .signals import schema_pre_activate, schema_post_activate
 
-    cursor = connection.cursor()
-    schema_pre_activate.send(sender=None, schema_name=None)
-    cursor.execute('SET search_path TO "$user",{0}'.format(settings.PUBLIC_SCHEMA))
-    schema_post_activate.send(sender=None, schema_name=None)
-    _thread_locals.schema = None
-    cursor.close()
+    if lazy and hasattr(connection, 'lazy_schema'):
+        # The default search path starts with "$user", so lazily activating
+        # that is the same as deactivating.
+        connection.lazy_schema = '$user'
+        _active_schema.set(None)
+        if connection.connection is not None:
+            _ensure_connection(('$user', settings.PUBLIC_SCHEMA))
+        return
+
+    connection.lazy_schema = None
+    schema_pre_activate.send(sender=None, schema_name=None, connection=connection)
+    path = ('$user', settings.PUBLIC_SCHEMA)
+    _ensure_connection(path)
+    if getattr(connection, 'search_path', None) != path:
+        cursor = connection.cursor()
+        cursor.execute('SET search_path TO "$user",{0}'.format(connection.ops.quote_name(settings.PUBLIC_SCHEMA)))
+        cursor.close()
+        connection.search_path = path
+    schema_post_activate.send(sender=None, schema_name=None, connection=connection)
+    _active_schema.set(None)
 
 
 #: These models are required to be shared by the system.
@@ -217,11 +513,44 @@ def _is_join_model(model):
     )
 
 
+# A mapping of model class to whether it is shared: see is_shared_model().
+_shared_models = {}
+
+
+def clear_shared_models_cache():
+    """
+    Forget which models are shared, and which model each table belongs
+    to: this needs to happen if the settings that determine that are changed.
+    """
+    _shared_models.clear()
+    _table_maps.clear()
+
+
 def is_shared_model(model):
     """
     Is the model (or instance of a model) one that should be in the
     public/shared schema?
+
+    Once the app registry is ready, the result for each of the installed
+    models is remembered, as this is called for every model instance that
+    is created. Historical models (from migration states) are never stored,
+    as new classes are created for those each time a state is rendered.
     """
+    if not isinstance(model, type):
+        model = model.__class__
+
+    try:
+        return _shared_models[model]
+    except KeyError:
+        pass
+
+    shared = _is_shared_model(model)
+    if global_apps.ready and model._meta.apps is global_apps:
+        _shared_models[model] = shared
+    return shared
+
+
+def _is_shared_model(model):
     if model._is_shared_model:
         return True
 
@@ -252,72 +581,103 @@ def is_shared_model(model):
     return False
 
 
-def _get_models(apps, stack):
+def _get_migration_states():
     """
     If we are in a migration operation, we need to look in that for models.
     We really only should be injecting ourselves if we find a frame that contains
     a database_(forwards|backwards) function.
-    Otherwise, we can look in the `apps` object passed in.
+
+    Returns the (from_state, to_state) of that operation, or None.
+
+    This walks the frames directly, rather than using :func:`inspect.stack`,
+    which reads the source of every frame and is very slow.
     """
-    for frame in stack:
-        frame_locals = frame[0].f_locals
-        if frame[3] == 'database_forwards' and all(
-            local in frame_locals for local in ('from_state', 'to_state', 'schema_editor', 'self')
-        ) and isinstance(frame_locals['self'], Operation):
-            # Should this be from_state, or to_state, or should we look in both?
-            from_state = frame_locals['from_state']
-            to_state = frame_locals['to_state']
-            models = set()
-            if to_state.apps:
-                models = models.union(to_state.apps.get_models())
-            if from_state.apps:
-                models = models.union(from_state.apps.get_models())
-            return models
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name == 'database_forwards':
+            frame_locals = frame.f_locals
+            if all(
+                local in frame_locals for local in ('from_state', 'to_state', 'schema_editor', 'self')
+            ) and isinstance(frame_locals['self'], Operation):
+                return frame_locals['from_state'], frame_locals['to_state']
+        frame = frame.f_back
+
 
-    return apps.get_models()
+# A mapping of apps registry to (table map, join table map): see _get_table_maps().
+_table_maps = weakref.WeakKeyDictionary()
 
 
-def _get_join_model(table, table_map):
+def _get_table_maps(*registries):
     """
-    Given a database table, and a mapping of tables to models, look for a many-to-many field on models
-    that uses that database table.
+    Given one or more app registries, get a mapping of all table names to
+    (non-proxy) models, and a mapping of the table names of many-to-many
+    join tables to their through models.
 
-    Currently, it only looks within models that have a matching prefix.
+    These are only built once for each (set of) registries: a migration
+    operation has its own registries, so these are built once per operation.
     """
-    for db_table, model in table_map.items():
-        if table.startswith(db_table):
-            for field in model._meta.local_many_to_many:
-                through = (field.remote_field if hasattr(field, 'remote_field') else field.rel).through
-                if through._meta.db_table == table:
-                    return through
+    key = registries[-1]
+    try:
+        others, maps = _table_maps[key]
+    except KeyError:
+        pass
+    else:
+        if len(others) == len(registries) - 1 and all(
+            ref() is registry for (ref, registry) in zip(others, registries)
+        ):
+            return maps
+
+    models = set()
+    for registry in registries:
+        models.update(registry.get_models())
+
+    table_map = {
+        model._meta.db_table: model for model in models
+        if not model._meta.proxy
+    }
+    join_map = {}
+    for model in table_map.values():
+        for field in model._meta.local_many_to_many:
+            through = (field.remote_field if hasattr(field, 'remote_field') else field.rel).through
+            join_map.setdefault(through._meta.db_table, through)
+
+    maps = (table_map, join_map)
+    if all(registry.ready for registry in registries):
+        _table_maps[key] = ([weakref.ref(registry) for registry in registries[:-1]], maps)
+    return maps
 
 
-def is_shared_table(table, apps=apps):
+def is_shared_table(table, apps=None):
     """
     Is the model from the provided database table name shared?
 
     We may need to look and see if we can work out which models
     this table joins.
+
+    If no ``apps`` registry is passed in, then the registries of the
+    migration operation that is being applied are used, or the global
+    registry if we are not within a migration.
     """
     if table in REQUIRED_SHARED_TABLES:
         return True
 
-    # Get a mapping of all table names to models.
-    models = _get_models(apps, inspect.stack())
+    if apps is not None:
+        registries = [apps]
+    else:
+        states = _get_migration_states()
+        registries = [state.apps for state in states if state.apps] if states else []
+        registries = registries or [global_apps]
 
-    table_map = {
-        x._meta.db_table: x for x in models
-        if not x._meta.proxy
-    }
+    # Get a mapping of all table names to models.
+    table_map, join_map = _get_table_maps(*registries)
 
     # If we have a match, see if that one is shared.
     if table in table_map:
         return is_shared_model(table_map[table])
 
     # It may be a join table.
-    through = _get_join_model(table, table_map)
-    if through:
-        return is_shared_model(through)
+    if table in join_map:
+        return is_shared_model(join_map[table])
 
     # Not a join table: just assume that it's not shared.
     return False
@@ -325,7 +685,7 @@ def is_shared_table(table, apps=apps):
 
 # Internal helper functions.
 
-def _table_exists(table_name, schema=None):
+def _table_exists(table_name, schema=None, connection=connection):
     cursor = connection.cursor()
     cursor.execute("""SELECT *
                         FROM information_schema.tables
@@ -336,3 +696,53 @@ def _table_exists(table_name, schema=None):
 
 def _schema_table_exists():
     return _table_exists(get_schema_model()._meta.db_table)
+
+
+def _migrate_in_parallel():
+    return settings.BOARDINGHOUSE_MIGRATION_WORKERS > 1 and not connection.in_atomic_block
+
+
+def _batched_sql(kwargs):
+    """
+    The (sql, params) of a schema-aware operation, if it should be executed
+    in batches or in parallel (see ``settings.BOARDINGHOUSE_MIGRATION_BATCH_SIZE``
+    and ``settings.BOARDINGHOUSE_MIGRATION_WORKERS``), or None if it must be
+    executed one schema at a time.
+    """
+    if kwargs.get('sql') is not None:
+        if settings.BOARDINGHOUSE_MIGRATION_BATCH_SIZE or _migrate_in_parallel():
+            return kwargs['sql'], kwargs.get('params')
+
+
+def _schema_statements(cursor, schemata, sql, params=None):
+    """
+    A single query that executes the statement in each of the named schemata,
+    setting the search path to that schema before each.
+    """
+    if params:
+        sql = force_text(cursor.mogrify(sql, params))
+    statements = []
+    for schema in schemata:
+        statements.append(force_text(cursor.mogrify(
+            "SELECT set_config('search_path', quote_ident(%s) || ',' || quote_ident(%s), false)",
+            [schema, settings.PUBLIC_SCHEMA]
+        )))
+        statements.append(sql)
+    return ';\n'.join(statements)
+
+
+def _execute_in_schemata(schemata, sql, params=None):
+    """
+    Execute the statement in each of the named schemata, either in parallel,
+    or in batches: each batch of schemata needs just one query.
+    """
+    schemata = list(schemata)
+    if _migrate_in_parallel():
+        from .backends.postgres.parallel import execute_in_parallel
+        execute_in_parallel(schemata, sql, params)
+        return
+    batch_size = settings.BOARDINGHOUSE_MIGRATION_BATCH_SIZE
+    cursor = connection.cursor()
+    for start in range(0, len(schemata), batch_size):
+        cursor.execute(_schema_statements(cursor, schemata[start:start + batch_size], sql, params))
+    cursor.close()
@@ -38,3 +38,176 @@ The model that will store the actual schema objects. This should be a
 subclass of :class:`boardinghouse.models.AbstractSchema`, or expose the
 same methods.
 """
+
+BOARDINGHOUSE_LAZY_ACTIVATION = False
+"""
+If set, :class:`boardinghouse.middleware.SchemaMiddleware` only records
+which schema should be active for the request. The search path is not
+changed until the first query that refers to a private table is executed,
+so requests that only touch shared models need no activation query at all.
+
+Only the tables of private models (and ``current_schema()``) are looked
+for: raw SQL that refers to some other object that exists in each schema
+(a view, a function, or a table created by ``RunSQL``) would be executed
+with the shared schema active. Add the names of those to
+``BOARDINGHOUSE_PRIVATE_TABLES``.
+"""
+
+BOARDINGHOUSE_PRIVATE_TABLES = []
+"""
+The names of other objects in each schema (views, functions, or tables that
+do not belong to a model) that need the schema to be active when a statement
+refers to them, when schemata are lazily activated (see
+``BOARDINGHOUSE_LAZY_ACTIVATION``).
+"""
+
+BOARDINGHOUSE_SCHEMA_CACHE_TIMEOUT = 0
+"""
+How long (in seconds) the default :data:`boardinghouse.signals.find_schema`
+receiver should remember the schema object it found for a given name. This
+cache is local to each process: it is cleared when a schema is saved or
+deleted in this process, but changes made elsewhere (such as a schema being
+deactivated) will only be seen after this timeout. Set to ``0`` (the
+default) to disable this cache.
+"""
+
+BOARDINGHOUSE_SCHEMA_CACHE_SIZE = 1000
+"""
+The maximum number of schema names that will be stored in the process-local
+schema cache: the least recently used names are discarded first.
+"""
+
+BOARDINGHOUSE_CONNECTION_POOL_SIZE = 0
+"""
+The maximum number of idle database connections that each process should
+keep open, keyed by the search path that they have set, so that a request
+can be given a connection that already has its schema active (and whose
+per-connection caches are already warm for that schema). Any other session
+state is reset when a connection is returned to the pool (see
+:mod:`boardinghouse.backends.postgres.pool`). Set to ``0`` (the default) to
+disable pooling.
+"""
+
+BOARDINGHOUSE_MIGRATION_BATCH_SIZE = 0
+"""
+When a migration alters a private table, the statement needs to be executed
+in every schema. If this is set, then the statement is sent for this many
+schemata at a time (with the search path set before each copy of it) in a
+single query, rather than activating each schema and executing the statement
+in turn. Set to ``0`` (the default) to execute it one schema at a time.
+"""
+
+BOARDINGHOUSE_MIGRATION_WORKERS = 0
+"""
+If this is more than one, then a migration statement that alters private
+tables is applied to the schemata using this many extra database connections
+at once, each schema in its own transaction (see
+:mod:`boardinghouse.backends.postgres.parallel`). This only happens when the
+migration is not atomic (``atomic = False``): otherwise the statement could
+not see what the migration has already done, and the schemata would no
+longer be migrated in the same transaction as each other.
+"""
+
+BOARDINGHOUSE_DEFER_SCHEMA_MIGRATIONS = False
+"""
+If set, then ``migrate`` only applies migrations to the shared schema and
+the template schema (so new schemata are up to date), and to any schemata
+that have been active recently (see ``BOARDINGHOUSE_RECENT_ACTIVITY_TIMEOUT``).
+The other schemata are left to be brought up to date by the
+``migrate_schemata`` management command, or when they are next activated
+(see ``BOARDINGHOUSE_MIGRATE_ON_ACTIVATION``, and :mod:`boardinghouse.ledger`).
+Migrations that run code (``RunPython``, or ``RunSQL`` that alters private
+tables) are still applied to every schema. Migrations should not be
+unapplied while any schemata are behind.
+"""
+
+BOARDINGHOUSE_RECENT_ACTIVITY_TIMEOUT = 0
+"""
+When migrations are deferred (see ``BOARDINGHOUSE_DEFER_SCHEMA_MIGRATIONS``),
+the schemata that have been activated within this many seconds are still
+migrated by ``migrate``, along with the template schema. Activations are
+recorded in the cache, so this needs a cache that is shared between
+processes. Set to ``0`` (the default) to defer migrating every schema.
+"""
+
+BOARDINGHOUSE_MIGRATE_ON_ACTIVATION = False
+"""
+If set, then the first time each process activates a schema, it checks that
+the schema has had every migration applied to it, and if not, brings it up to
+date before activating it (see :mod:`boardinghouse.ledger`). This allows
+migrations to be deferred without running ``migrate_schemata``. When the
+schema is lazily activated (see ``BOARDINGHOUSE_LAZY_ACTIVATION``), the
+middleware does this before the view is called.
+"""
+
+BOARDINGHOUSE_SPARE_SCHEMATA = 0
+"""
+How many spare clones of the template schema the ``fill_spare_schemata``
+management command should keep ready. When there is one, a new schema
+(that is not a clone of some other schema) is made by renaming it, rather
+than by cloning the template schema while the user waits (see
+:mod:`boardinghouse.spares`). Set to ``0`` (the default) to always clone
+the template schema.
+"""
+
+BOARDINGHOUSE_SPARE_PREFIX = '__spare_'
+"""
+The prefix of the internal names of spare schemata. This must start with
+an underscore, so that they can not be activated.
+"""
+
+BOARDINGHOUSE_ASYNC_PROVISIONING = False
+"""
+If set, then saving a new schema object does not create the schema in the
+database. Instead, it is saved as inactive, and left for the
+``provision_schemata`` management command to create (see
+:mod:`boardinghouse.provisioning`): until then,
+:class:`boardinghouse.middleware.SchemaMiddleware` refuses to change to it.
+"""
+
+BOARDINGHOUSE_QUERY_STATISTICS = False
+"""
+If set, then each process counts and times the statements executed in each
+schema, and hands the totals to ``BOARDINGHOUSE_QUERY_REPORTERS`` (see
+:mod:`boardinghouse.backends.postgres.instrumentation`).
+"""
+
+BOARDINGHOUSE_SLOW_QUERY_TIME = 0.5
+"""
+Statements that take at least this many seconds are counted (and kept) as
+slow queries, when ``BOARDINGHOUSE_QUERY_STATISTICS`` is set.
+"""
+
+BOARDINGHOUSE_QUERY_REPORTERS = [
+    'boardinghouse.backends.postgres.instrumentation.LoggingReporter',
+]
+"""
+The dotted paths of the classes that are handed the per-schema query
+statistics: ``boardinghouse.backends.postgres.instrumentation.StatsdReporter``
+sends them to a StatsD server instead of logging them.
+"""
+
+BOARDINGHOUSE_QUERY_REPORT_INTERVAL = 60
+"""
+The per-schema query statistics are handed to the reporters at the end of
+a request, at most once every this many seconds.
+"""
+
+BOARDINGHOUSE_STATSD_ADDRESS = 'localhost:8125'
+"""
+The ``host:port`` of the StatsD server that the ``StatsdReporter`` sends
+per-schema query statistics to.
+"""
+
+BOARDINGHOUSE_PROFILE_SAMPLE_RATE = 0
+"""
+The fraction (from ``0`` to ``1``) of requests for which the time spent
+finding and activating schemata is measured and logged (see
+:mod:`boardinghouse.profiling`). Set to ``0`` (the default) to profile none.
+"""
+
+BOARDINGHOUSE_PROFILE_SERVER_TIMING = False
+"""
+If set, then the times measured for a profiled request are also added to
+its response, in a ``Server-Timing`` header.
+"""
@@ -11,14 +11,23 @@ Signals that are fired as part of the django-boardinghouse project.
     Sent when a new schema object has been created in the database. Accepts a
     single argument, the (internal) name of the schema.
 
+.. data:: schemata_created
+
+    Sent once when one or more schemata have been created in the database
+    together (by ``Schema.objects.bulk_create()``, for instance), after
+    :data:`schema_created` has been sent for each of them. Accepts a single
+    argument, the list of (internal) names of the schemata.
+
 .. data:: schema_pre_activate
 
     Sent just before a schema will be activated. May be used to abort this by
-    throwing an exception.
+    throwing an exception. Accepts the (internal) name of the schema, and the
+    database connection it is being activated on.
 
 .. data:: schema_post_activate
 
-    Sent immediately after a schema has been activated.
+    Sent immediately after a schema has been activated, with the same
+    arguments.
 
 .. data:: session_requesting_schema_change
 
@@ -41,15 +50,22 @@ Signals that are fired as part of the django-boardinghouse project.
     are applied to :class:`boardinghouse.contrib.template.models.SchemaTemplate`
     instances.
 
+.. data:: find_schemata
+
+    The bulk version of :data:`find_schema`: sent with a list of schema
+    values, and receivers may respond with a dict mapping those values they
+    were able to find to the matching schema objects.
+
 """
 
 from django.dispatch import Signal
 
 schema_created = Signal(providing_args=["schema"])
+schemata_created = Signal(providing_args=["schemata"])
 schemata_deleted = Signal(providing_args=["schemata"])
 
-schema_pre_activate = Signal(providing_args=["schema"])
-schema_post_activate = Signal(providing_args=["schema"])
+schema_pre_activate = Signal(providing_args=["schema", "connection"])
+schema_post_activate = Signal(providing_args=["schema", "connection"])
 
 session_requesting_schema_change = Signal(providing_args=["user", "schema", "session"])
 session_schema_changed = Signal(providing_args=["user", "schema", "session"])
@@ -57,3 +73,4 @@ session_schema_changed = Signal(providing_args=["user", "schema", "session"])
 schema_aware_operation = Signal(providing_args=['db_table', 'sql', 'params', 'execute'])
 
 find_schema = Signal(providing_args=['schema'])
+find_schemata = Signal(providing_args=['schemata'])
@@ -0,0 +1,142 @@
+"""
+A pool of spare schemata, cloned from the template schema ahead of time.
+
+Cloning the template schema creates every table, index and constraint that
+a schema needs, which takes a while: and that usually happens while someone
+is waiting for their new schema. If ``settings.BOARDINGHOUSE_SPARE_SCHEMATA``
+is set, then that many clones of the template schema are kept ready, named
+with ``settings.BOARDINGHOUSE_SPARE_PREFIX`` (which starts with an underscore,
+so that they can never be activated). A new schema that would be a clone of
+the template schema takes one of these instead, and just renames it.
+
+The pool is filled by the ``fill_spare_schemata`` management command, which
+may be run regularly (from cron, for instance), or left running with
+``--interval``.
+
+Each spare is labelled with the migrations that had been applied when it
+was cloned. Spares cloned before the template schema was last migrated (or
+a migration was unapplied) are never used, and are dropped the next time the
+pool is filled.
+
+Renaming a schema does not change the text of any functions in it, so if the
+template schema contains functions that refer to it by name, then these will
+still refer to the spare schema's name.
+"""
+from __future__ import unicode_literals
+
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+# The first key of the advisory lock held while taking a spare schema: the
+# second is the hash of its name.
+ADVISORY_LOCK_KEY = 0x6269
+
+
+def _fingerprint(connection):
+    """
+    A hash of the migrations that have been applied, which changes whenever
+    the template schema is migrated.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT md5(coalesce(string_agg(app || '.' || name, ',' ORDER BY app, name), '')) "
+        "FROM {0}".format(connection.ops.quote_name(MigrationRecorder.Migration._meta.db_table))
+    )
+    return cursor.fetchone()[0]
+
+
+def _spares(connection):
+    """
+    The name and label of each spare schema, oldest first.
+    """
+    prefix = settings.BOARDINGHOUSE_SPARE_PREFIX
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT nspname, obj_description(oid, 'pg_namespace') "
+        "  FROM pg_namespace "
+        " WHERE left(nspname, %s) = %s "
+        " ORDER BY oid",
+        [len(prefix), prefix]
+    )
+    return cursor.fetchall()
+
+
+def spare_schemata(using=DEFAULT_DB_ALIAS):
+    """
+    The names of the spare schemata that may be used, oldest first.
+    """
+    connection = connections[using]
+    fingerprint = _fingerprint(connection)
+    return [name for name, label in _spares(connection) if label == fingerprint]
+
+
+def fill(size=None, using=DEFAULT_DB_ALIAS):
+    """
+    Drop any spare schemata that are out of date, and then clone the template
+    schema until there are `size` spare schemata (by default,
+    ``settings.BOARDINGHOUSE_SPARE_SCHEMATA``).
+
+    Each spare is created in its own transaction. Returns the names of the
+    spare schemata that were created, and of those that were dropped.
+    """
+    if size is None:
+        size = settings.BOARDINGHOUSE_SPARE_SCHEMATA
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    fingerprint = _fingerprint(connection)
+
+    spares = _spares(connection)
+    current = [name for name, label in spares if label == fingerprint]
+    dropped = [name for name, label in spares if label != fingerprint]
+
+    cursor = connection.cursor()
+    for name in dropped:
+        cursor.execute('DROP SCHEMA IF EXISTS {0} CASCADE'.format(quote_name(name)))
+        LOGGER.info('Out of date spare schema dropped: %s', name)
+
+    created = []
+    for i in range(size - len(current)):
+        name = '{0}{1}'.format(settings.BOARDINGHOUSE_SPARE_PREFIX, uuid.uuid4().hex)
+        with transaction.atomic(using=using):
+            cursor.execute('SELECT clone_schema(%s, %s, false)', [settings.TEMPLATE_SCHEMA, name])
+            cursor.execute('COMMENT ON SCHEMA {0} IS %s'.format(quote_name(name)), [fingerprint])
+        created.append(name)
+        LOGGER.info('Spare schema created: %s', name)
+
+    if created:
+        # Older versions of clone_schema() set the search path themselves.
+        connection.search_path = None
+    return created, dropped
+
+
+def take(schema, using=DEFAULT_DB_ALIAS):
+    """
+    Rename a spare schema that is up to date to `schema`, and return the name
+    it had, or ``None`` if there was not one to take.
+
+    An advisory lock is held on the spare until the transaction ends, so no
+    other process may take the same one.
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+
+    with transaction.atomic(using=using):
+        cursor = connection.cursor()
+        for name in spare_schemata(using=using):
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s, hashtext(%s))', [ADVISORY_LOCK_KEY, name])
+            if not cursor.fetchone()[0]:
+                continue
+            # Another process may have taken this one before we got the lock.
+            cursor.execute('SELECT 1 FROM pg_namespace WHERE nspname = %s', [name])
+            if not cursor.fetchone():
+                continue
+            cursor.execute('ALTER SCHEMA {0} RENAME TO {1}'.format(quote_name(name), quote_name(schema)))
+            cursor.execute('COMMENT ON SCHEMA {0} IS NULL'.format(quote_name(schema)))
+            return name
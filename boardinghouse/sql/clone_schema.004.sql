@@ -0,0 +1,246 @@
+CREATE OR REPLACE FUNCTION clone_schema(
+  source_schema   text,
+  dest_schema     text,
+  include_records boolean
+) RETURNS void AS $$
+
+-- This version looks everything up in pg_catalog, rather than in the
+-- information_schema views (which check privileges on every row, and so
+-- get slower as the number of schemata grows), and builds the DDL for
+-- each kind of object in one statement, rather than one per object.
+--
+-- The objects in the source schema are found through their dependencies on
+-- it, so that every lookup uses an index: pg_class and pg_proc are not
+-- indexed by schema, and scanning them takes longer with every new schema.
+--
+-- The search path is only the public schema while this runs, so that the
+-- definitions of triggers, constraints, defaults and views leave the names
+-- of shared objects unqualified, and those of private objects qualified with
+-- the source schema (which is replaced with the destination schema).
+
+DECLARE
+  source_oid  oid;
+  relations_  oid[];
+  sequences_  oid[];
+  functions_  oid[];
+  source_     text := quote_ident(source_schema);
+  dest_       text := quote_ident(dest_schema);
+  sql_        text;
+
+BEGIN
+  -- Check that the source_schema exists.
+  SELECT oid INTO source_oid
+    FROM pg_catalog.pg_namespace
+   WHERE nspname = source_schema;
+  IF NOT FOUND THEN
+    RAISE NOTICE 'Source schema % does not exist.', source_schema;
+    RETURN;
+  END IF;
+
+  -- Check that the dest_schema does not yet exist.
+  PERFORM oid
+     FROM pg_catalog.pg_namespace
+    WHERE nspname = dest_schema;
+  IF FOUND THEN
+    RAISE NOTICE 'Destination schema % already exists', dest_schema;
+    RETURN;
+  END IF;
+
+  RAISE INFO 'CREATE SCHEMA %', dest_schema;
+  EXECUTE 'CREATE SCHEMA ' || dest_;
+
+  SELECT array_agg(objid) INTO relations_
+    FROM pg_catalog.pg_depend
+   WHERE refclassid = 'pg_catalog.pg_namespace'::regclass
+     AND refobjid = source_oid
+     AND classid = 'pg_catalog.pg_class'::regclass;
+
+  SELECT array_agg(objid) INTO functions_
+    FROM pg_catalog.pg_depend
+   WHERE refclassid = 'pg_catalog.pg_namespace'::regclass
+     AND refobjid = source_oid
+     AND classid = 'pg_catalog.pg_proc'::regclass;
+
+  -- Sequences that belong to identity columns are created along with their tables.
+  SELECT array_agg(c.oid) INTO sequences_
+    FROM pg_catalog.pg_class c
+   WHERE c.oid = ANY(relations_)
+     AND c.relkind = 'S'
+     AND NOT EXISTS (SELECT 1
+                       FROM pg_catalog.pg_depend d
+                      WHERE d.classid = 'pg_catalog.pg_class'::regclass
+                        AND d.objid = c.oid
+                        AND d.deptype = 'i');
+
+  -- Create sequences, before the tables that refer to them.
+  SELECT string_agg(
+           'CREATE SEQUENCE ' || dest_ || '.' || quote_ident(c.relname)
+           || ' INCREMENT BY ' || p.increment
+           || ' MINVALUE '     || p.minimum_value
+           || ' MAXVALUE '     || p.maximum_value
+           || ' START WITH '   || p.start_value
+           || ' CACHE '        || COALESCE(row_to_json(p) ->> 'cache_size', '1')
+           || CASE WHEN p.cycle_option THEN ' CYCLE' ELSE ' NO CYCLE' END,
+           '; ' ORDER BY c.oid)
+    INTO sql_
+    FROM pg_catalog.pg_class c,
+         LATERAL pg_catalog.pg_sequence_parameters(c.oid) p
+   WHERE c.oid = ANY(sequences_);
+  IF sql_ IS NOT NULL THEN
+    EXECUTE sql_;
+  END IF;
+
+  IF include_records THEN
+    SELECT string_agg(
+             'SELECT setval(' || quote_literal(dest_ || '.' || quote_ident(c.relname))
+             || ', last_value, is_called) FROM ' || source_ || '.' || quote_ident(c.relname),
+             '; ')
+      INTO sql_
+      FROM pg_catalog.pg_class c
+     WHERE c.oid = ANY(sequences_);
+    IF sql_ IS NOT NULL THEN
+      EXECUTE sql_;
+    END IF;
+  END IF;
+
+  -- Create tables, with their indexes, and check and unique constraints.
+  SELECT string_agg(
+           'CREATE TABLE ' || dest_ || '.' || quote_ident(relname)
+           || ' (LIKE ' || source_ || '.' || quote_ident(relname) || ' INCLUDING ALL)',
+           '; ' ORDER BY oid)
+    INTO sql_
+    FROM pg_catalog.pg_class
+   WHERE oid = ANY(relations_)
+     AND relkind = 'r';
+  IF sql_ IS NOT NULL THEN
+    EXECUTE sql_;
+  END IF;
+
+  IF include_records THEN
+    SELECT string_agg(
+             'INSERT INTO ' || dest_ || '.' || quote_ident(relname)
+             || ' SELECT * FROM ' || source_ || '.' || quote_ident(relname),
+             '; ')
+      INTO sql_
+      FROM pg_catalog.pg_class
+     WHERE oid = ANY(relations_)
+       AND relkind = 'r';
+    IF sql_ IS NOT NULL THEN
+      EXECUTE sql_;
+    END IF;
+  END IF;
+
+  -- Ensure any default values that refer to the old schema now refer to the new schema.
+  SELECT string_agg(
+           'ALTER TABLE ' || dest_ || '.' || quote_ident(c.relname)
+           || ' ALTER COLUMN ' || quote_ident(a.attname)
+           || ' SET DEFAULT ' || replace(pg_catalog.pg_get_expr(d.adbin, d.adrelid),
+                                         source_schema || '.', dest_schema || '.'),
+           '; ')
+    INTO sql_
+    FROM pg_catalog.pg_attrdef d
+    JOIN pg_catalog.pg_class c ON (c.oid = d.adrelid)
+    JOIN pg_catalog.pg_attribute a ON (a.attrelid = d.adrelid AND a.attnum = d.adnum)
+   WHERE c.oid = ANY(relations_)
+     AND c.relkind = 'r'
+     AND pg_catalog.pg_get_expr(d.adbin, d.adrelid) LIKE '%' || source_schema || '.%';
+  IF sql_ IS NOT NULL THEN
+    EXECUTE sql_;
+  END IF;
+
+  -- Copy across any triggers.
+  SELECT string_agg(
+           replace(pg_catalog.pg_get_triggerdef(t.oid, false),
+                   source_schema || '.', dest_schema || '.'),
+           '; ')
+    INTO sql_
+    FROM pg_catalog.pg_trigger t
+    JOIN pg_catalog.pg_class c ON (c.oid = t.tgrelid)
+   WHERE c.oid = ANY(relations_)
+     AND c.relkind = 'r'
+     AND NOT t.tgisinternal;
+  IF sql_ IS NOT NULL THEN
+    EXECUTE sql_;
+  END IF;
+
+  -- Change the ownership of any sequences (to the column they belong to).
+  -- This enables the use of pg_get_serial_sequence, for instance, to get the
+  -- name of a the sequence by table column.
+  -- Does not support sequences in use by multiple columns.
+  SELECT string_agg(
+           'ALTER SEQUENCE ' || dest_ || '.' || quote_ident(s.relname)
+           || ' OWNED BY '   || dest_ || '.' || quote_ident(t.relname)
+           || '.' || quote_ident(a.attname),
+           '; ')
+    INTO sql_
+    FROM (
+      SELECT dep.refobjid AS sequence_oid,
+             (array_agg(ad.adrelid))[1] AS table_oid,
+             (array_agg(ad.adnum))[1] AS column_number
+        FROM pg_catalog.pg_depend dep
+        JOIN pg_catalog.pg_attrdef ad ON (ad.oid = dep.objid)
+       WHERE dep.classid = 'pg_catalog.pg_attrdef'::regclass
+         AND dep.refclassid = 'pg_catalog.pg_class'::regclass
+         AND dep.refobjid IN (SELECT (dest_ || '.' || quote_ident(relname))::regclass
+                                FROM pg_catalog.pg_class
+                               WHERE oid = ANY(sequences_))
+    GROUP BY dep.refobjid
+      HAVING count(*) = 1
+    ) owner
+    JOIN pg_catalog.pg_class s ON (s.oid = owner.sequence_oid)
+    JOIN pg_catalog.pg_class t ON (t.oid = owner.table_oid)
+    JOIN pg_catalog.pg_attribute a ON (a.attrelid = owner.table_oid AND a.attnum = owner.column_number);
+  IF sql_ IS NOT NULL THEN
+    EXECUTE sql_;
+  END IF;
+
+  -- Copy across any foreign key constraints. This happens after creating
+  -- all of the tables.
+  SELECT string_agg(
+           'ALTER TABLE ' || dest_ || '.' || quote_ident(c.relname)
+           || ' ADD CONSTRAINT ' || quote_ident(r.conname)
+           || ' ' || replace(pg_catalog.pg_get_constraintdef(r.oid, true),
+                             source_schema || '.', dest_schema || '.'),
+           '; ')
+    INTO sql_
+    FROM pg_catalog.pg_constraint r
+    JOIN pg_catalog.pg_class c ON (c.oid = r.conrelid)
+   WHERE c.oid = ANY(relations_)
+     AND r.contype = 'f';
+  IF sql_ IS NOT NULL THEN
+    EXECUTE sql_;
+  END IF;
+
+  -- Create views, in the order they were created in the source schema.
+  SELECT string_agg(
+           'CREATE VIEW ' || dest_ || '.' || quote_ident(relname) || ' AS '
+           || rtrim(replace(pg_catalog.pg_get_viewdef(oid), source_schema || '.', dest_schema || '.'), ';'),
+           '; ' ORDER BY oid)
+    INTO sql_
+    FROM pg_catalog.pg_class
+   WHERE oid = ANY(relations_)
+     AND relkind = 'v';
+  IF sql_ IS NOT NULL THEN
+    EXECUTE sql_;
+  END IF;
+
+  -- Create functions. This is in here for completeness, although I'm not sure
+  -- it's the best idea to have functions in the client schema.
+  SELECT string_agg(
+           replace(pg_catalog.pg_get_functiondef(oid), source_schema || '.', dest_schema || '.'),
+           '; ')
+    INTO sql_
+    FROM pg_catalog.pg_proc
+   WHERE oid = ANY(functions_);
+  IF sql_ IS NOT NULL THEN
+    EXECUTE sql_;
+  END IF;
+
+END;
+
+$$ LANGUAGE plpgsql VOLATILE SET search_path = "{public_schema}";
+
+CREATE OR REPLACE FUNCTION clone_schema(source_schema text, dest_schema text)
+RETURNS void AS $$
+  SELECT clone_schema($1, $2, false);
+$$ LANGUAGE sql VOLATILE;
@@ -0,0 +1,19 @@
+CREATE OR REPLACE FUNCTION clone_schemata(
+  source_schema   text,
+  dest_schemata   text[],
+  include_records boolean
+) RETURNS void AS $$
+
+-- Clone the source schema once for each of the dest_schemata, so that many
+-- schemata may be created with a single query.
+
+DECLARE
+  dest_schema text;
+
+BEGIN
+  FOREACH dest_schema IN ARRAY dest_schemata LOOP
+    PERFORM clone_schema(source_schema, dest_schema, include_records);
+  END LOOP;
+END;
+
+$$ LANGUAGE plpgsql VOLATILE;
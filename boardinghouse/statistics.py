@@ -0,0 +1,124 @@
+"""
+Storage statistics for each schema.
+
+These show which schemata are the largest (or the busiest): the size of
+their tables and indexes, an estimate of how many rows they hold, and how
+far their sequences have got. They are gathered for all of the schemata at
+once, in a single query of ``pg_class`` and ``pg_namespace``, and kept in
+:class:`boardinghouse.models.SchemaStatistics` (in the shared schema), so
+they may be shown and sorted on without gathering them again: the admin
+changelist of the schema model shows them (with Django 1.11 or later).
+
+They are collected by the ``schema_statistics`` management command, or with
+``Schema.objects.collect_statistics()`` (or ``schema.collect_statistics()``).
+
+The rows in each table are estimated from ``pg_class.reltuples``, which is
+only updated by ``VACUUM``, ``ANALYZE`` (and autovacuum), and the position of
+sequences is only available from PostgreSQL 10.
+"""
+from __future__ import unicode_literals
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import BigIntegerField, DateTimeField, F
+from django.utils import timezone
+
+STATISTICS = """
+SELECT n.nspname,
+       count(c.oid) FILTER (WHERE c.relkind IN ('r', 'p')),
+       coalesce(sum(pg_catalog.pg_table_size(c.oid)) FILTER (WHERE c.relkind IN ('r', 'm')), 0),
+       coalesce(sum(pg_catalog.pg_indexes_size(c.oid)) FILTER (WHERE c.relkind IN ('r', 'm')), 0),
+       coalesce(sum(greatest(c.reltuples, 0)) FILTER (WHERE c.relkind IN ('r', 'm')), 0)::bigint,
+       {sequence_value}
+  FROM pg_catalog.pg_namespace n
+  LEFT JOIN pg_catalog.pg_class c ON (c.relnamespace = n.oid)
+ WHERE n.nspname = ANY(%s)
+ GROUP BY n.nspname
+"""
+
+SEQUENCE_VALUE = "max(CASE WHEN c.relkind = 'S' THEN pg_catalog.pg_sequence_last_value(c.oid) END)"
+
+
+def gather(schemata, using=DEFAULT_DB_ALIAS):
+    """
+    Gather the statistics of the given schemata from the database, without
+    keeping them, as a list of (unsaved) :class:`boardinghouse.models.SchemaStatistics`.
+
+    Schemata that do not exist in the database are left out.
+    """
+    from .models import SchemaStatistics
+
+    connection = connections[using]
+    if connection.pg_version >= 100000:
+        sequence_sql = SEQUENCE_VALUE
+    else:
+        sequence_sql = 'NULL::bigint'
+
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(STATISTICS.format(sequence_value=sequence_sql), [list(schemata)])
+        return [
+            SchemaStatistics(
+                schema=schema,
+                tables=tables,
+                table_size=table_size,
+                index_size=index_size,
+                row_estimate=row_estimate,
+                sequence_value=sequence_value,
+                collected=now,
+            )
+            for schema, tables, table_size, index_size, row_estimate, sequence_value
+            in cursor.fetchall()
+        ]
+
+
+def collect(schemata=None, using=DEFAULT_DB_ALIAS):
+    """
+    Gather the statistics of the given schemata (or of every schema), and
+    keep them, replacing any that were kept before. Returns the list of
+    :class:`boardinghouse.models.SchemaStatistics`, in the same order as
+    the schemata.
+    """
+    from .models import SchemaStatistics
+    from .schema import get_schema_model
+
+    if schemata is None:
+        schemata = get_schema_model().objects.using(using).values_list('schema', flat=True)
+    schemata = list(schemata)
+
+    statistics = {each.schema: each for each in gather(schemata, using=using)}
+    with transaction.atomic(using=using):
+        SchemaStatistics.objects.using(using).filter(schema__in=schemata).delete()
+        SchemaStatistics.objects.using(using).bulk_create(statistics.values())
+
+    return [statistics[schema] for schema in schemata if schema in statistics]
+
+
+def annotate(queryset):
+    """
+    Annotate each schema in the queryset with its most recently collected
+    statistics: ``table_size``, ``index_size``, ``total_size``, ``row_estimate``,
+    ``sequence_value`` and ``statistics_collected``. These are ``None`` for
+    schemata whose statistics have not been collected.
+
+    This needs Django 1.11 or later.
+    """
+    try:
+        from django.db.models import OuterRef, Subquery
+    except ImportError:  # Django < 1.11
+        raise NotImplementedError('Annotating schemata with their statistics needs Django 1.11 or later.')
+
+    from .models import SchemaStatistics
+
+    statistics = SchemaStatistics.objects.using(queryset.db).filter(schema=OuterRef('schema'))
+
+    def latest(value, output_field=BigIntegerField()):
+        return Subquery(statistics.annotate(value=value).values('value')[:1], output_field=output_field)
+
+    return queryset.annotate(
+        table_size=latest(F('table_size')),
+        index_size=latest(F('index_size')),
+        total_size=latest(F('table_size') + F('index_size')),
+        row_estimate=latest(F('row_estimate')),
+        sequence_value=latest(F('sequence_value')),
+        statistics_collected=latest(F('collected'), DateTimeField()),
+    )
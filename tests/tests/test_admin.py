@@ -90,6 +90,32 @@ class TestAdminAdditions(TestCase):
         self.assertEqual(2, len(entry.get_admin_url().split('?')))
         self.assertEqual('__schema=a', entry.get_admin_url().split('?')[1])
 
+    def test_history_finds_schemata_of_log_entries_at_once(self):
+        Schema.objects.mass_create('a')
+        user = User.objects.create_superuser(username='su', password='su', email='su@example.com')
+
+        Schema.objects.get(schema='a').activate()
+        aware = AwareModel.objects.create(name='foo')
+        for message in ('one', 'two', 'three'):
+            LogEntry.objects.log_action(
+                user_id=user.pk,
+                content_type_id=ContentType.objects.get_for_model(aware).pk,
+                object_id=aware.pk,
+                object_repr=six.text_type(aware),
+                change_message=message,
+                action_flag=ADDITION,
+            )
+
+        self.client.login(username='su', password='su')
+        response = self.client.get(
+            reverse('admin:tests_awaremodel_history', args=(aware.pk,)), HTTP_X_CHANGE_SCHEMA='a'
+        )
+        entries = response.context['action_list']
+        self.assertEqual(3, len(entries))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(['a', 'a', 'a'], [entry.object_schema.schema for entry in entries])
+
     def test_admin_log_naive_object_no_schema(self):
         Schema.objects.mass_create('a')
         schema = Schema.objects.get(name='a')
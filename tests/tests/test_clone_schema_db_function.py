@@ -1,3 +1,5 @@
+from importlib import import_module
+
 from django.test import TestCase
 from django.db.migrations.state import ProjectState
 from django.db import connection, migrations, transaction
@@ -62,3 +64,55 @@ class TestCloneSchemaDBFunction(TestCase):
         with connection.cursor() as cursor:
             cursor.execute('SELECT "{0}".spam_and_eggs()'.format(schema.schema))
             self.assertTrue(cursor.fetchone()[0])
+
+    def test_cloned_sequences_and_foreign_keys_belong_to_new_schema(self):
+        Schema.objects.mass_create('a')
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_get_serial_sequence('a.tests_awaremodel', 'id')")
+            self.assertEqual('a.tests_awaremodel_id_seq', cursor.fetchone()[0])
+            cursor.execute("""SELECT confrelid::regclass::text
+                                FROM pg_constraint
+                               WHERE conrelid = 'a.tests_selfreferentialmodel'::regclass
+                                 AND contype = 'f'""")
+            self.assertEqual('a.tests_selfreferentialmodel', cursor.fetchone()[0])
+
+    def test_cloning_with_records_copies_sequence_values(self):
+        Schema.objects.mass_create('a')
+        Schema.objects.get(schema='a').activate()
+        foo = AwareModel.objects.create(name='foo')
+
+        schema = Schema(name='b', schema='b')
+        schema._clone = 'a'
+        schema.save()
+        schema.activate()
+
+        self.assertEqual(['foo'], list(AwareModel.objects.values_list('name', flat=True)))
+        self.assertEqual(foo.pk + 1, AwareModel.objects.create(name='bar').pk)
+
+    def test_cloning_keeps_search_path(self):
+        Schema.objects.mass_create('a')
+        Schema.objects.get(schema='a').activate()
+        search_path = connection.search_path
+
+        Schema.objects.mass_create('b')
+
+        self.assertEqual(search_path, connection.search_path)
+        cursor = connection.cursor()
+        cursor.execute('SHOW search_path')
+        self.assertEqual('a,public', cursor.fetchone()[0])
+
+    def test_reverse_of_fast_clone_schema_keeps_search_path(self):
+        migration = import_module('boardinghouse.migrations.0007_fast_clone_schema')
+        operation, = migration.Migration.operations
+        with connection.schema_editor() as editor:
+            operation.database_backwards('boardinghouse', editor, ProjectState(), ProjectState())
+
+        Schema.objects.mass_create('a')
+        Schema.objects.get(schema='a').activate()
+        Schema.objects.mass_create('b')
+
+        cursor = connection.cursor()
+        cursor.execute('SHOW search_path')
+        self.assertEqual('a,public', cursor.fetchone()[0])
+        self.assertEqual(['a', 'b'], sorted(Schema.objects.values_list('schema', flat=True)))
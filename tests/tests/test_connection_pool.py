@@ -0,0 +1,220 @@
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS, TRANSACTION_STATUS_UNKNOWN
+
+from boardinghouse.backends.postgres.pool import SchemaConnectionPool, changes_session_state, connection_pool
+from boardinghouse.schema import (
+    activate_schema, activate_template_schema, deactivate_schema, get_schema_model, _get_search_path,
+)
+
+TEMPLATE_PATH = ('__template__', 'public')
+PUBLIC_PATH = ('$user', 'public')
+
+AVAILABLE_APPS = [
+    "boardinghouse",
+    "tests",
+    "django.contrib.auth",
+    "django.contrib.admin",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+]
+
+
+def mock_connection(status=TRANSACTION_STATUS_IDLE):
+    return Mock(closed=0, get_transaction_status=Mock(return_value=status))
+
+
+@override_settings(BOARDINGHOUSE_CONNECTION_POOL_SIZE=2)
+class TestSchemaConnectionPool(TransactionTestCase):
+    available_apps = AVAILABLE_APPS
+
+    def test_take_prefers_matching_search_path(self):
+        pool = SchemaConnectionPool()
+        first, second, third = mock_connection(), mock_connection(), mock_connection()
+        pool.put('key', PUBLIC_PATH, first)
+        pool.put('key', TEMPLATE_PATH, second)
+
+        self.assertEqual((second, TEMPLATE_PATH), pool.take('key', TEMPLATE_PATH))
+        self.assertEqual(None, pool.take('other', PUBLIC_PATH))
+
+        pool.put('key', TEMPLATE_PATH, third)
+        self.assertEqual((first, PUBLIC_PATH), pool.take('key', ('foo', 'public')))
+        self.assertEqual(1, pool.hits)
+
+    @override_settings(BOARDINGHOUSE_CONNECTION_POOL_SIZE=3)
+    def test_broken_connections_are_not_taken(self):
+        pool = SchemaConnectionPool()
+        working, closed, broken = mock_connection(), mock_connection(), mock_connection()
+        pool.put('key', PUBLIC_PATH, working)
+        pool.put('key', TEMPLATE_PATH, closed)
+        closed.closed = 1
+        pool.put('key', TEMPLATE_PATH, broken)
+        broken.get_transaction_status.return_value = TRANSACTION_STATUS_UNKNOWN
+
+        self.assertEqual(None, pool.take('key', TEMPLATE_PATH, exact=True))
+        self.assertEqual((working, PUBLIC_PATH), pool.take('key', TEMPLATE_PATH))
+        self.assertEqual(1, closed.close.call_count)
+        self.assertEqual(1, broken.close.call_count)
+        self.assertEqual(0, len(pool))
+        self.assertEqual(None, pool.take('key', TEMPLATE_PATH))
+
+    def test_session_is_only_reset_when_changed(self):
+        pool = SchemaConnectionPool()
+        changed, unchanged = mock_connection(), mock_connection()
+        pool.put('key', PUBLIC_PATH, changed)
+        pool.put('key', PUBLIC_PATH, unchanged, reset=False)
+
+        self.assertEqual(2, changed.cursor.return_value.execute.call_count)
+        self.assertEqual(0, unchanged.cursor.call_count)
+
+    def test_changes_session_state(self):
+        for sql in [
+            'SET statement_timeout = 10',
+            'SELECT 1; set work_mem = 1024',
+            'CREATE TEMPORARY TABLE foo (id integer)',
+            'SELECT pg_advisory_lock(1)',
+            "SELECT set_config('work_mem', '1MB', false)",
+            'LISTEN foo',
+        ]:
+            self.assertTrue(changes_session_state(sql), sql)
+
+        for sql in [
+            'UPDATE foo SET bar = 1',
+            'SELECT pg_advisory_xact_lock(1)',
+            "SELECT set_config('search_path', 'foo', false)",
+            'SELECT * FROM tempest',
+        ]:
+            self.assertFalse(changes_session_state(sql), sql)
+
+    def test_connections_of_dropped_schemata_are_closed(self):
+        pool = SchemaConnectionPool()
+        dropped, kept = mock_connection(), mock_connection()
+        pool.put('key', ('a', 'public'), dropped)
+        pool.put('key', PUBLIC_PATH, kept)
+
+        pool.discard(['a'])
+
+        self.assertTrue(dropped.close.called)
+        self.assertFalse(kept.close.called)
+        self.assertEqual(1, len(pool))
+
+    def test_least_recently_used_are_closed(self):
+        pool = SchemaConnectionPool()
+        connections = [mock_connection() for i in range(3)]
+        for conn in connections:
+            pool.put('key', PUBLIC_PATH, conn)
+
+        self.assertEqual(2, len(pool))
+        self.assertEqual(1, connections[0].close.call_count)
+        self.assertEqual(0, connections[2].close.call_count)
+
+    def test_connection_in_transaction_is_closed(self):
+        pool = SchemaConnectionPool()
+        conn = mock_connection(TRANSACTION_STATUS_INTRANS)
+        pool.put('key', PUBLIC_PATH, conn)
+
+        self.assertEqual(0, len(pool))
+        self.assertEqual(1, conn.close.call_count)
+
+    def test_closed_connection_is_reused_with_search_path(self):
+        activate_template_schema()
+        raw_connection = connection.connection
+        connection.close()
+
+        self.assertEqual(1, len(connection_pool))
+
+        with self.assertNumQueries(0):
+            activate_template_schema()
+
+        self.assertIs(raw_connection, connection.connection)
+        self.assertEqual('__template__', _get_search_path())
+
+        # A connection that was closed while it was in the pool is not used.
+        connection.close()
+        raw_connection.close()
+        activate_template_schema()
+        self.assertIsNot(raw_connection, connection.connection)
+        self.assertEqual('__template__', _get_search_path())
+
+        connection.close()
+        deactivate_schema()
+        self.assertEqual('public', _get_search_path())
+
+    def test_session_state_is_reset_when_pooled(self):
+        activate_template_schema()
+        cursor = connection.cursor()
+        cursor.execute('SET statement_timeout = 1234')
+        cursor.execute('CREATE TEMPORARY TABLE pooled_temp (id integer)')
+        cursor.execute('SELECT pg_advisory_lock(1)')
+        cursor.close()
+        raw_connection = connection.connection
+        connection.close()
+
+        activate_template_schema()
+        self.assertIs(raw_connection, connection.connection)
+        self.assertEqual('__template__', _get_search_path())
+        cursor = connection.cursor()
+        cursor.execute('SHOW statement_timeout')
+        self.assertEqual('0', cursor.fetchone()[0])
+        cursor.execute("SELECT to_regclass('pg_temp.pooled_temp')")
+        self.assertEqual(None, cursor.fetchone()[0])
+        cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+        self.assertEqual(0, cursor.fetchone()[0])
+        cursor.close()
+
+    @override_settings(BOARDINGHOUSE_CONNECTION_POOL_SIZE=3)
+    def test_request_is_given_connection_with_its_schema(self):
+        Schema = get_schema_model()
+        Schema.objects.mass_create('a', 'b')
+        User.objects.create_superuser(username='su', password='su', email='su@example.com')
+        self.client.login(username='su', password='su')
+
+        # Another connection, which does not have the search path of schema a.
+        other = connection.get_new_connection(connection.get_connection_params())
+        other.autocommit = True
+        connection_pool.put(connection._pool_key(), None, other)
+        activate_schema('a')
+        raw_connection = connection.connection
+        connection.close()
+        connection_pool.hits = connection_pool.misses = 0
+
+        # The session is fetched before the schema is known, using the
+        # least recently used connection: that is then swapped for the one
+        # that has the search path of the schema.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/', HTTP_X_CHANGE_SCHEMA='a')
+        self.assertEqual(b'a', response.content)
+        self.assertIs(raw_connection, connection.connection)
+        self.assertEqual(1, connection_pool.hits)
+        self.assertEqual(1, len(connection_pool))
+        self.assertFalse([query for query in queries.captured_queries if 'search_path' in query['sql']])
+        self.assertEqual('a', _get_search_path())
+
+        # There is no pooled connection with the search path of schema b.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/', HTTP_X_CHANGE_SCHEMA='b')
+        self.assertIs(raw_connection, connection.connection)
+        self.assertEqual(1, connection_pool.misses)
+        self.assertEqual('b', _get_search_path())
+
+    def tearDown(self):
+        deactivate_schema()
+        connection_pool.clear()
+        get_schema_model().objects.all().delete(drop=True)
+
+
+class TestConnectionPoolDisabled(TransactionTestCase):
+    available_apps = AVAILABLE_APPS
+
+    def test_closed_connection_is_not_pooled(self):
+        connection.ensure_connection()
+        connection.close()
+        self.assertEqual(0, len(connection_pool))
@@ -0,0 +1,311 @@
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, migrations, models
+from django.db.migrations.recorder import MigrationRecorder
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import six
+
+from boardinghouse import ledger
+from boardinghouse.exceptions import SchemaNotReady
+from boardinghouse.management.commands import migrate
+from boardinghouse.ledger import migrate_schemata, pending_migrations
+from boardinghouse.models import Schema, SchemaMigration
+from boardinghouse.schema import activate_schema, deactivate_schema
+from boardinghouse.signals import schema_aware_operation
+
+from ..models import AwareModel
+
+TABLES = """SELECT table_name, table_type
+              FROM information_schema.tables
+             WHERE table_schema = %s"""
+
+
+def record(app, name, action='apply_success', replaces=None):
+    """
+    Record a migration as applied (or unapplied), as the migrate command does.
+    """
+    migration = migrations.Migration(name, app)
+    migration.replaces = replaces or []
+    recorder = MigrationRecorder(connection)
+    for key in migration.replaces or [(app, name)]:
+        if action == 'apply_success':
+            recorder.record_applied(*key)
+        else:
+            recorder.record_unapplied(*key)
+    command = migrate.Command()
+    command.verbosity = 0
+    command.database = connection.alias
+    command.ledger_exists = False
+    command.migration_progress_callback(action, migration)
+
+
+class TestLedger(TestCase):
+    def test_new_schema_has_every_migration(self):
+        Schema.objects.mass_create('a')
+        self.assertEqual({}, pending_migrations())
+        self.assertEqual(
+            MigrationRecorder.Migration.objects.count(),
+            SchemaMigration.objects.filter(schema='a').count()
+        )
+
+    def test_cloned_schema_has_migrations_of_source(self):
+        Schema.objects.mass_create('a')
+        SchemaMigration.objects.filter(schema='a', app='tests').delete()
+
+        schema = Schema(name='b', schema='b')
+        schema._clone = 'a'
+        schema.save()
+
+        pending = pending_migrations()
+        self.assertEqual(['a', 'b'], sorted(pending))
+        self.assertEqual(pending['a'], pending['b'])
+
+    def test_dropped_schema_is_removed(self):
+        Schema.objects.mass_create('a', 'b')
+        Schema.objects.filter(schema='a').delete(drop=True)
+        self.assertFalse(SchemaMigration.objects.filter(schema='a').exists())
+        self.assertTrue(SchemaMigration.objects.filter(schema='b').exists())
+
+    def test_schemata_created_and_dropped_before_ledger_exists(self):
+        # As when schemata are created by a migration before the ledger's.
+        table = connection.ops.quote_name(SchemaMigration._meta.db_table)
+        connection.cursor().execute('ALTER TABLE {0} RENAME TO not_yet_created'.format(table))
+        Schema.objects.mass_create('a')
+        Schema.objects.filter(schema='a').delete(drop=True)
+        connection.cursor().execute('ALTER TABLE not_yet_created RENAME TO {0}'.format(table))
+        self.assertFalse(SchemaMigration.objects.exists())
+
+    def test_recorded_migrations_are_applied_to_every_schema(self):
+        Schema.objects.mass_create('a', 'b')
+        record('tests', '0002_example')
+        self.assertEqual({}, pending_migrations())
+        self.assertEqual(2, SchemaMigration.objects.filter(name='0002_example').count())
+
+        record('tests', '0002_example', 'unapply_success')
+        self.assertFalse(SchemaMigration.objects.filter(name='0002_example').exists())
+
+    def test_replaced_migrations_are_recorded(self):
+        Schema.objects.mass_create('a')
+        replaces = [('tests', '0002_example'), ('tests', '0003_example')]
+        record('tests', '0002_squashed_0003', replaces=replaces)
+        self.assertEqual({}, pending_migrations())
+        self.assertEqual(
+            ['0002_example', '0003_example'],
+            sorted(SchemaMigration.objects.filter(schema='a', name__endswith='_example').values_list('name', flat=True))
+        )
+
+    def test_recorded_on_the_connection_migrated(self):
+        other = Mock(alias='other')
+        other.ops.quote_name = connection.ops.quote_name
+        other.cursor.return_value.fetchone.return_value = (1,)
+        command = migrate.Command()
+        command.verbosity = 0
+        command.database = 'other'
+        command.ledger_exists = False
+
+        with patch.object(migrate, 'connections', {'other': other}):
+            with CaptureQueriesContext(connection) as queries:
+                command.migration_progress_callback('apply_success', migrations.Migration('0002_example', 'tests'))
+                command.migration_progress_callback('apply_success', migrations.Migration('0003_example', 'tests'))
+
+        self.assertEqual(0, len(queries))
+        # The ledger is only looked for once, then each migration is recorded.
+        self.assertEqual(3, len(other.cursor.return_value.execute.call_args_list))
+
+    @override_settings(BOARDINGHOUSE_DEFER_SCHEMA_MIGRATIONS=True)
+    def test_deferred_migrations_are_pending(self):
+        Schema.objects.mass_create('a', 'b')
+        record('tests', '0002_example')
+        self.assertEqual({
+            'a': {('tests', '0002_example')},
+            'b': {('tests', '0002_example')},
+        }, pending_migrations())
+        self.assertEqual({'b': {('tests', '0002_example')}}, pending_migrations(['b']))
+
+        function = Mock()
+        schema_aware_operation.send(sender=None, db_table=None, function=function)
+        # Only the template schema.
+        self.assertEqual(1, function.call_count)
+
+    @override_settings(BOARDINGHOUSE_DEFER_SCHEMA_MIGRATIONS=True, BOARDINGHOUSE_RECENT_ACTIVITY_TIMEOUT=60)
+    def test_recently_active_schemata_are_not_deferred(self):
+        Schema.objects.mass_create('a', 'b')
+        activate_schema('a')
+        deactivate_schema()
+
+        # As the migrate command does.
+        ledger.start_migrating()
+        function = Mock()
+        schema_aware_operation.send(sender=None, db_table=None, function=function)
+        record('tests', '0002_example')
+        ledger.finish_migrating()
+
+        # The template schema, and schema a.
+        self.assertEqual(2, function.call_count)
+        self.assertEqual({'b': {('tests', '0002_example')}}, pending_migrations())
+
+    def test_migrations_that_cannot_be_deferred(self):
+        def migration(*operations):
+            return type(str('Migration'), (migrations.Migration,), {'operations': list(operations)})('0002', 'tests')
+
+        self.assertTrue(ledger.cannot_defer(migration(migrations.RunPython(lambda apps, schema_editor: None))))
+        self.assertTrue(ledger.cannot_defer(migration(migrations.RunSQL('UPDATE tests_awaremodel SET name = name'))))
+        self.assertTrue(ledger.cannot_defer(migration(migrations.RunSQL(['DROP INDEX foo']))))
+        self.assertFalse(ledger.cannot_defer(migration(migrations.RunPython(migrations.RunPython.noop))))
+        self.assertFalse(ledger.cannot_defer(migration(migrations.RunSQL([('UPDATE auth_user SET is_staff = %s', [True])]))))
+        self.assertFalse(ledger.cannot_defer(migration(migrations.RunSQL('UPDATE a.tests_awaremodel SET name = name'))))
+
+    @override_settings(BOARDINGHOUSE_DEFER_SCHEMA_MIGRATIONS=True)
+    def test_migration_that_cannot_be_deferred_is_applied_to_every_schema(self):
+        Schema.objects.mass_create('a', 'b')
+        migration = type(str('Migration'), (migrations.Migration,), {
+            'operations': [migrations.RunPython(lambda apps, schema_editor: None)],
+        })('0002_example', 'tests')
+
+        with patch.object(ledger, 'migrate_schemata') as migrate_schemata:
+            ledger.start_migrating([(migration, False)])
+        # Any schema that is behind is brought up to date first.
+        migrate_schemata.assert_called_once_with(using='default')
+        function = Mock()
+        schema_aware_operation.send(sender=None, db_table=None, function=function)
+        record('tests', '0002_example')
+        ledger.finish_migrating()
+
+        self.assertEqual(3, function.call_count)
+        self.assertEqual({}, pending_migrations())
+        self.assertTrue(ledger.deferring())
+
+    def tearDown(self):
+        ledger._activity.clear()
+        cache.clear()
+
+    def test_list_command(self):
+        Schema.objects.mass_create('a', 'b')
+        SchemaMigration.objects.filter(schema='b', app='tests').delete()
+
+        output = six.StringIO()
+        call_command('migrate_schemata', list=True, stdout=output)
+        self.assertEqual('b: 1 migrations\n', output.getvalue())
+
+
+class TestMigrateSchemata(TransactionTestCase):
+    available_apps = [
+        "boardinghouse",
+        "tests",
+        "django.contrib.auth",
+        "django.contrib.admin",
+        "django.contrib.contenttypes",
+        "django.contrib.sessions",
+    ]
+
+    def tearDown(self):
+        deactivate_schema()
+        ledger._current_schemata.clear()
+        Schema.objects.all().delete(drop=True)
+
+    def get_tables(self, schema):
+        with connection.cursor() as cursor:
+            cursor.execute(TABLES, [schema])
+            return sorted(cursor.fetchall())
+
+    def test_empty_schema_is_brought_up_to_date(self):
+        Schema.objects.mass_create('a', 'b')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP SCHEMA a CASCADE; CREATE SCHEMA a')
+        SchemaMigration.objects.filter(schema='a').delete()
+
+        applied = migrate_schemata()
+
+        self.assertEqual(['a'], list(applied))
+        self.assertEqual({}, pending_migrations())
+        self.assertEqual(self.get_tables('b'), self.get_tables('a'))
+
+        # Nothing is left to do.
+        self.assertEqual({}, migrate_schemata())
+
+    def remove_tests_migration(self, schema):
+        SchemaMigration.objects.filter(schema=schema, app='tests').delete()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP SCHEMA {0} CASCADE; CREATE SCHEMA {0}'.format(schema))
+            cursor.execute(''.join(
+                'CREATE TABLE {0}.{1} (LIKE __template__.{1} INCLUDING ALL);'.format(schema, table)
+                for table, table_type in self.get_tables('__template__')
+                if table_type == 'BASE TABLE' and not table.startswith('tests_')
+            ))
+
+    @override_settings(BOARDINGHOUSE_MIGRATE_ON_ACTIVATION=True)
+    def test_schemata_are_checked_again_after_migrate(self):
+        Schema.objects.mass_create('a')
+        activate_schema('a')
+        self.assertEqual({('default', 'a')}, ledger._current_schemata)
+
+        models.signals.post_migrate.send(
+            sender=apps.get_app_config('boardinghouse'), app_config=apps.get_app_config('boardinghouse'),
+            verbosity=0, interactive=False, using=connection.alias, apps=apps, plan=[],
+        )
+        self.assertEqual(set(), ledger._current_schemata)
+
+    @override_settings(BOARDINGHOUSE_MIGRATE_ON_ACTIVATION=True)
+    def test_schema_is_migrated_on_the_connection_it_is_activated_on(self):
+        Schema.objects.mass_create('a')
+        with patch('boardinghouse.ledger.migrate_on_activation') as migrate_on_activation:
+            activate_schema('a')
+        migrate_on_activation.assert_called_once_with('a', connection)
+
+    @override_settings(BOARDINGHOUSE_MIGRATE_ON_ACTIVATION=True)
+    def test_schema_is_not_migrated_part_way_through_a_query(self):
+        Schema.objects.mass_create('a', 'b')
+        self.remove_tests_migration('b')
+
+        activate_schema('b', lazy=True)
+        with self.assertRaises(SchemaNotReady):
+            list(AwareModel.objects.all())
+        self.assertEqual(['b'], list(pending_migrations()))
+
+    @override_settings(BOARDINGHOUSE_MIGRATE_ON_ACTIVATION=True, BOARDINGHOUSE_LAZY_ACTIVATION=True)
+    def test_lazily_activated_schema_is_migrated_before_the_view(self):
+        Schema.objects.mass_create('a', 'b')
+        self.remove_tests_migration('b')
+        User.objects.create_superuser(username='su', password='su', email='su@example.com')
+        self.client.login(username='su', password='su')
+
+        response = self.client.get('/', HTTP_X_CHANGE_SCHEMA='b')
+
+        self.assertEqual(b'b', response.content)
+        self.assertEqual({}, pending_migrations())
+        self.assertEqual(self.get_tables('a'), self.get_tables('b'))
+
+    def test_command(self):
+        Schema.objects.mass_create('a', 'b')
+        self.remove_tests_migration('b')
+
+        output = six.StringIO()
+        call_command('migrate_schemata', 'a', 'b', stdout=output)
+
+        self.assertEqual('b: applied 1 migrations\n', output.getvalue())
+        self.assertEqual(self.get_tables('a'), self.get_tables('b'))
+
+    @override_settings(BOARDINGHOUSE_MIGRATE_ON_ACTIVATION=True)
+    def test_schema_is_migrated_on_activation(self):
+        Schema.objects.mass_create('a', 'b')
+        self.remove_tests_migration('b')
+
+        with CaptureQueriesContext(connection) as queries:
+            activate_schema('b')
+
+        self.assertTrue([query for query in queries.captured_queries if 'pg_advisory_lock' in query['sql']])
+        self.assertEqual({}, pending_migrations())
+        self.assertEqual(self.get_tables('a'), self.get_tables('b'))
+        self.assertEqual('b', connection.search_path[0])
+
+        # This process knows it is up to date now.
+        with self.assertNumQueries(0):
+            activate_schema('b')
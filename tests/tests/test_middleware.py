@@ -2,16 +2,19 @@ from __future__ import unicode_literals
 from importlib import import_module
 import unittest
 
-from django.db import ProgrammingError
+from django.core.cache import cache
+from django.db import ProgrammingError, connection
 from django.conf import settings
 from django.contrib.auth.models import User, Group, Permission
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from hypothesis import given, settings as hsettings
 from hypothesis.strategies import text
 from hypothesis.extra.django import TestCase
 
 from boardinghouse.exceptions import Forbidden, SchemaNotFound
-from boardinghouse.schema import get_schema_model, activate_schema
+from boardinghouse.schema import get_schema_model, activate_schema, deactivate_schema
 from boardinghouse.middleware import change_schema
 
 from ..models import AwareModel
@@ -287,6 +290,55 @@ class TestMiddleware(TestCase):
         self.client.get('/')
         self.assertFalse('schema' in self.client.session)
 
+    @override_settings(BOARDINGHOUSE_LAZY_ACTIVATION=True)
+    def test_lazy_activation(self):
+        schema = Schema.objects.mass_create('a')[0]
+        schema.activate()
+        AwareModel.objects.create(name='foo')
+        deactivate_schema()
+
+        user = User.objects.create_user(**CREDENTIALS)
+        user.schemata.add(schema)
+        self.client.login(**CREDENTIALS)
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get('/')
+        self.assertEqual(b'a', resp.content)
+        self.assertFalse([query for query in queries.captured_queries if 'search_path' in query['sql']])
+
+        resp = self.client.get('/aware/')
+        self.assertEqual(b'foo', resp.content)
+
+    @override_settings(BOARDINGHOUSE_LAZY_ACTIVATION=True)
+    def test_lazy_activation_of_deleted_schema(self):
+        schema = Schema.objects.mass_create('a')[0]
+        user = User.objects.create_user(**CREDENTIALS)
+        user.schemata.add(schema)
+
+        self.client.login(**CREDENTIALS)
+        self.client.post('/__change_schema__/a/')
+
+        schema.delete(drop=True)
+
+        resp = self.client.get('/aware/')
+        self.assertEqual(302, resp.status_code)
+        self.assertFalse('schema' in self.client.session)
+
+    @override_settings(BOARDINGHOUSE_LAZY_ACTIVATION=True)
+    def test_lazy_activation_of_deleted_schema_is_not_repeated_for_post(self):
+        schema = Schema.objects.mass_create('a')[0]
+        user = User.objects.create_user(**CREDENTIALS)
+        user.schemata.add(schema)
+
+        self.client.login(**CREDENTIALS)
+        self.client.post('/__change_schema__/a/')
+
+        schema.delete(drop=True)
+
+        resp = self.client.post('/aware/')
+        self.assertEqual(409, resp.status_code)
+        self.assertFalse('schema' in self.client.session)
+
 
 class TestContextProcessor(TestCase):
     def setUp(self):
@@ -321,3 +373,22 @@ class TestContextProcessor(TestCase):
         resp = self.client.get('/change/')
         self.assertEqual([], list(resp.context['schemata']))
         self.assertEqual([], list(resp.context['schema_choices']))
+
+    def test_visible_schemata_are_only_fetched_once(self):
+        user = User.objects.create_user(**CREDENTIALS)
+        user.schemata.add(*Schema.objects.exclude(schema='b'))
+        self.client.login(**CREDENTIALS)
+        cache.clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get('/change/')
+        self.assertEqual(1, len([
+            query for query in queries.captured_queries if 'boardinghouse_schema_users' in query['sql']
+        ]))
+        self.assertEqual([('a', 'a'), ('c', 'c')], sorted(resp.context['schema_choices']))
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get('/change/')
+        self.assertFalse([
+            query for query in queries.captured_queries if 'boardinghouse_schema_users' in query['sql']
+        ])
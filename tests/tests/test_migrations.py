@@ -8,12 +8,14 @@ from django.db.migrations.state import ProjectState
 from django.db.transaction import atomic
 from django.db.utils import IntegrityError
 from django.contrib.auth.models import Group, User
-from django.test import TransactionTestCase, TestCase, modify_settings
+from django.test import TransactionTestCase, TestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import six
 
 from boardinghouse.schema import get_schema_model, get_template_schema
 from boardinghouse.schema import activate_template_schema, deactivate_schema
 from boardinghouse.backends.postgres.schema import get_constraints
+from boardinghouse.exceptions import SchemaMigrationError
 from boardinghouse.operations import AddField
 
 Schema = get_schema_model()
@@ -561,6 +563,83 @@ class TestMigrations(MigrationTestBase):
             self.assertEqual(1, len(editor._constraint_names(SelfReferentialModel, foreign_key=True)))
 
 
+@override_settings(BOARDINGHOUSE_MIGRATION_BATCH_SIZE=2)
+class TestBatchedMigrations(TestMigrations):
+    """
+    Run all of the migration tests again, but with each statement sent for
+    two schemata at a time.
+    """
+
+    def test_statement_is_batched(self):
+        operation = migrations.CreateModel("Pony", [
+            ('pony_id', models.AutoField(primary_key=True)),
+        ])
+        project_state = ProjectState()
+        new_state = project_state.clone()
+        operation.state_forwards('tests', new_state)
+        with CaptureQueriesContext(connection) as queries:
+            with connection.schema_editor() as editor:
+                operation.database_forwards('tests', editor, project_state, new_state)
+        self.assertTableExists('tests_pony')
+        # Three schemata, in two batches.
+        self.assertEqual(2, len([
+            query for query in queries.captured_queries
+            if query['sql'].startswith("SELECT set_config('search_path'")
+        ]))
+
+
+@override_settings(BOARDINGHOUSE_MIGRATION_WORKERS=2)
+class TestParallelMigrations(MigrationTestBase):
+    def setUp(self):
+        Schema.objects.mass_create('a', 'b', 'c')
+        self.operation = migrations.CreateModel("Pony", [
+            ('pony_id', models.AutoField(primary_key=True)),
+        ])
+        self.project_state = ProjectState()
+        self.new_state = self.project_state.clone()
+        self.operation.state_forwards('tests', self.new_state)
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            for schema in Schema.objects.all():
+                cursor.execute('DROP SCHEMA IF EXISTS {0} CASCADE'.format(schema.schema))
+            cursor.execute('SET search_path TO __template__,public')
+            cursor.execute('DROP TABLE IF EXISTS tests_pony')
+
+    def test_statement_is_applied_to_all_schemata(self):
+        with CaptureQueriesContext(connection) as queries:
+            with connection.schema_editor(atomic=False) as editor:
+                self.operation.database_forwards('tests', editor, self.project_state, self.new_state)
+        self.assertTableExists('tests_pony')
+        # None of the schemata were migrated using this connection.
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if query['sql'].startswith("SELECT set_config('search_path'")
+        ])
+
+    def test_failure_records_applied_schemata(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE b.tests_pony (pony_id integer)')
+
+        with self.assertRaises(SchemaMigrationError) as context:
+            with connection.schema_editor(atomic=False) as editor:
+                self.operation.database_forwards('tests', editor, self.project_state, self.new_state)
+
+        self.assertEqual(['b'], list(context.exception.failed))
+        self.assertNotIn('b', context.exception.applied)
+
+    def test_atomic_migration_is_not_parallel(self):
+        with CaptureQueriesContext(connection) as queries:
+            with connection.schema_editor() as editor:
+                self.operation.database_forwards('tests', editor, self.project_state, self.new_state)
+        self.assertTableExists('tests_pony')
+        # Each schema (and the template schema) was activated using this connection.
+        self.assertEqual(4, len([
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT current_schema()') and 'set_config' in query['sql']
+        ]))
+
+
 class TestBoardinghouseMigrations(TestCase):
     def test_0002_patch_admin_reverse(self):
         Schema.objects.mass_create('a', 'b', 'c')
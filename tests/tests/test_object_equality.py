@@ -1,3 +1,4 @@
+from django.db.models.signals import post_init
 from django.test import TestCase
 
 from boardinghouse.schema import get_schema_model
@@ -40,3 +41,26 @@ class TestObjectEquality(TestCase):
 
         self.assertEqual(aware.pk, naive.pk)
         self.assertNotEqual(aware, naive)
+
+    def test_no_post_init_receivers(self):
+        self.assertFalse(post_init.has_listeners(AwareModel))
+
+    def test_fetched_objects_know_their_schema(self):
+        first, second = Schema.objects.mass_create('first', 'second')
+
+        first.activate()
+        AwareModel.objects.create(name='foo')
+        fetched = list(AwareModel.objects.all()) + list(AwareModel.objects.iterator())
+
+        second.activate()
+        self.assertEqual(['first', 'first'], [obj._schema for obj in fetched])
+
+    def test_unsaved_object_looks_up_schema_when_used(self):
+        Schema.objects.mass_create('first')[0].activate()
+        obj = AwareModel(name='foo')
+
+        self.assertNotIn('_schema', obj.__dict__)
+        self.assertEqual('first', obj._schema)
+
+        naive = NaiveModel(name='foo')
+        self.assertEqual(None, getattr(naive, '_schema', None))
@@ -0,0 +1,69 @@
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import six
+
+from boardinghouse import profiling
+from boardinghouse.models import Schema
+from boardinghouse.schema import activate_schema, deactivate_schema
+
+
+class TestProfiling(TestCase):
+    def tearDown(self):
+        profiling._timings.set(None)
+        deactivate_schema()
+
+    def test_nothing_timed_unless_profiling(self):
+        with profiling.timed('middleware'):
+            pass
+        self.assertIsNone(profiling._timings.get())
+        self.assertIsNone(profiling.end(RequestFactory().get('/'), None))
+
+    @override_settings(BOARDINGHOUSE_PROFILE_SAMPLE_RATE=1)
+    def test_activation_is_timed(self):
+        Schema.objects.mass_create('a')
+        self.assertTrue(profiling.begin())
+        activate_schema('a')
+        deactivate_schema()
+        durations = profiling.end(RequestFactory().get('/'), None)
+        self.assertEqual(['activate'], list(durations))
+        self.assertGreater(durations['activate'], 0)
+        self.assertIsNone(profiling._timings.get())
+
+    @override_settings(BOARDINGHOUSE_PROFILE_SAMPLE_RATE=1, BOARDINGHOUSE_PROFILE_SERVER_TIMING=True)
+    def test_server_timing_header_is_extended(self):
+        profiling.begin()
+        with profiling.timed('find_schema'):
+            pass
+        response = HttpResponse()
+        response['Server-Timing'] = 'db;dur=1'
+        profiling.end(RequestFactory().get('/'), response)
+        six.assertRegex(self, response['Server-Timing'], r'^db;dur=1, schema-find-schema;dur=[0-9.]+$')
+
+
+class TestMiddlewareProfiling(TestCase):
+    def setUp(self):
+        Schema.objects.mass_create('a')
+        User.objects.create_superuser(username='su', password='su', email='su@example.com')
+        self.client.login(username='su', password='su')
+
+    def tearDown(self):
+        deactivate_schema()
+
+    @override_settings(BOARDINGHOUSE_PROFILE_SAMPLE_RATE=1, BOARDINGHOUSE_PROFILE_SERVER_TIMING=True)
+    def test_request_is_profiled(self):
+        response = self.client.get('/', HTTP_X_CHANGE_SCHEMA='a')
+        self.assertEqual(b'a', response.content)
+        metrics = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertIn('schema-middleware', metrics)
+        self.assertIn('schema-activate', metrics)
+
+    @override_settings(BOARDINGHOUSE_PROFILE_SAMPLE_RATE=1)
+    def test_header_only_added_when_asked_for(self):
+        response = self.client.get('/', HTTP_X_CHANGE_SCHEMA='a')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(BOARDINGHOUSE_PROFILE_SERVER_TIMING=True)
+    def test_requests_not_profiled_by_default(self):
+        response = self.client.get('/', HTTP_X_CHANGE_SCHEMA='a')
+        self.assertFalse(response.has_header('Server-Timing'))
@@ -0,0 +1,115 @@
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import six
+
+from boardinghouse.ledger import pending_migrations
+from boardinghouse.models import Schema, SchemaProvisioning
+from boardinghouse.provisioning import ADVISORY_LOCK_KEY, provision, queued
+from boardinghouse.schema import _schema_exists
+from boardinghouse.signals import schema_aware_operation, schema_created
+
+
+@override_settings(BOARDINGHOUSE_ASYNC_PROVISIONING=True)
+class TestAsyncProvisioning(TestCase):
+    def test_schema_is_provisioned_later(self):
+        received = []
+
+        def receiver(sender, schema, **kwargs):
+            received.append(schema)
+
+        schema = Schema.objects.create(name='a', schema='a')
+
+        self.assertFalse(_schema_exists('a'))
+        self.assertFalse(schema.is_active)
+        self.assertFalse(Schema.objects.get(pk='a').is_active)
+        self.assertEqual(['a'], queued())
+        self.assertEqual({}, pending_migrations())
+
+        schema_created.connect(receiver)
+        try:
+            self.assertEqual((['a'], []), provision())
+        finally:
+            schema_created.disconnect(receiver)
+
+        self.assertEqual(['a'], received)
+        self.assertTrue(_schema_exists('a'))
+        self.assertTrue(Schema.objects.get(pk='a').is_active)
+        self.assertEqual([], queued())
+        self.assertEqual({}, pending_migrations())
+
+    def test_inactive_schema_stays_inactive(self):
+        Schema.objects.create(name='a', schema='a', is_active=False)
+        provision()
+        self.assertTrue(_schema_exists('a'))
+        self.assertFalse(Schema.objects.get(pk='a').is_active)
+
+    def test_bulk_created_schemata_are_queued(self):
+        Schema.objects.mass_create('a', 'b', 'c')
+        self.assertEqual(['a', 'b', 'c'], sorted(queued()))
+        self.assertEqual((['a'], []), provision(limit=1))
+        self.assertEqual((['b', 'c'], []), provision())
+
+    def test_middleware_refuses_schema_until_provisioned(self):
+        Schema.objects.create(name='a', schema='a')
+        User.objects.create_superuser(username='su', password='su', email='su@example.com')
+        self.client.login(username='su', password='su')
+
+        resp = self.client.get('/', HTTP_X_CHANGE_SCHEMA='a')
+        self.assertEqual(503, resp.status_code)
+        self.assertEqual('5', resp['Retry-After'])
+
+        provision()
+        resp = self.client.get('/', HTTP_X_CHANGE_SCHEMA='a')
+        self.assertEqual(b'a', resp.content)
+
+    def test_migrations_are_not_applied_to_queued_schemata(self):
+        with override_settings(BOARDINGHOUSE_ASYNC_PROVISIONING=False):
+            Schema.objects.mass_create('a')
+        Schema.objects.mass_create('b')
+
+        function = Mock()
+        schema_aware_operation.send(sender=None, db_table=None, function=function)
+        # The template schema, and schema a.
+        self.assertEqual(2, function.call_count)
+
+    def test_failure_is_recorded(self):
+        Schema.objects.create(name='a', schema='a')
+        connection.cursor().execute('CREATE SCHEMA a')
+
+        self.assertEqual(([], ['a']), provision())
+        job = SchemaProvisioning.objects.get(schema='a')
+        self.assertEqual(SchemaProvisioning.FAILED, job.state)
+        self.assertIn('ValueError', job.error)
+        self.assertEqual(([], []), provision())
+
+        connection.cursor().execute('DROP SCHEMA a')
+        self.assertEqual((['a'], []), provision(retry=True))
+
+    def test_schema_locked_by_another_process_is_skipped(self):
+        Schema.objects.mass_create('a', 'b')
+        other = connection.get_new_connection(connection.get_connection_params())
+        try:
+            other.cursor().execute('SELECT pg_advisory_lock(%s, hashtext(%s))', [ADVISORY_LOCK_KEY, 'a'])
+            self.assertEqual((['b'], []), provision())
+        finally:
+            other.close()
+        self.assertEqual((['a'], []), provision())
+
+    def test_deleted_schema_is_forgotten(self):
+        Schema.objects.create(name='a', schema='a')
+        Schema.objects.filter(schema='a').delete(drop=True)
+        self.assertEqual(([], []), provision())
+        self.assertEqual([], queued())
+
+    def test_provision_schemata_command(self):
+        Schema.objects.create(name='a', schema='a')
+        out = six.StringIO()
+        call_command('provision_schemata', stdout=out)
+        self.assertEqual('Created schema a.\n', out.getvalue())
@@ -0,0 +1,143 @@
+import logging
+import socket
+
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+
+from boardinghouse.backends.postgres.instrumentation import (
+    LoggingReporter, PrometheusReporter, StatsdReporter, prometheus_metrics, query_statistics,
+)
+from boardinghouse.models import Schema
+from boardinghouse.schema import activate_schema, deactivate_schema
+
+from ..models import AwareModel
+
+
+@override_settings(BOARDINGHOUSE_QUERY_STATISTICS=True, BOARDINGHOUSE_QUERY_REPORTERS=[])
+class TestQueryStatistics(TestCase):
+    def setUp(self):
+        query_statistics.clear()
+
+    def tearDown(self):
+        deactivate_schema()
+        query_statistics.clear()
+
+    def test_queries_are_counted_against_active_schema(self):
+        Schema.objects.mass_create('a', 'b')
+        query_statistics.clear()
+
+        activate_schema('a')
+        AwareModel.objects.count()
+        # Activating the schema is counted against it too.
+        count = query_statistics.snapshot()['a'].count
+        AwareModel.objects.count()
+        self.assertEqual(count + 1, query_statistics.snapshot()['a'].count)
+
+        activate_schema('b')
+        AwareModel.objects.count()
+
+        statistics = query_statistics.snapshot()
+        self.assertIn('b', statistics)
+        self.assertGreater(statistics['a'].time, 0)
+        self.assertEqual(0, statistics['a'].slow)
+
+    def test_queries_without_active_schema_are_counted_against_public(self):
+        connection.cursor().execute('SELECT 1')
+        self.assertEqual(1, query_statistics.snapshot()['public'].count)
+
+    @override_settings(BOARDINGHOUSE_SLOW_QUERY_TIME=0)
+    def test_slow_queries_are_kept(self):
+        connection.cursor().execute('SELECT 1')
+        statistics = query_statistics.snapshot()['public']
+        self.assertEqual(1, statistics.slow)
+        self.assertEqual('SELECT 1', statistics.slow_queries[0][0])
+
+    @override_settings(BOARDINGHOUSE_QUERY_STATISTICS=False)
+    def test_queries_not_counted_when_disabled(self):
+        connection.cursor().execute('SELECT 1')
+        self.assertEqual({}, query_statistics.snapshot())
+
+    def test_reporters_are_handed_totals_after_interval(self):
+        reporter = Mock()
+        query_statistics._reporters = [reporter]
+        connection.cursor().execute('SELECT 1')
+
+        query_statistics.report_if_due()
+        query_statistics.report_if_due()
+        self.assertFalse(reporter.report.called)
+
+        query_statistics.report()
+        self.assertEqual(1, reporter.report.call_args[0][0]['public'].count)
+
+    @override_settings(BOARDINGHOUSE_QUERY_REPORT_INTERVAL=0)
+    def test_report_if_due(self):
+        reporter = Mock()
+        query_statistics._reporters = [reporter]
+        query_statistics.report_if_due()
+        self.assertFalse(reporter.report.called)
+        query_statistics.report_if_due()
+        self.assertTrue(reporter.report.called)
+
+
+class TestReporters(TestCase):
+    statistics = {
+        'a': Mock(count=3, time=0.25, slow=1, slow_queries=[('SELECT 2', 0.2)]),
+        'b': Mock(count=1, time=0.001, slow=0, slow_queries=[]),
+    }
+
+    def test_logging_reporter(self):
+        logger = Mock(spec=logging.Logger)
+        reporter = LoggingReporter(logger)
+        reporter.report(self.statistics)
+        self.assertEqual(2, logger.info.call_count)
+        self.assertEqual(1, logger.warning.call_count)
+
+        # Slow queries are only logged once.
+        reporter.report(self.statistics)
+        self.assertEqual(1, logger.warning.call_count)
+
+    def test_statsd_reporter(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            reporter = StatsdReporter('127.0.0.1:{0}'.format(server.getsockname()[1]), prefix='bh')
+            reporter.report(self.statistics)
+            self.assertEqual([
+                'bh.a.queries:3|c',
+                'bh.a.query_time:250|c',
+                'bh.a.slow_queries:1|c',
+                'bh.b.queries:1|c',
+                'bh.b.query_time:1|c',
+            ], server.recv(4096).decode('utf-8').split('\n'))
+
+            # Only the increase since the last report is sent.
+            statistics = dict(self.statistics, a=Mock(count=5, time=0.5, slow=1, slow_queries=[]))
+            reporter.report(statistics)
+            self.assertEqual(
+                ['bh.a.queries:2|c', 'bh.a.query_time:250|c'],
+                server.recv(4096).decode('utf-8').split('\n')
+            )
+        finally:
+            server.close()
+
+    def test_prometheus_reporter(self):
+        text = PrometheusReporter().render(self.statistics)
+        self.assertIn('# TYPE boardinghouse_queries_total counter\n', text)
+        self.assertIn('boardinghouse_queries_total{schema="a"} 3\n', text)
+        self.assertIn('boardinghouse_query_seconds_total{schema="b"} 0.001\n', text)
+
+    @override_settings(BOARDINGHOUSE_QUERY_STATISTICS=True)
+    def test_prometheus_metrics_view(self):
+        query_statistics.clear()
+        try:
+            connection.cursor().execute('SELECT 1')
+            response = prometheus_metrics(RequestFactory().get('/metrics'))
+        finally:
+            query_statistics.clear()
+        self.assertIn(b'boardinghouse_queries_total{schema="public"} 1\n', response.content)
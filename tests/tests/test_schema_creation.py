@@ -1,8 +1,15 @@
+import threading
+import types
+from unittest import skipIf
+
 from django.test import TestCase
-from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, models, transaction
 from django import forms
 from django.utils import six
 
+from boardinghouse.exceptions import SchemaNotFound
+from boardinghouse.signals import schemata_created
 from boardinghouse.schema import (
     activate_schema, deactivate_schema,
     TemplateSchemaActivation,
@@ -11,7 +18,13 @@ from boardinghouse.schema import (
     get_schema_model,
     activate_template_schema,
     _get_search_path,
+    _active_schema,
+    forget_dropped_schemata,
+    ContextVar,
 )
+from boardinghouse.backends.postgres.base import DatabaseWrapper
+
+from ..models import AwareModel
 
 Schema = get_schema_model()
 
@@ -82,6 +95,42 @@ class TestPostgresSchemaCreation(TestCase):
         with self.assertRaises(ValueError):
             Schema.objects.mass_create('already_here')
 
+    def test_bulk_create_clones_in_one_query(self):
+        received = []
+
+        def receiver(sender, schemata, **kwargs):
+            received.append(schemata)
+
+        schemata_created.connect(receiver)
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                created = Schema.objects.mass_create('a', 'b', 'c')
+        finally:
+            schemata_created.disconnect(receiver)
+
+        self.assertEqual([['a', 'b', 'c']], received)
+        self.assertEqual(1, len([query for query in queries if 'clone_schema' in query['sql']]))
+        self.assertEqual(['a', 'b', 'c'], [schema.schema for schema in created])
+        for schema in created:
+            schema.activate()
+            cursor = connection.cursor()
+            cursor.execute(TABLE_QUERY, [schema.schema, 'tests_awaremodel'])
+            self.assertTrue(cursor.fetchone())
+
+    def test_bulk_create_sends_post_save(self):
+        received = []
+
+        def receiver(sender, instance, created, **kwargs):
+            received.append((instance.schema, created))
+
+        models.signals.post_save.connect(receiver, sender=Schema)
+        try:
+            Schema.objects.mass_create('a', 'b')
+        finally:
+            models.signals.post_save.disconnect(receiver, sender=Schema)
+
+        self.assertEqual([('a', True), ('b', True)], received)
+
 
 class TestSchemaDrop(TestCase):
     def test_dropping_schema_model(self):
@@ -114,8 +163,9 @@ class TestSchemaDrop(TestCase):
         self.assertSequenceEqual(['a', 'b', 'c', 'd'],
             list(Schema.objects.order_by('schema').values_list('pk', flat=True)))
 
-        self.assertSequenceEqual(['a', 'c'],
-            list(Schema.objects.active().values_list('schema', flat=True)))
+        # There is no ordering on the schema model.
+        six.assertCountEqual(self, ['a', 'c'],
+            Schema.objects.active().values_list('schema', flat=True))
 
     def test_delete_of_non_existent_schema_is_fine_thankyou(self):
         Schema.objects.mass_create('a', 'b', 'c')
@@ -199,3 +249,148 @@ class TestGetSetSearchPath(TestCase):
 
         deactivate_schema()
         self.assertEqual(None, get_active_schema_name())
+
+    def test_activate_schema_uses_single_query(self):
+        Schema.objects.mass_create('a')
+
+        with self.assertNumQueries(1):
+            activate_schema('a')
+
+        self.assertEqual('a', _get_search_path())
+
+    def test_activate_missing_schema_raises(self):
+        with self.assertRaises(SchemaNotFound):
+            activate_schema('missing')
+
+    def test_activating_active_schema_does_not_query(self):
+        Schema.objects.mass_create('a')
+        activate_schema('a')
+
+        with self.assertNumQueries(0):
+            activate_schema('a')
+
+        deactivate_schema()
+
+        with self.assertNumQueries(0):
+            deactivate_schema()
+
+    def test_schema_dropped_elsewhere_is_detected(self):
+        Schema.objects.mass_create('a')
+        activate_schema('a')
+        # As if by another connection.
+        connection.cursor().execute('DROP SCHEMA a CASCADE')
+        forget_dropped_schemata(['a'])
+
+        with self.assertRaises(SchemaNotFound):
+            activate_schema('a')
+
+    def test_manual_search_path_change_is_detected(self):
+        Schema.objects.mass_create('a', 'b')
+        activate_schema('a')
+        connection.cursor().execute('SET search_path TO b,public')
+
+        activate_schema('a')
+        self.assertEqual('a', _get_search_path())
+
+    def test_rollback_forgets_search_path(self):
+        Schema.objects.mass_create('a', 'b')
+        activate_schema('a')
+
+        try:
+            with transaction.atomic():
+                activate_schema('b')
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual('a', _get_search_path())
+
+        activate_schema('b')
+        self.assertEqual('b', _get_search_path())
+
+    def test_lazy_activation(self):
+        Schema.objects.mass_create('a', 'b')
+        activate_schema('a')
+
+        with self.assertNumQueries(0):
+            activate_schema('b', lazy=True)
+
+        self.assertEqual('b', get_active_schema_name())
+        self.assertEqual('b', _get_search_path())
+
+    def test_lazy_activation_survives_rollback(self):
+        Schema.objects.mass_create('a', 'b')
+        activate_schema('a')
+        activate_schema('b', lazy=True)
+
+        try:
+            with transaction.atomic():
+                self.assertEqual('b', _get_search_path())
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual('b', _get_search_path())
+
+        deactivate_schema()
+        self.assertEqual(None, get_active_schema_name())
+
+    def test_lazy_deactivation(self):
+        Schema.objects.mass_create('a')
+        activate_schema('a')
+
+        with self.assertNumQueries(0):
+            deactivate_schema(lazy=True)
+
+        self.assertEqual('public', _get_search_path())
+        self.assertEqual(None, get_active_schema_name())
+
+    def test_lazy_schema_is_kept_for_each_alias(self):
+        Schema.objects.mass_create('a')
+        other = DatabaseWrapper(connection.settings_dict, alias='other')
+        activate_schema('a', lazy=True)
+
+        self.assertEqual('a', connection.lazy_schema)
+        self.assertEqual(None, other.lazy_schema)
+        deactivate_schema()
+
+    @skipIf(ContextVar is None, 'contextvars is not available')
+    def test_coroutines_keep_their_own_schemata(self):
+        import asyncio
+
+        for schema in Schema.objects.mass_create('a', 'b'):
+            schema.activate()
+            AwareModel.objects.create(name=schema.schema)
+        deactivate_schema()
+        seen = []
+
+        @types.coroutine
+        def request(schema):
+            activate_schema(schema, lazy=True)
+            for i in range(3):
+                # Let the other one run.
+                yield
+                seen.append((schema, get_active_schema_name(), AwareModel.objects.get().name))
+
+        loop = asyncio.new_event_loop()
+        try:
+            tasks = [loop.create_task(request(schema)) for schema in ['a', 'b']]
+            for task in tasks:
+                loop.run_until_complete(task)
+        finally:
+            loop.close()
+
+        self.assertEqual([('a', 'a', 'a'), ('b', 'b', 'b')] * 3, seen)
+        self.assertEqual((None, None), (_active_schema.get(), connection.lazy_schema))
+
+    def test_active_schema_is_not_shared_between_threads(self):
+        Schema.objects.mass_create('a')
+        activate_schema('a', lazy=True)
+        seen = []
+
+        thread = threading.Thread(target=lambda: seen.append((_active_schema.get(), connection.lazy_schema)))
+        thread.start()
+        thread.join()
+
+        self.assertEqual([(None, None)], seen)
+        self.assertEqual('a', get_active_schema_name())
@@ -1,6 +1,9 @@
-from django.test import TestCase
+from django.apps import apps
+from django.db.migrations.state import ProjectState
+from django.test import TestCase, override_settings
 
-from boardinghouse.schema import is_shared_model
+from boardinghouse.backends.postgres.base import private_table_pattern
+from boardinghouse.schema import is_shared_model, _shared_models
 
 from ..models import SettingsSharedModel, SettingsPrivateModel
 
@@ -11,3 +14,37 @@ class TestSettingsModels(TestCase):
 
     def test_model_in_private_models_is_not_shared(self):
         self.assertFalse(is_shared_model(SettingsPrivateModel))
+
+    def test_changing_settings_changes_shared_models(self):
+        self.assertFalse(is_shared_model(SettingsPrivateModel))
+
+        with override_settings(SHARED_MODELS=['tests.settingsprivatemodel'], PRIVATE_MODELS=[]):
+            self.assertTrue(is_shared_model(SettingsPrivateModel))
+
+        self.assertFalse(is_shared_model(SettingsPrivateModel))
+
+    def test_changing_settings_changes_private_tables(self):
+        table = SettingsPrivateModel._meta.db_table
+        self.assertTrue(private_table_pattern().search(table))
+
+        with override_settings(SHARED_MODELS=['tests.settingsprivatemodel'], PRIVATE_MODELS=[]):
+            self.assertFalse(private_table_pattern().search(table))
+
+        self.assertTrue(private_table_pattern().search(table))
+
+    def test_private_tables_setting(self):
+        self.assertFalse(private_table_pattern().search('SELECT * FROM private_view'))
+
+        with override_settings(BOARDINGHOUSE_PRIVATE_TABLES=['private_view']):
+            self.assertTrue(private_table_pattern().search('SELECT * FROM private_view'))
+
+        self.assertFalse(private_table_pattern().search('SELECT * FROM private_view'))
+
+    def test_historical_models_are_not_stored(self):
+        state = ProjectState.from_apps(apps)
+        model = state.apps.get_model('tests', 'SettingsSharedModel')
+
+        self.assertTrue(is_shared_model(model))
+        self.assertTrue(is_shared_model(SettingsSharedModel))
+        self.assertNotIn(model, _shared_models)
+        self.assertIn(SettingsSharedModel, _shared_models)
@@ -5,11 +5,13 @@ except ImportError:
 
 from django.contrib.auth.models import User, Group, Permission
 from django.http import HttpRequest
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from boardinghouse.middleware import change_schema
 from boardinghouse.models import Schema
-from boardinghouse.schema import TemplateSchemaActivation
+from boardinghouse.schema import TemplateSchemaActivation, _get_schema, find_schemata
 from boardinghouse.signals import (
     session_requesting_schema_change, schema_aware_operation, session_schema_changed,
     find_schema,
@@ -88,3 +90,48 @@ class TestSignalsDirectly(TestCase):
             response for handler, response in find_schema.send(sender=None, schema='__template__')
             if response
         ][0])
+
+    @override_settings(BOARDINGHOUSE_SCHEMA_CACHE_TIMEOUT=60)
+    def test_find_schema_is_cached(self):
+        Schema.objects.mass_create('a')
+
+        self.assertEqual('a', _get_schema('a').schema)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual('a', _get_schema('a').schema)
+            self.assertEqual(None, _get_schema('b'))
+            self.assertEqual(None, _get_schema('b'))
+        self.assertEqual(1, len(queries.captured_queries))
+
+    @override_settings(BOARDINGHOUSE_SCHEMA_CACHE_TIMEOUT=60)
+    def test_find_schema_cache_is_invalidated(self):
+        self.assertEqual(None, _get_schema('a'))
+        schema = Schema.objects.create(schema='a', name='A')
+        self.assertEqual('A', _get_schema('a').name)
+
+        schema.name = 'B'
+        schema.save()
+        self.assertEqual('B', _get_schema('a').name)
+
+        Schema.objects.filter(schema='a').delete()
+        self.assertEqual(None, _get_schema('a'))
+
+    @override_settings(BOARDINGHOUSE_SCHEMA_CACHE_TIMEOUT=60)
+    def test_find_schema_returns_copies(self):
+        Schema.objects.mass_create('a')
+        _get_schema('a').name = 'changed'
+        self.assertEqual('a', _get_schema('a').name)
+
+    @override_settings(BOARDINGHOUSE_SCHEMA_CACHE_TIMEOUT=60)
+    def test_find_schemata(self):
+        Schema.objects.mass_create('a', 'b', 'c')
+
+        with CaptureQueriesContext(connection) as queries:
+            found = find_schemata(['a', 'b', 'd', '__template__'])
+        self.assertEqual(1, len(queries.captured_queries))
+        self.assertEqual(['__template__', 'a', 'b'], sorted(found))
+
+        with CaptureQueriesContext(connection) as queries:
+            found = find_schemata(['a', 'b', 'd'])
+        self.assertEqual(0, len(queries.captured_queries))
+        self.assertEqual(['a', 'b'], sorted(found))
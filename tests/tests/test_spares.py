@@ -0,0 +1,91 @@
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.test import TestCase, override_settings
+from django.utils import six
+
+from boardinghouse import apps, ledger, spares
+from boardinghouse.models import Schema, SchemaMigration
+from boardinghouse.schema import _schema_exists, activate_schema
+
+from ..models import AwareModel
+
+
+@override_settings(BOARDINGHOUSE_SPARE_SCHEMATA=2)
+class TestSpareSchemata(TestCase):
+    def test_fill_creates_spare_schemata(self):
+        created, dropped = spares.fill()
+        self.assertEqual(2, len(created))
+        self.assertEqual([], dropped)
+        self.assertEqual(created, spares.spare_schemata())
+        for name in created:
+            self.assertTrue(name.startswith('__spare_'))
+
+        self.assertEqual(([], []), spares.fill())
+        self.assertEqual(1, len(spares.fill(3)[0]))
+
+    def test_new_schema_takes_spare(self):
+        first, second = spares.fill()[0]
+
+        Schema.objects.mass_create('a')
+
+        self.assertEqual([second], spares.spare_schemata())
+        self.assertFalse(_schema_exists(first))
+        self.assertTrue(_schema_exists('a'))
+        self.assertEqual(
+            MigrationRecorder.Migration.objects.count(),
+            SchemaMigration.objects.filter(schema='a').count()
+        )
+
+        activate_schema('a')
+        AwareModel.objects.create(name='foo', factor=1)
+        self.assertEqual(1, AwareModel.objects.count())
+
+    def test_bulk_create_takes_spares_then_clones(self):
+        spares.fill()
+        Schema.objects.mass_create('a', 'b', 'c')
+        self.assertEqual([], spares.spare_schemata())
+        for schema in ('a', 'b', 'c'):
+            self.assertTrue(_schema_exists(schema))
+
+    def test_cloned_schema_does_not_take_spare(self):
+        spares.fill()
+        Schema.objects.mass_create('a')
+
+        schema = Schema(name='b', schema='b')
+        schema._clone = 'a'
+        schema.save()
+
+        self.assertEqual(1, len(spares.spare_schemata()))
+
+    def test_spares_are_not_used_after_migrating(self):
+        spares.fill()
+        MigrationRecorder(connection).record_applied('tests', '0002_example')
+        ledger.record_applied(connection, 'tests', '0002_example')
+
+        self.assertEqual([], spares.spare_schemata())
+        Schema.objects.mass_create('a')
+        self.assertTrue(_schema_exists('a'))
+
+        created, dropped = spares.fill()
+        self.assertEqual(2, len(created))
+        self.assertEqual(2, len(dropped))
+        self.assertEqual(created, spares.spare_schemata())
+
+    @override_settings(BOARDINGHOUSE_SPARE_SCHEMATA=0)
+    def test_spares_not_used_when_disabled(self):
+        spares.fill(1)
+        Schema.objects.mass_create('a')
+        self.assertEqual(1, len(spares.spare_schemata()))
+
+    def test_fill_spare_schemata_command(self):
+        out = six.StringIO()
+        call_command('fill_spare_schemata', size=1, stdout=out)
+        self.assertEqual('Created 1 spare schemata.\n', out.getvalue())
+        self.assertEqual(1, len(spares.spare_schemata()))
+
+    @override_settings(BOARDINGHOUSE_SPARE_PREFIX='spare_')
+    def test_spare_prefix_must_start_with_underscore(self):
+        errors = apps.check_spare_prefix_starts_with_underscore()
+        self.assertEqual(1, len(errors))
+        self.assertEqual('boardinghouse.E005', errors[0].id)
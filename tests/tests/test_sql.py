@@ -2,9 +2,22 @@
 Tests for the RAW sql functions.
 """
 
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import threading
+
+import sqlparse
+
 from django.test import TestCase
 from django.db import connection
 
+from boardinghouse.backends.postgres import schema
+from boardinghouse.backends.postgres.schema import (
+    can_apply_to_multiple_schemata, classify_sql, classify_statement,
+)
 from boardinghouse.models import Schema
 
 
@@ -14,3 +27,81 @@ class TestRejectSchemaColumnChange(TestCase):
         cursor = connection.cursor()
         UPDATE = "UPDATE boardinghouse_schema SET schema='foo' WHERE schema='a'"
         self.assertRaises(Exception, cursor.execute, UPDATE)
+
+
+class TestClassifySQL(TestCase):
+    STATEMENTS = [
+        'CREATE TABLE "a" ("id" serial NOT NULL PRIMARY KEY)',
+        'ALTER TABLE "foo"."a" ADD COLUMN "b" integer DEFAULT 1 NOT NULL',
+        'DROP TABLE "a" CASCADE',
+        'CREATE UNIQUE INDEX "a_b_uniq" ON "a" ("b", "c")',
+        'DROP INDEX IF EXISTS "a_b_idx"',
+        'INSERT INTO "a" ("b") VALUES (1)',
+        'UPDATE tests_awaremodel SET name = %s',
+        'DELETE FROM "a" WHERE "b" = 1',
+        'CREATE SCHEMA foo',
+        'CREATE VIEW "a" AS (SELECT 1)',
+        'SET CONSTRAINTS "a_b_fk" IMMEDIATE; ALTER TABLE "a" DISABLE TRIGGER ALL',
+        'CREATE TABLE "a" ("id" serial NOT NULL PRIMARY KEY, '
+        '"b_id" integer NOT NULL REFERENCES "b" ("id") DEFERRABLE INITIALLY DEFERRED)',
+        'ALTER TABLE "a" ADD CONSTRAINT "a_b_id_fk_b_id" FOREIGN KEY ("b_id") '
+        'REFERENCES "b" ("id") DEFERRABLE INITIALLY DEFERRED',
+        'ALTER TABLE "a" ADD CONSTRAINT "a_b_id_fk_public_b_id" FOREIGN KEY ("b_id") '
+        'REFERENCES "public"."b" ("id") DEFERRABLE INITIALLY DEFERRED',
+        'ALTER TABLE "a" DROP CONSTRAINT "a_b_id_fk_b_id"',
+    ]
+
+    def test_fast_classification_matches_sqlparse(self):
+        for sql in self.STATEMENTS:
+            self.assertEqual(
+                tuple(classify_statement(statement) for statement in sqlparse.parse(sql)),
+                classify_sql(sql),
+                sql
+            )
+
+    def test_common_statements_are_not_parsed(self):
+        with patch('sqlparse.parse') as parse:
+            self.assertEqual((('a', 'foo'),), classify_sql('ALTER TABLE "foo"."a" ADD COLUMN "c" text'))
+            self.assertEqual((('a', None),), classify_sql('CREATE INDEX "a_c_idx" ON "a" ("c")'))
+        self.assertFalse(parse.called)
+
+    def test_foreign_keys_are_classified_by_their_table(self):
+        with patch('sqlparse.parse') as parse:
+            for sql in self.STATEMENTS[-4:]:
+                self.assertEqual((('a', None),), classify_sql(sql), sql)
+        self.assertFalse(parse.called)
+
+    def test_classification_from_threads(self):
+        errors = []
+
+        def classify(n):
+            try:
+                for i in range(200):
+                    classify_sql('CREATE VIEW "a{0}" AS (SELECT {1})'.format(n, i % 20))
+            except Exception as exc:
+                errors.append(exc)
+
+        with patch.object(schema, 'CLASSIFIED_CACHE_SIZE', 10):
+            threads = [threading.Thread(target=classify, args=(n,)) for n in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual([], errors)
+        self.assertLessEqual(len(schema._classified), 10)
+
+    def test_classification_is_remembered(self):
+        sql = 'CREATE VIEW "a" AS (SELECT 2)'
+        classify_sql(sql)
+        with patch('sqlparse.parse') as parse:
+            classify_sql(sql)
+        self.assertFalse(parse.called)
+
+    def test_dropped_index_is_looked_up(self):
+        match, = classify_sql('DROP INDEX IF EXISTS "boardinghouse_schema_name_key"')
+        self.assertEqual('boardinghouse_schema_name_key', match)
+
+        cursor = connection.cursor()
+        self.assertFalse(can_apply_to_multiple_schemata('DROP INDEX IF EXISTS "boardinghouse_schema_name_key"', cursor))
+        self.assertTrue(can_apply_to_multiple_schemata('DROP INDEX IF EXISTS "tests_awaremodel_pkey"', cursor))
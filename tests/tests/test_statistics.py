@@ -0,0 +1,89 @@
+import unittest
+
+import django
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import six
+try:
+    from django.urls import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+
+from boardinghouse.models import Schema, SchemaStatistics
+from boardinghouse.schema import activate_schema, deactivate_schema
+
+from ..models import AwareModel
+
+
+class TestStatistics(TestCase):
+    def setUp(self):
+        Schema.objects.mass_create('a', 'b')
+        activate_schema('a')
+        AwareModel.objects.bulk_create([AwareModel(name=str(i), factor=1) for i in range(50)])
+        deactivate_schema()
+        connection.cursor().execute('ANALYZE a.tests_awaremodel')
+
+    def test_statistics_are_collected_for_every_schema(self):
+        a, b = Schema.objects.order_by('schema').collect_statistics()
+
+        self.assertEqual(['a', 'b'], [a.schema, b.schema])
+        self.assertEqual(50, a.row_estimate)
+        self.assertEqual(0, b.row_estimate)
+        self.assertEqual(a.tables, b.tables)
+        self.assertGreater(a.table_size, b.table_size)
+        self.assertGreater(a.index_size, 0)
+        if connection.pg_version >= 100000:
+            self.assertEqual(50, a.sequence_value)
+            self.assertIsNone(b.sequence_value)
+
+        self.assertEqual(2, SchemaStatistics.objects.count())
+
+    def test_statistics_are_replaced(self):
+        schema = Schema.objects.get(schema='a')
+        self.assertIsNone(schema.statistics)
+
+        first = schema.collect_statistics()
+        second = schema.collect_statistics()
+        self.assertEqual(1, SchemaStatistics.objects.count())
+        self.assertEqual(second.collected, schema.statistics.collected)
+        self.assertGreaterEqual(second.collected, first.collected)
+
+    def test_collect_uses_one_query_for_all_schemata(self):
+        with CaptureQueriesContext(connection) as queries:
+            Schema.objects.collect_statistics()
+        self.assertEqual(1, len([query for query in queries if 'pg_class' in query['sql']]))
+
+    @unittest.skipIf(django.VERSION < (1, 11), 'Subquery needs Django 1.11')
+    def test_with_statistics(self):
+        Schema.objects.filter(schema='a').collect_statistics()
+        schemata = Schema.objects.with_statistics().order_by(F('total_size').desc(nulls_last=True))
+        a, b = schemata
+        self.assertEqual('a', a.schema)
+        self.assertEqual(50, a.row_estimate)
+        self.assertEqual(a.statistics.total_size, a.total_size)
+        self.assertIsNone(b.total_size)
+
+    def test_schema_statistics_command(self):
+        out = six.StringIO()
+        call_command('schema_statistics', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(['a', '50'], lines[1].split()[:2])
+
+        out = six.StringIO()
+        call_command('schema_statistics', 'b', cached=True, stdout=out)
+        self.assertEqual(2, len(out.getvalue().splitlines()))
+
+    @unittest.skipIf(django.VERSION < (1, 11), 'Subquery needs Django 1.11')
+    def test_admin_changelist_sorts_by_size(self):
+        Schema.objects.collect_statistics()
+        User.objects.create_superuser(username='su', password='su', email='su@example.com')
+        self.client.login(username='su', password='su')
+
+        response = self.client.get(reverse('admin:boardinghouse_schema_changelist'), {'o': '-3'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['a', 'b'], [schema.schema for schema in response.context['cl'].result_list])
@@ -1,9 +1,25 @@
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.core.cache import cache
 
-from boardinghouse.models import Schema
-from boardinghouse.schema import get_active_schemata
+from boardinghouse.models import SCHEMATA_GENERATION_KEY, Schema, visible_schemata_cache_key
+from boardinghouse.schema import get_active_schemata, SCHEMATA_CACHE_VERSION
+
+
+def cached_rows(user):
+    """
+    The visible schemata cached for the user, if they are still current.
+    """
+    cached = cache.get(visible_schemata_cache_key(user.pk))
+    if cached is not None and cached[3] == cache.get(SCHEMATA_GENERATION_KEY):
+        return list(cached[2])
 
 
 class TestUserSchemataCache(TestCase):
@@ -14,10 +30,10 @@ class TestUserSchemataCache(TestCase):
         user = User.objects.get(username='a')
         self.assertEqual(0, len(user.visible_schemata))
 
-        self.assertEqual([], list(cache.get('visible-schemata-{0!s}'.format(user.pk))))
+        self.assertEqual([], cached_rows(user))
 
         user.schemata.add(Schema.objects.get(schema='a'))
-        self.assertEqual(None, cache.get('visible-schemata-{0!s}'.format(user.pk)))
+        self.assertEqual(None, cached_rows(user))
 
     def test_removing_schema_from_user_clears_cache(self):
         User.objects.create_user(username='a', email='a@example.com', password='a')
@@ -29,7 +45,7 @@ class TestUserSchemataCache(TestCase):
         self.assertEqual(3, len(user.visible_schemata))
 
         user.schemata.remove(Schema.objects.get(schema='a'))
-        self.assertEqual(None, cache.get('visible-schemata-{0!s}'.format(user.pk)))
+        self.assertEqual(None, cached_rows(user))
 
     def test_adding_users_to_schema_clears_cache(self):
         User.objects.create_user(username='a', email='a@example.com', password='a')
@@ -38,12 +54,12 @@ class TestUserSchemataCache(TestCase):
         user = User.objects.get(username='a')
 
         self.assertEqual(0, len(user.visible_schemata))
-        self.assertEqual([], list(cache.get('visible-schemata-{0!s}'.format(user.pk))))
+        self.assertEqual([], cached_rows(user))
 
         schema = Schema.objects.get(schema='a')
         schema.users.add(user)
 
-        self.assertEqual(None, cache.get('visible-schemata-{0!s}'.format(user.pk)))
+        self.assertEqual(None, cached_rows(user))
 
     def test_removing_users_from_schema_clears_cache(self):
         User.objects.create_user(username='a', email='a@example.com', password='a')
@@ -56,7 +72,7 @@ class TestUserSchemataCache(TestCase):
         schema = Schema.objects.get(schema='a')
         schema.users.remove(user)
 
-        self.assertEqual(None, cache.get('visible-schemata-{0!s}'.format(user.pk)))
+        self.assertEqual(None, cached_rows(user))
 
     def test_saving_schema_clears_cache_for_related_users(self):
         User.objects.create_user(username='a', email='a@example.com', password='a')
@@ -69,7 +85,7 @@ class TestUserSchemataCache(TestCase):
 
         Schema.objects.get(schema='a').save()
 
-        self.assertEqual(None, cache.get('visible-schemata-{0!s}'.format(user.pk)))
+        self.assertEqual(None, cached_rows(user))
 
     def test_saving_schema_clears_global_active_schemata_cache(self):
         Schema.objects.mass_create('a', 'b', 'c')
@@ -82,3 +98,87 @@ class TestUserSchemataCache(TestCase):
         schema.save()
 
         self.assertEqual(None, cache.get('active-schemata'))
+
+    def test_cached_schemata_are_values_only(self):
+        User.objects.create_user(username='a', email='a@example.com', password='a')
+        Schema.objects.mass_create('a', 'b', 'c')
+
+        user = User.objects.get(username='a')
+        user.schemata.add(*Schema.objects.filter(schema__in=['a', 'b']))
+        self.assertEqual(2, len(user.visible_schemata))
+
+        version, field_names, rows, generation = cache.get(visible_schemata_cache_key(user.pk))
+        self.assertEqual(SCHEMATA_CACHE_VERSION, version)
+        self.assertEqual([('a', 'a', True), ('b', 'b', True)], sorted(rows))
+        self.assertEqual(('schema', 'name', 'is_active'), field_names)
+
+        with self.assertNumQueries(0):
+            schemata = user.visible_schemata
+            self.assertEqual(['a', 'b'], sorted(schema.schema for schema in schemata))
+            self.assertEqual([True, True], [schema.is_active for schema in schemata])
+        self.assertIn(Schema.objects.get(schema='a'), schemata)
+
+        # It is still a queryset.
+        self.assertTrue(schemata.filter(schema='a').exists())
+        self.assertEqual('b', schemata.get(schema='b').schema)
+
+    def test_stale_cached_value_is_ignored(self):
+        Schema.objects.mass_create('a', 'b', 'c')
+        cache.set('active-schemata', Schema.objects.all())
+
+        self.assertEqual(['a', 'b', 'c'], sorted(schema.schema for schema in get_active_schemata()))
+
+    def test_saving_schema_is_a_single_cache_operation(self):
+        Schema.objects.mass_create('a')
+        schema = Schema.objects.get(schema='a')
+        users = [
+            User.objects.create_user(username=name, email='{0}@example.com'.format(name), password=name)
+            for name in ['a', 'b', 'c']
+        ]
+        schema.users.add(*users)
+        for user in users:
+            self.assertEqual(1, len(user.visible_schemata))
+
+        with CaptureQueriesContext(connection) as queries:
+            schema.save()
+        self.assertFalse([query for query in queries.captured_queries if 'auth_user' in query['sql']])
+
+        for user in users:
+            self.assertEqual(None, cached_rows(user))
+
+    def test_clearing_schema_users_clears_cache(self):
+        User.objects.create_user(username='a', email='a@example.com', password='a')
+        Schema.objects.mass_create('a')
+
+        user = User.objects.get(username='a')
+        schema = Schema.objects.get(schema='a')
+        schema.users.add(user)
+        self.assertEqual(1, len(user.visible_schemata))
+
+        schema.users.clear()
+        self.assertEqual(None, cached_rows(user))
+        self.assertEqual(0, len(user.visible_schemata))
+
+    def test_cached_visible_schemata_are_a_single_cache_operation(self):
+        User.objects.create_user(username='a', email='a@example.com', password='a')
+        Schema.objects.mass_create('a')
+        user = User.objects.get(username='a')
+        user.schemata.add(Schema.objects.get(schema='a'))
+        self.assertEqual(1, len(user.visible_schemata))
+
+        with patch('boardinghouse.schema.cache', wraps=cache) as mock_cache:
+            with self.assertNumQueries(0):
+                self.assertEqual(['a'], [schema.schema for schema in user.visible_schemata])
+        self.assertEqual(['get_many'], [name for (name, args, kwargs) in mock_cache.method_calls])
+
+    def test_membership_changes_only_invalidate_once_made(self):
+        User.objects.create_user(username='a', email='a@example.com', password='a')
+        Schema.objects.mass_create('a')
+        user = User.objects.get(username='a')
+        schema = Schema.objects.get(schema='a')
+
+        with patch('boardinghouse.receivers.invalidate_visible_schemata') as invalidate:
+            user.schemata.add(schema)
+            schema.users.remove(user)
+            schema.users.clear()
+        self.assertEqual(3, invalidate.call_count)
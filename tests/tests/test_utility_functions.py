@@ -3,11 +3,13 @@ try:
 except ImportError:
     from mock import patch
 
+from django.apps import apps
 from django.test import TestCase, override_settings
-from django.db import connection
+from django.db import connection, migrations
+from django.db.migrations.state import ProjectState
 
 from boardinghouse.schema import (
-    is_shared_model, is_shared_table,
+    is_shared_model, is_shared_table, _table_maps,
     activate_template_schema, deactivate_schema,
 )
 
@@ -70,6 +72,35 @@ class TestIsSharedTable(TestCase):
     def test_prefix_clash(self):
         self.assertFalse(is_shared_table('tests_modelb'))
 
+    def test_explicit_apps(self):
+        state_apps = ProjectState.from_apps(apps).apps
+        self.assertFalse(is_shared_table(AwareModel._meta.db_table, apps=state_apps))
+        self.assertTrue(is_shared_table(NaiveModel._meta.db_table, apps=state_apps))
+        self.assertTrue(is_shared_table('boardinghouse_schema_users', apps=state_apps))
+
+    def test_table_maps_are_remembered(self):
+        is_shared_table(AwareModel._meta.db_table)
+        self.assertIn(apps, _table_maps)
+
+    def test_table_maps_are_forgotten_when_settings_change(self):
+        is_shared_table(AwareModel._meta.db_table)
+        with override_settings(SHARED_MODELS=['tests.awaremodel']):
+            self.assertNotIn(apps, _table_maps)
+            self.assertTrue(is_shared_table(AwareModel._meta.db_table))
+        self.assertNotIn(apps, _table_maps)
+        self.assertFalse(is_shared_table(AwareModel._meta.db_table))
+
+    def test_migration_state_is_used(self):
+        results = []
+
+        class Operation(migrations.RunSQL):
+            def database_forwards(self, app_label, schema_editor, from_state, to_state):
+                results.append(is_shared_table(NaiveModel._meta.db_table))
+
+        # The (empty) migration state does not know about NaiveModel.
+        Operation('').database_forwards('tests', None, ProjectState(), ProjectState())
+        self.assertEqual([False], results)
+
 
 class TestTemplateSchemaActivation(TestCase):
     @override_settings(TEMPLATE_SCHEMA='__template_schema__')
@@ -82,3 +113,21 @@ class TestTemplateSchemaActivation(TestCase):
             deactivate_schema()
             connection.creation.deserialize_db_from_string('[]')
             activate_template_schema.assert_called_once_with()
+
+
+class TestSearchPath(TestCase):
+    def tearDown(self):
+        deactivate_schema()
+
+    def test_public_schema_is_quoted(self):
+        cursor = connection.cursor()
+        cursor.execute('CREATE SCHEMA "Shared Schema"')
+
+        with override_settings(PUBLIC_SCHEMA='Shared Schema'):
+            activate_template_schema()
+            cursor.execute('SHOW search_path')
+            self.assertEqual('__template__,"Shared Schema"', cursor.fetchone()[0])
+
+            deactivate_schema()
+            cursor.execute('SHOW search_path')
+            self.assertEqual('"$user", "Shared Schema"', cursor.fetchone()[0])